@@ -0,0 +1,158 @@
+"""
+In-process load benchmark for the payments API
+
+Drives the FastAPI app through httpx.ASGITransport (no sockets), so the
+numbers cover routing, validation, the processor and serialization.
+Each scenario runs at every combination of store size and concurrency,
+and reports throughput and p50/p95/p99 latency.
+
+Usage:
+    python -m benchmarks.api_bench --requests 2000 \\
+        --store-sizes 0 10000 100000 --concurrency 1 16 64 \\
+        --save baseline.json
+    python -m benchmarks.api_bench --compare baseline.json --threshold 0.15
+"""
+import argparse
+import asyncio
+import itertools
+import sys
+import time
+from typing import Callable, Dict, List
+
+import httpx
+
+from src.main import app
+from src.routes import payments
+from src.services.auth import TokenVerifier
+from src.services.payment_processor import PaymentProcessor
+from src.services.response_cache import make_etag
+
+from .stats import compare_to_baseline, save_baseline, summarize
+
+VERIFIER = TokenVerifier("benchmark-secret")
+AUTH_HEADERS = {"Authorization": "Bearer " + VERIFIER.sign({"sub": "benchmark"}, ttl=24 * 3600)}
+SCENARIOS = ("charge", "refund", "get_charge", "order_charges", "order_charges_304")
+
+
+def charge_body(i: int) -> dict:
+    return {
+        "order_id": f"order-{i % 5000}",
+        "amount": 100.00,
+        "currency": "USD",
+        "customer_id": f"cust-{i % 1000}",
+        "payment_method": "card",
+    }
+
+
+async def fill_store(size: int) -> List[str]:
+    """Swap in a fresh processor holding `size` charges; return their IDs."""
+    processor = PaymentProcessor()
+    payments.payment_processor = processor
+    ids = []
+    for i in range(size):
+        charge = await processor.charge(**charge_body(i))
+        ids.append(charge.id)
+    return ids
+
+
+def make_request(scenario: str, ids: List[str]) -> Callable[[httpx.AsyncClient, int], object]:
+    if scenario == "charge":
+        return lambda client, i: client.post("/api/payments/charge", json=charge_body(i), headers=AUTH_HEADERS)
+    if scenario == "refund":
+        return lambda client, i: client.post(
+            "/api/payments/refund",
+            json={"charge_id": ids[i % len(ids)], "amount": 0.01},
+            headers=AUTH_HEADERS
+        )
+    if scenario == "get_charge":
+        return lambda client, i: client.get(f"/api/payments/charges/{ids[i % len(ids)]}", headers=AUTH_HEADERS)
+    if scenario == "order_charges":
+        return lambda client, i: client.get(
+            f"/api/payments/orders/order-{i % 5000}/charges?limit=20", headers=AUTH_HEADERS
+        )
+    if scenario == "order_charges_304":
+        # A poller that already has the current version of the order
+        return lambda client, i: client.get(
+            f"/api/payments/orders/order-{i % 5000}/charges?limit=20",
+            headers={
+                **AUTH_HEADERS,
+                "If-None-Match": make_etag(payments.payment_processor.order_version(f"order-{i % 5000}"))
+            }
+        )
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+async def run_case(scenario: str, store_size: int, concurrency: int, requests: int) -> dict:
+    # Lookups and refunds need something to look up
+    ids = await fill_store(max(store_size, 1) if scenario in ("refund", "get_charge") else store_size)
+    request = make_request(scenario, ids)
+    latencies: List[float] = []
+    failures = 0
+    counter = itertools.count()
+    
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker() -> None:
+            nonlocal failures
+            while True:
+                i = next(counter)
+                if i >= requests:
+                    return
+                start = time.perf_counter()
+                response = await request(client, i)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    failures += 1
+        
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    
+    result = summarize(latencies, elapsed)
+    result["failures"] = failures
+    return result
+
+
+async def main(args: argparse.Namespace) -> int:
+    # Every benchmark request comes from one client; measure the data
+    # path, not the rate limiter
+    payments.client_rate_limiter = None
+    payments.customer_rate_limiter = None
+    payments.token_verifier = VERIFIER
+    results: Dict[str, dict] = {}
+    print(f"{'case':<40} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'fail':>5}")
+    for scenario, store_size, concurrency in itertools.product(
+        args.scenarios, args.store_sizes, args.concurrency
+    ):
+        name = f"{scenario}/store={store_size}/c={concurrency}"
+        result = await run_case(scenario, store_size, concurrency, args.requests)
+        results[name] = result
+        print(
+            f"{name:<40} {result['throughput']:>9.0f} {result['p50_ms']:>8.3f} "
+            f"{result['p95_ms']:>8.3f} {result['p99_ms']:>8.3f} {result['failures']:>5}"
+        )
+    
+    if args.save:
+        save_baseline(args.save, results)
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        regressions = compare_to_baseline(args.compare, results, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Payments API load benchmark")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per case")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("--store-sizes", type=int, nargs="+", default=[0, 10000, 100000])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--save", help="Write results to this JSON baseline file")
+    parser.add_argument("--compare", help="Compare results to this JSON baseline file")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="Allowed relative regression before failing")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,82 @@
+"""
+Gateway client load test against the stub gateway
+
+Runs charges through PaymentGateway and reports throughput and latency
+percentiles. By default the stub gateway runs in-process; pass --url to
+target a stub started with `python -m src.services.stub_gateway`.
+
+Usage:
+    python -m benchmarks.gateway_bench --calls 2000 --concurrency 100 \\
+        --latency-ms 20 --jitter-ms 80 --error-rate 0.02 --hedge-after-ms 50
+"""
+import argparse
+import asyncio
+import time
+from typing import List, Optional
+
+import httpx
+
+from src.services.gateway import CircuitBreaker, GatewayError, PaymentGateway
+from src.services.stub_gateway import create_stub_gateway
+
+from .stats import summarize
+
+
+async def main(args: argparse.Namespace) -> None:
+    transport: Optional[httpx.AsyncBaseTransport] = None
+    base_url = args.url
+    if base_url is None:
+        stub = create_stub_gateway(args.latency_ms, args.jitter_ms, args.error_rate, seed=1)
+        transport = httpx.ASGITransport(app=stub)
+        base_url = "http://stub-gateway"
+    
+    gateway = PaymentGateway(
+        base_url,
+        timeout=args.timeout,
+        max_retries=args.retries,
+        hedge_after=args.hedge_after_ms / 1000 if args.hedge_after_ms else None,
+        # Keep the breaker out of the way; this measures the data path
+        breaker=CircuitBreaker(failure_threshold=args.calls + 1),
+        max_connections=args.concurrency,
+        transport=transport
+    )
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: List[float] = []
+    errors = 0
+    
+    async def one(i: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await gateway.charge({"reference": f"bench-{i}", "amount": 10.0, "currency": "USD"})
+            except GatewayError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.calls)))
+    elapsed = time.perf_counter() - start
+    await gateway.close()
+    
+    print(f"{args.calls} calls, concurrency {args.concurrency}, "
+          f"hedge {'off' if not args.hedge_after_ms else f'{args.hedge_after_ms}ms'}")
+    summary = summarize(latencies, elapsed)
+    print(f"  throughput  {summary['throughput']:>10.0f} calls/sec")
+    print(f"  errors      {errors:>10d}")
+    for key in ("mean", "p50", "p95", "p99"):
+        print(f"  {key:<11} {summary[key + '_ms']:>10.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gateway client load test")
+    parser.add_argument("--url", default=None, help="Base URL of a running stub gateway")
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=10.0)
+    parser.add_argument("--jitter-ms", type=float, default=40.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=5.0)
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--hedge-after-ms", type=float, default=0.0)
+    asyncio.run(main(parser.parse_args()))
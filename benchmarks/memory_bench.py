@@ -0,0 +1,84 @@
+"""
+Memory per charge: dict records vs compact ChargeRecord
+
+Builds N charges in each representation, the way PaymentProcessor holds
+them (keyed by ID), and reports traced memory per charge. 10M dict
+charges need several GB of RAM; use --sizes to pick smaller runs.
+
+Usage:
+    python -m benchmarks.memory_bench --sizes 1000000 10000000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from typing import Callable, Dict
+
+from src.services.records import ChargeRecord
+from src.utils.money import to_minor_units
+
+CURRENCIES = ["USD", "EUR", "GBP", "JPY"]
+METHODS = ["card", "bank_transfer", "paypal", "apple_pay", "google_pay"]
+
+
+def make_dict(i: int) -> dict:
+    currency = CURRENCIES[i % len(CURRENCIES)]
+    # Build fresh strings, as request parsing would, so dicts don't get
+    # interning for free
+    return {
+        "id": f"ch_{uuid.uuid4().hex[:16]}",
+        "order_id": f"order-{i}",
+        "amount": 10.0 + i % 1000 / 100,
+        "currency": "".join(currency),
+        "customer_id": f"cust-{i % 100000}",
+        "payment_method": "".join(METHODS[i % len(METHODS)]),
+        "status": "".join("succeeded"),
+        "created_at": datetime.utcnow().isoformat(),
+    }
+
+
+def make_record(i: int) -> ChargeRecord:
+    currency = CURRENCIES[i % len(CURRENCIES)]
+    return ChargeRecord(
+        id=f"ch_{uuid.uuid4().hex[:16]}",
+        order_id=f"order-{i}",
+        amount_minor=to_minor_units(10.0 + i % 1000 / 100, currency),
+        currency="".join(currency),
+        customer_id=f"cust-{i % 100000}",
+        payment_method="".join(METHODS[i % len(METHODS)]),
+        status="".join("succeeded"),
+        created_at=time.time(),
+    )
+
+
+def measure(factory: Callable[[int], object], size: int) -> float:
+    """Return traced bytes per charge for `size` charges built by `factory`."""
+    gc.collect()
+    tracemalloc.start()
+    store: Dict[str, object] = {}
+    for i in range(size):
+        charge = factory(i)
+        key = charge["id"] if isinstance(charge, dict) else charge.id
+        store[key] = charge
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del store
+    gc.collect()
+    return current / size
+
+
+def main(sizes) -> None:
+    print(f"{'charges':>12} {'dict B/charge':>15} {'record B/charge':>17} {'saving':>8}")
+    for size in sizes:
+        dict_bytes = measure(make_dict, size)
+        record_bytes = measure(make_record, size)
+        saving = 1 - record_bytes / dict_bytes
+        print(f"{size:>12,} {dict_bytes:>15.0f} {record_bytes:>17.0f} {saving:>7.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory per charge benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000000, 10000000])
+    main(parser.parse_args().sizes)
@@ -0,0 +1,67 @@
+"""
+Cost of request metrics
+
+Calls a minimal ASGI app directly, with and without MetricsMiddleware,
+and reports the added time per request. Also times Histogram.observe.
+
+Usage:
+    python -m benchmarks.metrics_bench --requests 200000
+"""
+import argparse
+import asyncio
+import time
+
+from src.middleware.metrics import MetricsMiddleware
+from src.utils.metrics import Histogram, MetricsRegistry
+
+
+class _Route:
+    path = "/api/payments/charges/{charge_id}"
+
+
+async def bare_app(scope, receive, send):
+    scope["route"] = _Route
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def receive():
+    return {"type": "http.request", "body": b""}
+
+
+async def send(message):
+    pass
+
+
+async def time_app(app, requests: int) -> float:
+    """Return seconds per request for `requests` sequential calls."""
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app({"type": "http", "method": "GET", "path": "/x"}, receive, send)
+    return (time.perf_counter() - start) / requests
+
+
+async def main(requests: int) -> None:
+    base = await time_app(bare_app, requests)
+    wrapped = await time_app(MetricsMiddleware(bare_app, MetricsRegistry()), requests)
+    
+    histogram = Histogram()
+    start = time.perf_counter()
+    for i in range(requests):
+        histogram.observe(i * 1e-7)
+    observe = (time.perf_counter() - start) / requests
+    
+    print(f"{requests} requests")
+    for label, seconds, unit in (
+        ("bare ASGI app", base, "request"),
+        ("with MetricsMiddleware", wrapped, "request"),
+        ("added cost", wrapped - base, "request"),
+        ("Histogram.observe", observe, "call"),
+    ):
+        print(f"  {label:<24}{seconds * 1e9:>8.0f} ns/{unit}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Request metrics overhead benchmark")
+    parser.add_argument("--requests", type=int, default=200000)
+    asyncio.run(main(parser.parse_args().requests))
@@ -0,0 +1,74 @@
+"""
+Micro-benchmarks for hot utility functions
+
+Usage:
+    python -m benchmarks.micro_bench --save micro.json
+    python -m benchmarks.micro_bench --compare micro.json --threshold 0.15
+"""
+import argparse
+import sys
+import timeit
+import uuid
+from typing import Callable, Dict
+
+from src.services.auth import TokenVerifier
+from src.utils.formatting import format_payment_amount
+from src.utils.ids import IdGenerator
+from src.utils.validation import validate_order_total
+
+from .stats import compare_to_baseline, save_baseline
+
+_ids = IdGenerator(0)
+# Cold: every call checks the signature; warm: the claims come from the cache
+_cold_verifier = TokenVerifier("benchmark-secret", cache_size=0)
+_warm_verifier = TokenVerifier("benchmark-secret")
+_token = _warm_verifier.sign({"sub": "benchmark", "scope": "payments"}, ttl=24 * 3600)
+
+CASES: Dict[str, Callable[[], object]] = {
+    "validate_order_total/valid": lambda: validate_order_total(99.99),
+    "validate_order_total/negative": lambda: validate_order_total(-1.0),
+    "validate_order_total/non_number": lambda: validate_order_total("100"),
+    "format_payment_amount/usd": lambda: format_payment_amount(99.99, "USD"),
+    "format_payment_amount/unknown": lambda: format_payment_amount(99.99, "XYZ"),
+    "charge_id/uuid4": lambda: f"ch_{uuid.uuid4().hex[:16]}",
+    "charge_id/id_generator": lambda: _ids.new_id("ch"),
+    "verify_token/cold": lambda: _cold_verifier.verify(_token),
+    "verify_token/warm": lambda: _warm_verifier.verify(_token),
+}
+
+
+def measure(func: Callable[[], object], number: int, repeat: int) -> float:
+    """Best-of-`repeat` nanoseconds per call."""
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def main(args: argparse.Namespace) -> int:
+    results = {}
+    for name, func in CASES.items():
+        ns = measure(func, args.number, args.repeat)
+        results[name] = {"ns_per_call": ns}
+        print(f"{name:<36} {ns:>8.1f} ns/call")
+    
+    if args.save:
+        save_baseline(args.save, results)
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        regressions = compare_to_baseline(args.compare, results, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Utility micro-benchmarks")
+    parser.add_argument("--number", type=int, default=200000, help="Calls per timing run")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing runs; the best is kept")
+    parser.add_argument("--save", help="Write results to this JSON baseline file")
+    parser.add_argument("--compare", help="Compare results to this JSON baseline file")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="Allowed relative regression before failing")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,144 @@
+"""
+Overload benchmark for admission control
+
+Offers open-loop traffic (arrivals don't wait for earlier responses)
+above the service's capacity, through httpx.ASGITransport, with and
+without the admission controller. Capacity comes from the gateway: the
+stub gateway runs in-process and serves a fixed number of calls at
+once, so charges past its throughput wait for it. A response only
+counts toward goodput if it succeeds within the client's deadline;
+charges and lookups are reported separately.
+
+Usage:
+    python -m benchmarks.overload_bench --rate 600 --seconds 8 \\
+        --write-share 0.5 --gateway-capacity 4 --latency-ms 20 --deadline-ms 1000
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from src.main import app
+from src.routes import payments
+from src.services.admission import AdmissionController, GradientLimit
+from src.services.gateway import CircuitBreaker, PaymentGateway
+from src.services.payment_processor import PaymentProcessor
+from src.services.stub_gateway import create_stub_gateway
+
+from .api_bench import AUTH_HEADERS, VERIFIER, charge_body
+from .stats import summarize
+
+
+def limit_concurrency(stub, capacity: int):
+    """Wrap an ASGI app so it serves at most `capacity` requests at once."""
+    semaphore = asyncio.Semaphore(capacity)
+    
+    async def limited(scope, receive, send):
+        async with semaphore:
+            await stub(scope, receive, send)
+    return limited
+
+
+async def run(args: argparse.Namespace, controller: Optional[AdmissionController]) -> Dict[str, dict]:
+    stub = create_stub_gateway(args.latency_ms, args.jitter_ms, seed=1)
+    gateway = PaymentGateway(
+        "http://stub-gateway",
+        timeout=60.0,
+        max_retries=0,
+        breaker=CircuitBreaker(failure_threshold=1 << 30),
+        transport=httpx.ASGITransport(app=limit_concurrency(stub, args.gateway_capacity))
+    )
+    processor = PaymentProcessor(gateway=gateway)
+    ids = [charge.id for charge in await asyncio.gather(*(processor.charge(**charge_body(i)) for i in range(1000)))]
+    payments.payment_processor = processor
+    payments.admission_controller = controller
+    
+    deadline = args.deadline_ms / 1000
+    outcomes: Dict[str, Dict[str, List[float]]] = {
+        kind: {"ok": [], "late": [], "shed": [], "failed": []} for kind in ("charge", "lookup")
+    }
+    rng = random.Random(1)
+    counter = itertools.count()
+    
+    async def one(client: httpx.AsyncClient, kind: str, arrival: float) -> None:
+        i = next(counter)
+        if kind == "charge":
+            response = await client.post("/api/payments/charge", json=charge_body(i), headers=AUTH_HEADERS)
+        else:
+            response = await client.get(f"/api/payments/charges/{ids[i % len(ids)]}", headers=AUTH_HEADERS)
+        # From the scheduled arrival, so time spent waiting for the event loop counts
+        latency = time.perf_counter() - arrival
+        if response.status_code == 503:
+            outcome = "shed"
+        elif response.status_code >= 400:
+            outcome = "failed"
+        else:
+            outcome = "ok" if latency <= deadline else "late"
+        outcomes[kind][outcome].append(latency)
+    
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        tasks = []
+        total = int(args.rate * args.seconds)
+        start = time.perf_counter()
+        for n in range(total):
+            # Hold the schedule of arrivals regardless of how the service keeps up
+            arrival = start + n / args.rate
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            kind = "charge" if rng.random() < args.write_share else "lookup"
+            tasks.append(asyncio.ensure_future(one(client, kind, arrival)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    await gateway.close()
+    
+    results = {}
+    for kind, by_outcome in outcomes.items():
+        counts = {outcome: len(latencies) for outcome, latencies in by_outcome.items()}
+        result = {"goodput": counts["ok"] / elapsed, **counts}
+        if by_outcome["ok"]:
+            result.update(summarize(by_outcome["ok"], elapsed))
+        results[kind] = result
+    return results
+
+
+async def main(args: argparse.Namespace) -> None:
+    payments.client_rate_limiter = None
+    payments.customer_rate_limiter = None
+    payments.token_verifier = VERIFIER
+    
+    offered = {"charge": args.rate * args.write_share, "lookup": args.rate * (1 - args.write_share)}
+    print(f"offered {args.rate:.0f} req/s ({offered['charge']:.0f} charges, {offered['lookup']:.0f} lookups), "
+          f"gateway capacity ~{args.gateway_capacity / (args.latency_ms + args.jitter_ms / 2) * 1000:.0f} "
+          f"calls/sec, deadline {args.deadline_ms:.0f} ms")
+    print(f"{'mode':<20} {'kind':<8} {'goodput/s':>10} {'ok':>7} {'late':>7} {'shed':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    modes = [
+        ("no admission", None),
+        ("admission", AdmissionController(
+            GradientLimit(initial=args.gateway_capacity, max_limit=500),
+            queue_timeout=args.queue_timeout_ms / 1000
+        )),
+    ]
+    for name, controller in modes:
+        results = await run(args, controller)
+        for kind, result in results.items():
+            print(f"{name:<20} {kind:<8} {result['goodput']:>10.0f} {result['ok']:>7} {result['late']:>7} "
+                  f"{result['shed']:>7} {result.get('p50_ms', 0):>8.1f} {result.get('p99_ms', 0):>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=600, help="offered requests per second")
+    parser.add_argument("--seconds", type=float, default=8)
+    parser.add_argument("--write-share", type=float, default=0.5, help="fraction of requests that are charges")
+    parser.add_argument("--gateway-capacity", type=int, default=4, help="gateway calls served at once")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--deadline-ms", type=float, default=1000.0, help="client deadline for a useful response")
+    parser.add_argument("--queue-timeout-ms", type=float, default=500.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,69 @@
+"""
+Settlement reconciliation benchmark
+
+Records charges in a PaymentProcessor, writes a settlement CSV for
+them with a sprinkling of discrepancies, and reconciles it in-process
+and across a process pool, reporting rows/sec and the parent's peak
+resident memory before and after.
+
+Usage:
+    python -m benchmarks.reconciliation_bench --charges 1000000 --workers 0 4
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from src.services.payment_processor import PaymentProcessor
+from src.services.reconciliation import build_ledger, reconcile
+
+from .tiering_bench import rss_mb
+
+
+async def make_ledger(charges: int):
+    processor = PaymentProcessor()
+    ids = []
+    for i in range(charges):
+        charge = await processor.charge(f"order-{i}", 10.0 + i % 100, "USD", f"cust-{i % 100000}", "card")
+        ids.append(charge.id)
+    return await build_ledger(processor), ids
+
+
+def write_settlement(path: str, ids, every: int = 1000) -> None:
+    with open(path, "w") as f:
+        f.write("reference,amount,currency,fee\n")
+        for i, charge_id in enumerate(ids):
+            if i % every == 0:
+                continue  # missing
+            amount = 10.0 + i % 100 + (0.01 if i % every == 1 else 0)
+            f.write(f"{charge_id},{amount:.2f},USD,0.30\n")
+        for i in range(len(ids) // every):
+            f.write(f"ch_extra{i:08x},1.00,USD,0.30\n")
+
+
+def main(args: argparse.Namespace) -> None:
+    ledger, ids = asyncio.run(make_ledger(args.charges))
+    print(f"{len(ledger):,} records, RSS {rss_mb():.0f} MB")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "settlement.csv")
+        write_settlement(path, ids)
+        del ids
+        print(f"settlement file {os.path.getsize(path) / 1e6:.0f} MB")
+        for workers in args.workers:
+            with open(path, "rb") as f:
+                start = time.perf_counter()
+                counts = reconcile(f, ledger, lambda discrepancy: None, workers=workers,
+                                   chunk_bytes=int(args.chunk_mb * 1024 * 1024))
+                elapsed = time.perf_counter() - start
+            label = "in process" if workers == 0 else f"{workers} workers"
+            print(f"{label:<12} {counts['rows'] / elapsed:>12,.0f} rows/sec  {elapsed:6.2f} s  "
+                  f"peak RSS {rss_mb('VmHWM'):.0f} MB  {counts}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--charges", type=int, default=1000000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, os.cpu_count() or 1])
+    parser.add_argument("--chunk-mb", type=float, default=8)
+    main(parser.parse_args())
@@ -0,0 +1,131 @@
+"""
+Crash recovery benchmark for the write-ahead log backend
+
+Builds two data directories holding the same records:
+- log only: every record in WAL segments, as if never snapshotted
+- snapshot + tail: a snapshot plus `--tail` records logged after it
+
+and times reading them back. By default only the records are decoded;
+--load also rebuilds a PaymentProcessor's indexes, which needs several
+GB of memory at 10M records.
+
+Usage:
+    python -m benchmarks.recovery_bench --records 10000000 --tail 10000
+    python -m benchmarks.recovery_bench --records 1000000 --load
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Iterator
+
+from src.services.payment_processor import PaymentProcessor
+from src.services.records import ChargeRecord, RefundRecord
+from src.services.wal import WALStorage, encode_frame, write_snapshot
+
+REFUND_EVERY = 10  # One refund per this many charges
+CHUNK = 10000
+
+
+def make_charges(start: int, stop: int) -> Iterator[ChargeRecord]:
+    for i in range(start, stop):
+        yield ChargeRecord(
+            id=f"ch_{i:016x}",
+            order_id=f"order-{i}",
+            amount_minor=1000 + i % 5000,
+            currency="USD" if i % 3 else "EUR",
+            customer_id=f"cust-{i % 10000}",
+            payment_method="card" if i % 4 else "bank_transfer",
+            status="succeeded",
+            created_at=1704067200.0 + i / 1000,
+        )
+
+
+def make_refunds(start: int, stop: int) -> Iterator[RefundRecord]:
+    for i in range(start - start % REFUND_EVERY, stop, REFUND_EVERY):
+        if i < start:
+            continue
+        yield RefundRecord(
+            id=f"re_{i:016x}",
+            charge_id=f"ch_{i:016x}",
+            amount_minor=500,
+            currency="USD" if i % 3 else "EUR",
+            reason=None,
+            status="succeeded",
+            created_at=1704067200.0 + i / 1000,
+        )
+
+
+def write_log(path: str, start: int, stop: int) -> None:
+    """Append records to a WAL segment directly, skipping the writer thread."""
+    with open(path, "ab") as f:
+        for chunk in range(start, stop, CHUNK):
+            end = min(chunk + CHUNK, stop)
+            f.write(b"".join(map(encode_frame, make_charges(chunk, end))))
+            f.write(b"".join(map(encode_frame, make_refunds(chunk, end))))
+
+
+def build(directory: str, records: int, tail: int) -> None:
+    """Lay out `records` charges, the last `tail` of them after a snapshot."""
+    os.makedirs(directory)
+    snapshotted = records - tail
+    if snapshotted:
+        write_snapshot(
+            os.path.join(directory, "snapshot-00000002.bin"),
+            make_charges(0, snapshotted),
+            make_refunds(0, snapshotted),
+        )
+        write_log(os.path.join(directory, "wal-00000002.log"), snapshotted, records)
+    else:
+        write_log(os.path.join(directory, "wal-00000001.log"), 0, records)
+
+
+def directory_size(directory: str) -> int:
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+async def recover(directory: str, load: bool) -> float:
+    """Open the directory and read everything back; return elapsed seconds."""
+    start = time.perf_counter()
+    storage = WALStorage(directory)
+    if load:
+        processor = PaymentProcessor(storage=storage)
+        await processor.load()
+    else:
+        for _ in storage.iter_charges():
+            pass
+        for _ in storage.iter_refunds():
+            pass
+    elapsed = time.perf_counter() - start
+    await storage.close()
+    return elapsed
+
+
+async def main(records: int, tail: int, load: bool) -> None:
+    total = records + records // REFUND_EVERY
+    with tempfile.TemporaryDirectory() as tmp:
+        layouts = [("log only", records), ("snapshot + tail", min(tail, records))]
+        results = []
+        for name, logged in layouts:
+            directory = os.path.join(tmp, name.replace(" ", "_").replace("+", "and"))
+            build(directory, records, logged)
+            elapsed = await recover(directory, load)
+            results.append((name, elapsed, directory_size(directory)))
+    
+    action = "load into PaymentProcessor" if load else "decode"
+    print(f"{records} charges + {records // REFUND_EVERY} refunds, {action}")
+    for name, elapsed, size in results:
+        print(
+            f"  {name:<18} {elapsed:>8.2f} s  {total / elapsed:>10.0f} records/sec"
+            f"  ({size / 1e6:.0f} MB on disk)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=10000000)
+    parser.add_argument("--tail", type=int, default=10000, help="records logged after the snapshot")
+    parser.add_argument("--load", action="store_true", help="rebuild processor indexes, not just decode")
+    args = parser.parse_args()
+    asyncio.run(main(args.records, args.tail, args.load))
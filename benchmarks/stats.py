@@ -0,0 +1,59 @@
+"""
+Shared helpers for benchmark statistics and JSON baselines
+"""
+import json
+import statistics
+from typing import Dict, List
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of `samples` (pct in 0..100)."""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    """Throughput and latency summary, latencies in milliseconds."""
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def save_baseline(path: str, results: Dict[str, dict]) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def compare_to_baseline(path: str, results: Dict[str, dict], threshold: float) -> List[str]:
+    """
+    Compare results against a saved baseline.
+    
+    A case regresses when its throughput drops, or its p99 grows, by more
+    than `threshold` (a fraction). Cases missing from either side are
+    ignored.
+    
+    Returns:
+        One human-readable line per regression
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    
+    regressions = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if "throughput" in current and current["throughput"] < previous["throughput"] * (1 - threshold):
+            regressions.append(
+                f"{name}: throughput {previous['throughput']:.0f} -> {current['throughput']:.0f}/s"
+            )
+        for key in ("p99_ms", "ns_per_call"):
+            if key in current and current[key] > previous[key] * (1 + threshold):
+                regressions.append(f"{name}: {key} {previous[key]:.3f} -> {current[key]:.3f}")
+    return regressions
@@ -0,0 +1,68 @@
+"""
+Storage backend throughput benchmark
+
+Compares charge throughput for:
+- in-memory only (no storage backend)
+- SQLite, one commit per write
+- SQLite with group commit
+
+Usage:
+    python -m benchmarks.storage_bench --charges 5000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Optional
+
+from src.services.payment_processor import PaymentProcessor
+from src.services.storage import SQLiteStorage, StorageBackend
+
+
+async def run_charges(storage: Optional[StorageBackend], charges: int, concurrency: int) -> float:
+    """Run `charges` charges at the given concurrency and return charges/sec."""
+    processor = PaymentProcessor(storage=storage)
+    items = [
+        {
+            "order_id": f"order-{i}",
+            "amount": 10.0,
+            "currency": "USD",
+            "customer_id": f"cust-{i % 1000}",
+            "payment_method": "card",
+        }
+        for i in range(charges)
+    ]
+    
+    start = time.perf_counter()
+    await processor.charge_many(items, concurrency=concurrency)
+    elapsed = time.perf_counter() - start
+    await processor.close()
+    return charges / elapsed
+
+
+async def main(charges: int, concurrency: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        per_write = SQLiteStorage(os.path.join(tmp, "per_write.db"), group_commit=False)
+        grouped = SQLiteStorage(os.path.join(tmp, "grouped.db"), group_commit=True)
+        
+        results = [
+            ("in-memory", await run_charges(None, charges, concurrency), None),
+            ("sqlite per-write commit", await run_charges(per_write, charges, concurrency), per_write),
+            ("sqlite group commit", await run_charges(grouped, charges, concurrency), grouped),
+        ]
+    
+    print(f"{charges} charges, concurrency {concurrency}")
+    for name, rate, storage in results:
+        line = f"  {name:<26} {rate:>10.0f} charges/sec"
+        if storage is not None:
+            line += f"  ({storage.commits} commits, {storage.writes / storage.commits:.1f} writes/commit)"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--charges", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+    asyncio.run(main(args.charges, args.concurrency))
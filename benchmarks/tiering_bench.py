@@ -0,0 +1,102 @@
+"""
+Hot/cold tiering benchmark
+
+Pushes charges through PaymentProcessor.charge() with everything in
+memory and again with a cold tier, and reports resident memory as
+volume accumulates, then the cost of get_charge() and of listing an
+order's charges for a recent (hot) and an old (cold) charge. Each run
+happens in a fresh process so one can't inherit the other's heap.
+
+Usage:
+    python -m benchmarks.tiering_bench --charges 2000000 --budget-mb 64
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from src.services.cold_tier import ColdTier
+from src.services.payment_processor import PaymentProcessor
+
+CHECKPOINTS = 5
+LOOKUPS = 2000
+
+
+def rss_mb(field: str = "VmRSS") -> float:
+    """Resident memory from /proc/self/status, in MB."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def timed_lookups(processor: PaymentProcessor, charge_id: str, order_id: str) -> Tuple[float, float]:
+    start = time.perf_counter()
+    for _ in range(LOOKUPS):
+        await processor.get_charge(charge_id)
+    get_us = (time.perf_counter() - start) / LOOKUPS * 1e6
+    start = time.perf_counter()
+    for _ in range(LOOKUPS):
+        await processor.get_charges_by_order(order_id)
+    order_us = (time.perf_counter() - start) / LOOKUPS * 1e6
+    return get_us, order_us
+
+
+async def run(charges: int, budget_mb: Optional[int]) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        tier = None if budget_mb is None else ColdTier(tmp, memory_budget=budget_mb * 1024 * 1024)
+        processor = PaymentProcessor(cold_tier=tier)
+        rss: List[Tuple[int, float, float]] = []
+        step = charges // CHECKPOINTS
+        first = None
+        start = time.perf_counter()
+        for i in range(charges):
+            charge = await processor.charge(f"order-{i}", 10.0 + i % 100, "USD", f"cust-{i % 100000}", "card")
+            if first is None:
+                first = charge
+            if (i + 1) % step == 0:
+                rss.append((i + 1, rss_mb(), rss_mb("RssAnon")))
+        elapsed = time.perf_counter() - start
+        if processor._eviction is not None:
+            await processor._eviction
+        
+        result = {
+            "rss": rss,
+            "charges_per_sec": charges / elapsed,
+            "hot": await timed_lookups(processor, charge.id, charge.order_id),
+            "old": await timed_lookups(processor, first.id, first.order_id),
+            "segments": tier.segments if tier is not None else 0,
+            "cold": len(tier) if tier is not None else 0,
+        }
+        await processor.close()
+        return result
+
+
+def run_in_process(charges: int, budget_mb: Optional[int]) -> dict:
+    return asyncio.run(run(charges, budget_mb))
+
+
+def main(charges: int, budget_mb: int) -> None:
+    modes = [("all in memory", None), (f"cold tier, {budget_mb} MB hot", budget_mb)]
+    for name, budget in modes:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            result = pool.submit(run_in_process, charges, budget).result()
+        print(f"{name}: {result['charges_per_sec']:.0f} charges/sec")
+        if budget is not None:
+            print(f"  {result['cold']:,} charges on disk in {result['segments']} segments")
+        for count, rss, anon in result["rss"]:
+            print(f"  {count:>12,} charges  RSS {rss:>8.0f} MB  (anonymous {anon:.0f} MB)")
+        for label in ("hot", "old"):
+            get_us, order_us = result[label]
+            print(f"  {label} charge: get_charge {get_us:>7.1f} us  order lookup {order_us:>7.1f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--charges", type=int, default=2000000)
+    parser.add_argument("--budget-mb", type=int, default=64, help="hot tier memory budget")
+    args = parser.parse_args()
+    main(args.charges, args.budget_mb)
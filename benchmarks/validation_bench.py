@@ -0,0 +1,77 @@
+"""
+Bulk validation: scalar validators vs column-wise batch validation
+
+Validates N synthetic upload rows (amount, currency, payment method)
+three ways: a per-row loop over the scalar validators, validate_batch()
+on Python lists, and validate_batch() on NumPy arrays when NumPy is
+installed. Roughly 1% of rows are invalid in each column.
+
+Usage:
+    python -m benchmarks.validation_bench --rows 100000 1000000
+"""
+import argparse
+import random
+import time
+from typing import Callable, List
+
+from src.utils import validation
+from src.utils.validation import (
+    validate_batch,
+    validate_currency,
+    validate_order_total,
+    validate_payment_method,
+)
+
+CURRENCIES = ["USD", "EUR", "GBP", "JPY", "CAD", "AUD", "XXX"]
+METHODS = ["card", "bank_transfer", "paypal", "apple_pay", "google_pay", "cash"]
+
+
+def make_rows(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    amounts = [rng.uniform(-10, 2000) if rng.random() < 0.01 else rng.uniform(1, 2000)
+               for _ in range(count)]
+    currencies = [CURRENCIES[-1] if rng.random() < 0.01 else rng.choice(CURRENCIES[:-1])
+                  for _ in range(count)]
+    methods = [METHODS[-1] if rng.random() < 0.01 else rng.choice(METHODS[:-1])
+               for _ in range(count)]
+    return amounts, currencies, methods
+
+
+def scalar_loop(amounts: List, currencies: List, methods: List) -> List[bool]:
+    return [
+        validate_order_total(a) and validate_currency(c) and validate_payment_method(m)
+        for a, c, m in zip(amounts, currencies, methods)
+    ]
+
+
+def best_of(func: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(args: argparse.Namespace) -> None:
+    np = validation.np
+    print(f"{'rows':>10} {'method':<22} {'ms':>9} {'rows/sec':>14}")
+    for count in args.rows:
+        amounts, currencies, methods = make_rows(count)
+        cases = {
+            "scalar loop": lambda: scalar_loop(amounts, currencies, methods),
+            "batch (lists)": lambda: validate_batch(amounts, currencies, methods),
+        }
+        if np is not None:
+            arrays = (np.array(amounts), np.array(currencies), np.array(methods))
+            cases["batch (numpy arrays)"] = lambda: validate_batch(*arrays)
+        for name, func in cases.items():
+            seconds = best_of(func, args.repeat)
+            print(f"{count:>10,} {name:<22} {seconds * 1000:>9.1f} {count / seconds:>14,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk validation benchmark")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=3)
+    main(parser.parse_args())
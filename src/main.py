@@ -1,23 +1,54 @@
 """
 Payments Service - FastAPI Application
 """
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import Optional
 import os
 
-from .routes import payments, health
+from .middleware.metrics import MetricsMiddleware
+from .middleware.slow_requests import SlowRequestMiddleware, slow_request_threshold_from_env
+from .routes import payments, health, metrics, debug
+from .services.readiness import readiness_monitor_from_env
 from .utils.validation import validate_order_total
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Restore persisted charges/refunds before serving traffic
+    await payments.payment_processor.load()
+    # Deliver payment events in the background
+    if payments.webhook_dispatcher is not None:
+        payments.webhook_dispatcher.start()
+    # Probe dependencies in the background; /ready serves cached results
+    monitor = readiness_monitor_from_env(payments.payment_processor.readiness_probes())
+    health.readiness_monitor = monitor
+    monitor.start()
+    yield
+    await monitor.stop()
+    health.readiness_monitor = None
+    await payments.payment_processor.close()
+
+
 app = FastAPI(
     title="Payments Service",
     description="Microservice for handling payments",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+app.add_middleware(MetricsMiddleware)
+# Logs requests over SLOW_REQUEST_THRESHOLD_MS with per-phase timings
+slow_request_threshold = slow_request_threshold_from_env()
+if slow_request_threshold is not None:
+    app.add_middleware(SlowRequestMiddleware, threshold=slow_request_threshold)
+
 # Include routers
 app.include_router(health.router, tags=["Health"])
+app.include_router(metrics.router, tags=["Metrics"])
 app.include_router(payments.router, prefix="/api/payments", tags=["Payments"])
+app.include_router(debug.router, prefix="/debug", tags=["Debug"])
 
 
 @app.get("/")
@@ -0,0 +1,46 @@
+"""
+Request metrics middleware
+"""
+import time
+
+from ..utils.metrics import MetricsRegistry, REGISTRY
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording per-route latency, status codes and
+    in-flight requests.
+    
+    Routes are labelled with their path template (e.g.
+    /api/payments/charges/{charge_id}), never the raw path, so label
+    cardinality stays bounded. Requests that match no route share the
+    "unmatched" label.
+    """
+    
+    def __init__(self, app, registry: MetricsRegistry = REGISTRY):
+        self.app = app
+        self.registry = registry
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        method = scope["method"]
+        status = 500
+        
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        self.registry.request_started(method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the shared scope dict
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            self.registry.request_finished(method, path, status, time.perf_counter() - start)
@@ -0,0 +1,74 @@
+"""
+Slow-request log middleware
+"""
+import logging
+import os
+import time
+from typing import Deque, Optional
+
+from ..utils.request_timing import SLOW_REQUESTS, RequestTimer, current_timer
+
+logger = logging.getLogger(__name__)
+
+
+class SlowRequestMiddleware:
+    """
+    Pure ASGI middleware logging requests slower than `threshold` seconds
+    with their per-phase timings.
+    
+    Routes mark phases with utils.request_timing.lap(); the time from the
+    last lap to the response headers being sent is the serialization
+    phase. The latest slow requests are also kept in `recent`.
+    """
+    
+    def __init__(self, app, threshold: float, recent: Deque[dict] = SLOW_REQUESTS):
+        self.app = app
+        self.threshold = threshold
+        self.recent = recent
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        timer = RequestTimer()
+        status = 500
+        
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timer.lap("serialization")
+            await send(message)
+        
+        token = current_timer.set(timer)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_timer.reset(token)
+            elapsed = timer.elapsed()
+            if elapsed >= self.threshold:
+                self._record(scope, status, elapsed, timer)
+    
+    def _record(self, scope, status: int, elapsed: float, timer: RequestTimer) -> None:
+        route = scope.get("route")
+        entry = {
+            "method": scope["method"],
+            "path": route.path if route is not None else "unmatched",
+            "status": status,
+            "duration_ms": round(elapsed * 1000, 3),
+            "phases_ms": {phase: round(seconds * 1000, 3) for phase, seconds in timer.phases.items()},
+            "at": time.time(),
+        }
+        self.recent.append(entry)
+        logger.warning(
+            "Slow request %s %s %d took %.1f ms (%s)",
+            entry["method"], entry["path"], status, entry["duration_ms"],
+            " ".join(f"{phase}={ms:.1f}ms" for phase, ms in entry["phases_ms"].items())
+        )
+
+
+def slow_request_threshold_from_env() -> Optional[float]:
+    """Threshold from SLOW_REQUEST_THRESHOLD_MS in seconds, None when it is 0 (disabled)."""
+    threshold_ms = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", 1000))
+    return threshold_ms / 1000 if threshold_ms > 0 else None
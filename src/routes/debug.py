@@ -0,0 +1,46 @@
+"""
+Diagnostics endpoints: on-demand profiling and the slow-request log
+"""
+import os
+import time
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from ..services.profiler import ProfilerBusy, profile_event_loop
+from ..utils.request_timing import SLOW_REQUESTS
+from .payments import require_token
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_MAX_SECONDS = int(os.getenv("PROFILING_MAX_SECONDS", 60))
+
+router = APIRouter(dependencies=[Depends(require_token)])
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(10.0, gt=0, le=PROFILING_MAX_SECONDS),
+    hz: int = Query(100, ge=1, le=1000)
+):
+    """
+    Sample the event loop for `seconds` and return collapsed stacks.
+    
+    Requires a valid bearer token and PROFILING_ENABLED=true. The body
+    feeds flamegraph.pl or speedscope as is. One profile runs at a time.
+    """
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    try:
+        profiler = await profile_event_loop(seconds, hz)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(profiler.collapsed(), headers={
+        "Content-Disposition": f'attachment; filename="profile-{int(time.time())}.folded"',
+        "X-Profile-Samples": str(profiler.samples),
+    })
+
+
+@router.get("/slow-requests")
+async def slow_requests():
+    """Latest requests over SLOW_REQUEST_THRESHOLD_MS with per-phase timings, newest first."""
+    return {"requests": list(reversed(SLOW_REQUESTS))}
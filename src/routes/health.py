@@ -2,10 +2,17 @@
 Health check endpoints
 """
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 from datetime import datetime
+from typing import Optional
+
+from ..services.readiness import ReadinessMonitor
 
 router = APIRouter()
 
+# Started by the application lifespan once state has been loaded
+readiness_monitor: Optional[ReadinessMonitor] = None
+
 
 @router.get("/health")
 async def health_check():
@@ -18,10 +25,13 @@ async def health_check():
 
 @router.get("/ready")
 async def readiness_check():
-    return {
-        "ready": True,
-        "checks": {
-            "database": "ok",
-            "payment_gateway": "ok"
-        }
-    }
+    """
+    Report readiness from the background probes' cached results.
+    
+    Answers 200 when every dependency probe passed recently, otherwise
+    503, so load balancers stop routing to the pod. Never probes inline.
+    """
+    if readiness_monitor is None:
+        return JSONResponse(status_code=503, content={"ready": False, "checks": {}})
+    snapshot = readiness_monitor.snapshot()
+    return JSONResponse(status_code=200 if snapshot["ready"] else 503, content=snapshot)
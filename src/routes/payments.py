@@ -1,16 +1,220 @@
 """
 Payment routes
 """
-from fastapi import APIRouter, HTTPException, Header
-from pydantic import BaseModel
-from typing import Optional
+from contextvars import ContextVar
+from datetime import date, datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+import asyncio
+import json
+import math
 import os
 
-from ..services.payment_processor import PaymentProcessor
-from ..utils.validation import validate_order_total
+from ..services.admission import READ, WRITE, Overloaded, admission_controller_from_env
+from ..services.auth import InvalidToken, token_verifier_from_env
+from ..services.cold_tier import cold_tier_from_env
+from ..services.gateway import GatewayError, GatewayUnavailable, gateway_from_env
+from ..services.idempotency import IdempotencyCache, IdempotencyConflict
+from ..services.payment_processor import ChargeNotFound, PaymentProcessor
+from ..services.rate_limit import rate_limiter_from_env
+from ..services.response_cache import ResponseCache, encode_json, etag_matches, make_etag
+from ..services.settlement import summarize
+from ..services.storage import storage_from_env
+from ..services.webhooks import webhook_dispatcher_from_env
+from ..utils.money import from_minor_units, has_minor_precision
+from ..utils.request_timing import lap
+from ..utils.validation import validate_order_total, validate_order_totals
 
-router = APIRouter()
-payment_processor = PaymentProcessor()
+webhook_dispatcher = webhook_dispatcher_from_env()
+payment_processor = PaymentProcessor(
+    storage=storage_from_env(),
+    gateway=gateway_from_env(),
+    webhooks=webhook_dispatcher,
+    cold_tier=cold_tier_from_env()
+)
+
+BATCH_CHARGE_MAX_ITEMS = int(os.getenv("BATCH_CHARGE_MAX_ITEMS", 5000))
+BATCH_CHARGE_CONCURRENCY = int(os.getenv("BATCH_CHARGE_CONCURRENCY", 32))
+EXPORT_CHUNK_SIZE = 500
+
+# Encoded bodies of polled lookups, keyed by URL and resource version
+response_cache = ResponseCache(max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", 10000)))
+
+idempotency_cache = IdempotencyCache(
+    max_entries=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 100000)),
+    ttl=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 3600))
+)
+
+# Per API key (or client address, for anonymous calls) and per customer
+client_rate_limiter = rate_limiter_from_env("RATE_LIMIT_CLIENT", rate=100, burst=200)
+customer_rate_limiter = rate_limiter_from_env("RATE_LIMIT_CUSTOMER", rate=10, burst=20)
+
+
+async def _charges_per_customer(request: Request) -> Dict[str, int]:
+    """Charges in the JSON body (one, or a batch's items) per customer ID."""
+    customers: Dict[str, int] = {}
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            # FastAPI has already parsed and cached the body at this point
+            body = await request.json()
+        except ValueError:
+            return customers
+        items = body.get("charges") if isinstance(body, dict) else None
+        for item in [body] + (items if isinstance(items, list) else []):
+            if isinstance(item, dict) and isinstance(item.get("customer_id"), str):
+                customers[item["customer_id"]] = customers.get(item["customer_id"], 0) + 1
+    return customers
+
+
+def _too_many_requests(retry_after: float, scope: str) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=f"Rate limit exceeded for {scope}",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+async def limit_client(request: Request, authorization: Optional[str] = Header(None)) -> None:
+    """
+    Router dependency applying the per-client rate limit.
+    
+    A caller with a valid token is limited per token subject, anyone
+    else per address, so a made-up credential on every request doesn't
+    buy a fresh allowance.
+    
+    Raises:
+        HTTPException: 429 with Retry-After once the limit is exceeded
+    """
+    if client_rate_limiter is None:
+        return
+    try:
+        key = "sub:" + _verify_bearer(authorization)["sub"]
+    except HTTPException:
+        key = "ip:" + (request.client.host if request.client else "unknown")
+    retry_after = client_rate_limiter.acquire(key)
+    if retry_after:
+        raise _too_many_requests(retry_after, "this client")
+
+
+async def limit_customers(request: Request) -> None:
+    """
+    Dependency applying the per-customer rate limit to the charges in the body.
+    
+    Each charge takes one unit of its customer's allowance, so batching
+    doesn't get around the limit. A batch is let through whole or not at
+    all. Listed after require_token, so unauthenticated requests can't
+    use up a customer's allowance.
+    
+    Raises:
+        HTTPException: 429 with Retry-After once a limit is exceeded; 400
+            if a batch has more charges for one customer than its burst
+    """
+    if customer_rate_limiter is None:
+        return
+    charges = await _charges_per_customer(request)
+    burst = customer_rate_limiter.burst
+    for customer_id, count in charges.items():
+        if count > burst:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Batch has more than {burst} charges for customer {customer_id}"
+            )
+        retry_after = customer_rate_limiter.check("customer:" + customer_id, count)
+        if retry_after:
+            raise _too_many_requests(retry_after, f"customer {customer_id}")
+    # Nothing awaited since the checks, so they still hold
+    for customer_id, count in charges.items():
+        customer_rate_limiter.acquire("customer:" + customer_id, count)
+
+
+router = APIRouter(dependencies=[Depends(limit_client)])
+
+# Caps concurrent payment requests, shedding what can't start in time
+admission_controller = admission_controller_from_env()
+
+# Set for each admitted request; see _served()
+_admitted: ContextVar[Optional[List[bool]]] = ContextVar("admitted", default=None)
+
+
+def _served() -> None:
+    """Mark the current request as answered by the processor."""
+    admitted = _admitted.get()
+    if admitted is not None:
+        admitted[0] = True
+
+
+def _admission(priority: int) -> Callable[[], AsyncIterator[None]]:
+    async def admit() -> AsyncIterator[None]:
+        """
+        Dependency holding an admission slot for the rest of the request.
+        
+        Only requests the processor answered inform the limit: a failed
+        lookup or a replayed response is fast for reasons unrelated to
+        the service's capacity.
+        
+        Raises:
+            HTTPException: 503 with Retry-After when the request is shed
+        """
+        controller = admission_controller
+        if controller is None:
+            yield
+            return
+        try:
+            started = await controller.acquire(priority)
+        except Overloaded as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        lap("admission")
+        served = [False]
+        token = _admitted.set(served)
+        try:
+            yield
+        finally:
+            _admitted.reset(token)
+            controller.release(started, priority, record=served[0])
+    return admit
+
+
+admit_write = _admission(WRITE)
+admit_read = _admission(READ)
+
+token_verifier = token_verifier_from_env()
+
+
+def _unauthorized(detail: str) -> HTTPException:
+    return HTTPException(status_code=401, detail=detail, headers={"WWW-Authenticate": "Bearer"})
+
+
+async def require_token(authorization: Optional[str] = Header(None)) -> dict:
+    """
+    Dependency verifying the bearer token; returns its claims.
+    
+    Raises:
+        HTTPException: 401 for a missing or invalid token, or one without
+            a subject; 503 if no verification key is configured
+    """
+    return _verify_bearer(authorization)
+
+
+def _verify_bearer(authorization: Optional[str]) -> dict:
+    # Valid tokens are cached by the verifier, so verifying the same
+    # header for the rate limit and for require_token costs one lookup
+    if not authorization:
+        raise _unauthorized("Authorization required")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise _unauthorized("Invalid authorization format")
+    if token_verifier is None:
+        raise HTTPException(status_code=503, detail="Token verification is not configured")
+    try:
+        claims = token_verifier.verify(token)
+    except InvalidToken as e:
+        raise _unauthorized(str(e))
+    # The subject identifies the caller for rate limits and idempotency keys
+    if not isinstance(claims.get("sub"), str):
+        raise _unauthorized("Token has no subject")
+    return claims
 
 
 class ChargeRequest(BaseModel):
@@ -21,79 +225,355 @@ class ChargeRequest(BaseModel):
     payment_method: str
 
 
+class BatchChargeRequest(BaseModel):
+    charges: List[ChargeRequest] = Field(..., min_length=1, max_length=BATCH_CHARGE_MAX_ITEMS)
+
+
 class RefundRequest(BaseModel):
     charge_id: str
     amount: Optional[float] = None
     reason: Optional[str] = None
 
 
-@router.post("/charge")
-async def create_charge(request: ChargeRequest):
+async def validate_charge(request: ChargeRequest) -> None:
+    """Dependency rejecting an invalid charge before it is admitted."""
+    # Validate order total using local validation (DUPLICATED LOGIC)
+    if not validate_order_total(request.amount):
+        raise HTTPException(status_code=400, detail="Invalid amount")
+    if not has_minor_precision(request.amount, request.currency):
+        raise HTTPException(status_code=400, detail=_precision_error(request.currency))
+    lap("validation")
+
+
+def _precision_error(currency: str) -> str:
+    return f"Amount has more decimal places than {currency} allows"
+
+
+def _gateway_http_error(error: GatewayError) -> HTTPException:
+    """Map a gateway failure to 503 (circuit open) or 502 (upstream error)."""
+    status_code = 503 if isinstance(error, GatewayUnavailable) else 502
+    return HTTPException(status_code=status_code, detail=str(error))
+
+
+@router.post("/charge", dependencies=[
+    Depends(require_token),
+    Depends(limit_customers),
+    Depends(validate_charge),
+    Depends(admit_write),
+])
+async def create_charge(
+    request: ChargeRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
+    # Resolved once per request, by the route dependency above
+    claims: dict = Depends(require_token)
+):
     """
     Create a new charge for an order.
     
-    AUTH MISSING: This endpoint lacks authorization check!
-    Any request can charge any customer without verification.
-    Should check: authorization header, customer ownership, rate limiting
+    Requires a valid bearer token. Retries carrying the same
+    Idempotency-Key header and token subject get the original charge
+    back instead of creating a new one; keys are scoped to the subject.
     """
-    # BUG: No authorization check before processing payment!
-    # Should verify:
-    # 1. Valid API key or JWT token
-    # 2. Customer owns this order
-    # 3. Request is not a replay attack
+    async def process():
+        try:
+            charge = await payment_processor.charge(
+                order_id=request.order_id,
+                amount=request.amount,
+                currency=request.currency,
+                customer_id=request.customer_id,
+                payment_method=request.payment_method
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except GatewayError as e:
+            raise _gateway_http_error(e)
+        lap("processor")
+        _served()
+        return charge.to_dict()
     
-    # Validate order total using local validation (DUPLICATED LOGIC)
-    if not validate_order_total(request.amount):
-        raise HTTPException(status_code=400, detail="Invalid amount")
+    if idempotency_key is None:
+        return await process()
+    
+    try:
+        result, replayed = await idempotency_cache.run(
+            (claims["sub"], idempotency_key), process, fingerprint=request
+        )
+    except IdempotencyConflict:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Idempotency key {idempotency_key} was used with a different request"
+        )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+@router.post("/charges/batch", dependencies=[
+    Depends(require_token), Depends(limit_customers), Depends(admit_write)
+])
+async def create_charges_batch(request: BatchChargeRequest):
+    """
+    Create many charges in one request. Requires a valid bearer token.
+    
+    Items are validated up front; valid items are charged concurrently
+    (bounded by BATCH_CHARGE_CONCURRENCY). Results are returned in input
+    order, each with either a charge or an error.
+    """
+    results: List[dict] = [{"index": i, "charge": None, "error": None}
+                           for i in range(len(request.charges))]
     
-    # Process payment without any auth verification
-    result = await payment_processor.charge(
-        order_id=request.order_id,
-        amount=request.amount,
-        currency=request.currency,
-        customer_id=request.customer_id,
-        payment_method=request.payment_method
+    pending = []
+    valid = validate_order_totals([item.amount for item in request.charges])
+    for i, ok in enumerate(valid):
+        item = request.charges[i]
+        if not ok:
+            results[i]["error"] = "Invalid amount"
+        elif not has_minor_precision(item.amount, item.currency):
+            results[i]["error"] = _precision_error(item.currency)
+        else:
+            pending.append(i)
+    lap("validation")
+    
+    outcomes = await payment_processor.charge_many(
+        [request.charges[i].model_dump() for i in pending],
+        concurrency=BATCH_CHARGE_CONCURRENCY
     )
+    lap("processor")
+    _served()
+    for i, outcome in zip(pending, outcomes):
+        if isinstance(outcome, Exception):
+            results[i]["error"] = str(outcome)
+        else:
+            results[i]["charge"] = outcome.to_dict()
     
-    return result
+    failed = sum(1 for r in results if r["error"] is not None)
+    return {
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "results": results,
+    }
 
 
-@router.post("/refund")
-async def create_refund(
-    request: RefundRequest,
-    authorization: Optional[str] = Header(None)
-):
+@router.post("/refund", dependencies=[Depends(require_token), Depends(admit_write)])
+async def create_refund(request: RefundRequest):
     """
     Create a refund for a charge.
-    This endpoint HAS authorization (for comparison with /charge)
+    
+    Requires a valid bearer token.
     """
-    # This endpoint correctly checks authorization
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization required")
+    lap("validation")
+    try:
+        result = await payment_processor.refund(
+            charge_id=request.charge_id,
+            amount=request.amount,
+            reason=request.reason
+        )
+    except ChargeNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except GatewayError as e:
+        raise _gateway_http_error(e)
+    lap("processor")
+    _served()
     
-    if not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Invalid authorization format")
+    return result.to_dict()
+
+
+async def _versioned_json(
+    request: Request,
+    version: Optional[int],
+    build: Callable[[], Awaitable[dict]]
+) -> Union[Response, dict]:
+    """
+    Answer a polled GET from the resource's version.
     
-    result = await payment_processor.refund(
-        charge_id=request.charge_id,
-        amount=request.amount,
-        reason=request.reason
-    )
+    A client sending the current ETag in If-None-Match gets 304 with no
+    body. Otherwise the body cached for this URL at this version is sent
+    as is, and only a miss calls `build`. Without a version (unknown
+    resource, or shared mode) the response is built as usual.
+    """
+    # The caller has just looked up the version
+    lap("processor")
+    if version is None:
+        result = await build()
+        lap("processor")
+        _served()
+        return result
+    headers = {"ETag": make_etag(version), "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    key = f"{request.url.path}?{request.url.query}"
+    body = response_cache.get(key, version)
+    if body is None:
+        result = await build()
+        lap("processor")
+        _served()
+        body = encode_json(result)
+        response_cache.put(key, version, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/charges/{charge_id}", dependencies=[Depends(require_token), Depends(admit_read)])
+async def get_charge(charge_id: str, request: Request):
+    """Get charge details by ID (supports ETag / If-None-Match); requires a bearer token"""
+    async def build() -> dict:
+        charge = await payment_processor.get_charge(charge_id)
+        if not charge:
+            raise HTTPException(status_code=404, detail="Charge not found")
+        return charge.to_dict()
     
-    return result
+    return await _versioned_json(request, payment_processor.charge_version(charge_id), build)
 
 
-@router.get("/charges/{charge_id}")
-async def get_charge(charge_id: str):
-    """Get charge details by ID"""
-    charge = await payment_processor.get_charge(charge_id)
-    if not charge:
-        raise HTTPException(status_code=404, detail="Charge not found")
-    return charge
+@router.get("/charges/{charge_id}/refunds", dependencies=[Depends(require_token), Depends(admit_read)])
+async def get_charge_refunds(charge_id: str, request: Request):
+    """Get a charge's refund history and remaining refundable amount; requires a bearer token"""
+    async def build() -> dict:
+        try:
+            refunded, remaining = await payment_processor.get_refund_balance(charge_id)
+        except ChargeNotFound as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        refunds = await payment_processor.get_refunds_by_charge(charge_id)
+        charge = await payment_processor.get_charge(charge_id)
+        return {
+            "charge_id": charge_id,
+            "amount_refunded": from_minor_units(refunded, charge.currency),
+            "amount_remaining": from_minor_units(remaining, charge.currency),
+            "refunds": [refund.to_dict() for refund in refunds],
+        }
+    
+    return await _versioned_json(request, payment_processor.charge_version(charge_id), build)
+
 
+@router.get("/orders/{order_id}/charges", dependencies=[Depends(require_token), Depends(admit_read)])
+async def get_order_charges(
+    order_id: str,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None
+):
+    """Get charges for an order, optionally paginated with limit/cursor; requires a bearer token"""
+    async def build() -> dict:
+        try:
+            charges, next_cursor = await payment_processor.list_charges_by_order(
+                order_id, limit=limit, cursor=cursor
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {
+            "order_id": order_id,
+            "charges": [charge.to_dict() for charge in charges],
+            "next_cursor": next_cursor,
+        }
+    
+    return await _versioned_json(request, payment_processor.order_version(order_id), build)
+
+
+@router.get("/customers/{customer_id}/charges", dependencies=[Depends(require_token), Depends(admit_read)])
+async def get_customer_charges(
+    customer_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None
+):
+    """Get a page of charges for a customer; requires a bearer token"""
+    try:
+        charges, next_cursor = await payment_processor.list_charges_by_customer(
+            customer_id, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    _served()
+    return {
+        "customer_id": customer_id,
+        "charges": [charge.to_dict() for charge in charges],
+        "next_cursor": next_cursor,
+    }
+
+
+@router.get("/reports/settlement", dependencies=[Depends(require_token), Depends(admit_read)])
+async def settlement_report(
+    currency: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    locale: Optional[str] = None
+):
+    """
+    Settlement totals by currency, day (UTC), payment method and status.
+    
+    Each bucket has charge and refund counts and gross, refunded and net
+    amounts; totals are per currency. Answered from running aggregates,
+    so the cost depends on the number of buckets, not charges. With a
+    locale (e.g. de-DE), amounts are also given formatted for display.
+    Requires a valid bearer token.
+    """
+    buckets = await payment_processor.settlement_report(currency, date_from, date_to)
+    _served()
+    try:
+        return summarize(buckets, locale)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-@router.get("/orders/{order_id}/charges")
-async def get_order_charges(order_id: str):
-    """Get all charges for an order"""
-    charges = await payment_processor.get_charges_by_order(order_id)
-    return {"order_id": order_id, "charges": charges}
+
+def _epoch(value: Optional[datetime]) -> Optional[float]:
+    """Convert a query datetime to epoch seconds, treating naive values as UTC."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+async def _ndjson_lines(kind: str, rows: AsyncIterator[Tuple[str, object]]) -> AsyncIterator[bytes]:
+    """
+    Serialize (cursor, record) rows as NDJSON, a chunk at a time.
+    
+    Only one chunk is held in memory, and the event loop is yielded
+    between chunks so a large export doesn't starve other requests.
+    """
+    record_type = kind[:-1]
+    chunk: List[str] = []
+    async for cursor, record in rows:
+        chunk.append(json.dumps(
+            {"type": record_type, "cursor": cursor, "data": record.to_dict()},
+            separators=(",", ":")
+        ))
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield ("\n".join(chunk) + "\n").encode()
+            chunk = []
+            await asyncio.sleep(0)
+    if chunk:
+        yield ("\n".join(chunk) + "\n").encode()
+
+
+@router.get("/export", dependencies=[Depends(require_token)])
+async def export_records(
+    kind: str = Query("charges", alias="type", pattern="^(charges|refunds)$"),
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    currency: Optional[str] = None,
+    status: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    cursor: Optional[str] = None
+):
+    """
+    Stream charges or refunds as NDJSON.
+    
+    Each line is {"type", "cursor", "data"}. To resume an interrupted
+    export, repeat the request with the same filters and the cursor of
+    the last line received. Requires a valid bearer token.
+    """
+    try:
+        rows = payment_processor.stream_records(
+            kind,
+            cursor=cursor,
+            created_from=_epoch(created_from),
+            created_to=_epoch(created_to),
+            currency=currency,
+            status=status,
+            customer_id=customer_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(_ndjson_lines(kind, rows), media_type="application/x-ndjson")
@@ -0,0 +1,288 @@
+"""
+Adaptive admission control
+
+Past the service's capacity, taking on more requests only makes every
+one of them slower, until clients time out and retry into an even
+longer queue. AdmissionController caps the requests running at once,
+with the cap set by GradientLimit from observed latency, and holds the
+rest in a short queue. A request that can't start within the queue
+deadline, or that is estimated not to, is turned away at once, so it
+costs almost nothing and the client can back off or go elsewhere.
+
+Requests come in two priorities. Queued writes (charges and refunds)
+start before queued reads, except that reads may always take a small
+share of the slots, and a write arriving at a full queue takes the
+place of the newest queued read.
+
+Everything runs on the event loop, so no locks are needed.
+"""
+import asyncio
+import bisect
+import math
+import os
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+WRITE = 0
+READ = 1
+
+
+class Overloaded(Exception):
+    """A request was shed because the service is at capacity."""
+
+
+class _History:
+    """One kind of request's short-term average and recent latencies."""
+    
+    __slots__ = ("short", "recent", "ordered", "seen")
+    
+    def __init__(self, latency: float, window: int):
+        self.short = latency
+        # Arrival order, to drop the oldest, and sorted, to read percentiles
+        self.recent: Deque[float] = deque([latency], maxlen=window)
+        self.ordered = [latency]
+        self.seen = 0
+    
+    def add(self, latency: float, short_alpha: float) -> None:
+        self.short += short_alpha * (latency - self.short)
+        if len(self.recent) == self.recent.maxlen:
+            del self.ordered[bisect.bisect_left(self.ordered, self.recent[0])]
+        self.recent.append(latency)
+        bisect.insort(self.ordered, latency)
+    
+    def percentile(self, fraction: float) -> float:
+        return self.ordered[int((len(self.ordered) - 1) * fraction)]
+
+
+class GradientLimit:
+    """
+    Concurrency limit driven by latency (after Netflix's Gradient2).
+    
+    Keeps a short-term average of request latency and a baseline, a low
+    percentile of the last `long_window` latencies, so the odd unusually
+    fast request doesn't move it, while the lucky requests that skip
+    the queue keep it near the uncongested latency under load. While
+    the average stays within `tolerance` times the baseline, each
+    update grows the limit by up to sqrt(limit), headroom for a
+    small queue. Once latency rises past that, requests are waiting on
+    each other inside the service, and the limit shrinks in proportion,
+    by at most half per update. Samples taken while fewer than half the
+    allowed requests are running say nothing about the capacity, so
+    they only update the averages.
+    
+    A lookup takes a fraction of a millisecond and a charge waits on the
+    gateway, so a shift in the mix alone would look like congestion.
+    Each kind of request keeps its own history and is only compared
+    with itself, and the limit only grows while no kind seen recently
+    is congested.
+    """
+    
+    def __init__(
+        self,
+        initial: int = 20,
+        min_limit: int = 4,
+        max_limit: int = 500,
+        tolerance: float = 1.5,
+        smoothing: float = 0.2,
+        short_window: int = 10,
+        long_window: int = 600,
+        baseline_percentile: float = 0.1
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.baseline_percentile = baseline_percentile
+        self._short_alpha = 2 / (short_window + 1)
+        self._long_alpha = 2 / (long_window + 1)
+        self._long_window = long_window
+        self._kinds: Dict[int, _History] = {}
+        self._updates = 0
+        self._latency: Optional[float] = None
+    
+    @property
+    def latency(self) -> Optional[float]:
+        """Long-term average latency across kinds in seconds, None before any sample."""
+        return self._latency
+    
+    def update(self, latency: float, in_flight: int, kind: int = 0) -> None:
+        """Record one request's latency; `in_flight` includes the request."""
+        self._updates += 1
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency += self._long_alpha * (latency - self._latency)
+        history = self._kinds.get(kind)
+        if history is None:
+            history = self._kinds[kind] = _History(latency, self._long_window)
+        else:
+            history.add(latency, self._short_alpha)
+        history.seen = self._updates
+        if in_flight < self.limit / 2:
+            return
+        
+        gradient = 1.0
+        for history in self._kinds.values():
+            if history.short > 0 and self._updates - history.seen < self._long_window:
+                baseline = history.percentile(self.baseline_percentile)
+                gradient = min(gradient, self.tolerance * baseline / history.short)
+        target = self.limit * max(0.5, gradient) + math.sqrt(self.limit)
+        limit = self.limit * (1 - self.smoothing) + target * self.smoothing
+        self.limit = max(self.min_limit, min(self.max_limit, limit))
+
+
+class AdmissionController:
+    """
+    Run at most `limit.limit` requests at once and queue up to `max_queue` more.
+    
+    Args:
+        limit: Adaptive concurrency limit, updated as requests finish
+        max_queue: Requests allowed to wait for a slot, across priorities
+        queue_timeout: Longest a request may wait for a slot, in seconds
+        read_share: Share of the limit reads may take ahead of queued
+            writes, so a flood of writes can't starve lookups entirely
+    """
+    
+    def __init__(
+        self,
+        limit: GradientLimit,
+        max_queue: int = 200,
+        queue_timeout: float = 0.5,
+        read_share: float = 0.1,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.read_share = read_share
+        self._clock = clock
+        self.shed = 0
+        # Requests running and FIFOs of (future, expiry timer) waiting, per priority
+        self._running = [0, 0]
+        self._queues: List[Deque[Tuple[asyncio.Future, asyncio.TimerHandle]]] = [deque(), deque()]
+    
+    @property
+    def in_flight(self) -> int:
+        return self._running[WRITE] + self._running[READ]
+    
+    @property
+    def queued(self) -> int:
+        return len(self._queues[WRITE]) + len(self._queues[READ])
+    
+    async def acquire(self, priority: int) -> float:
+        """
+        Wait for a slot; returns the start time to hand back to release().
+        
+        Raises:
+            Overloaded: If the queue is full, the estimated wait exceeds
+                queue_timeout, or no slot frees up within it
+        """
+        if self.in_flight < self.limit.limit and not self.queued:
+            self._running[priority] += 1
+            return self._clock()
+        
+        if self.queued >= self.max_queue:
+            if priority == WRITE and self._queues[READ]:
+                self._reject(self._queues[READ].pop(), "Displaced by a payment write")
+            else:
+                self.shed += 1
+                raise Overloaded("Too many requests queued")
+        latency = self.limit.latency
+        # Slots free up at about limit / latency per second
+        ahead = len(self._queues[priority])
+        if latency is not None and (ahead + 1) * latency / self.limit.limit > self.queue_timeout:
+            self.shed += 1
+            raise Overloaded("Request would not start in time")
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        timer = loop.call_later(self.queue_timeout, self._expire, priority, future)
+        self._queues[priority].append((future, timer))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # The slot was handed over as the caller gave up
+                self._running[priority] -= 1
+                self._dispatch()
+            else:
+                self._remove(priority, future)
+            raise
+        return self._clock()
+    
+    def release(self, started: float, priority: int, record: bool = True) -> None:
+        """
+        Give back a slot taken at `started`.
+        
+        Args:
+            started: What acquire() returned
+            priority: The priority it was acquired with
+            record: Whether the request's latency should inform the limit;
+                pass False for requests that failed before doing real work
+        """
+        if record:
+            self.limit.update(self._clock() - started, self.in_flight, priority)
+        self._running[priority] -= 1
+        self._dispatch()
+    
+    def _dispatch(self) -> None:
+        """Hand free slots to queued requests, writes first beyond the reads' share."""
+        while self.in_flight < self.limit.limit:
+            reads, writes = self._queues[READ], self._queues[WRITE]
+            if reads and (not writes or self._running[READ] < self.read_share * self.limit.limit):
+                priority = READ
+            elif writes:
+                priority = WRITE
+            else:
+                return
+            future, timer = self._queues[priority].popleft()
+            timer.cancel()
+            if future.done():
+                continue
+            self._running[priority] += 1
+            future.set_result(None)
+    
+    def _expire(self, priority: int, future: asyncio.Future) -> None:
+        if self._remove(priority, future) and not future.done():
+            self.shed += 1
+            future.set_exception(Overloaded("Timed out waiting for capacity"))
+    
+    def _reject(self, entry: Tuple[asyncio.Future, asyncio.TimerHandle], reason: str) -> None:
+        future, timer = entry
+        timer.cancel()
+        if not future.done():
+            self.shed += 1
+            future.set_exception(Overloaded(reason))
+    
+    def _remove(self, priority: int, future: asyncio.Future) -> bool:
+        queue = self._queues[priority]
+        for entry in queue:
+            if entry[0] is future:
+                entry[1].cancel()
+                queue.remove(entry)
+                return True
+        return False
+
+
+def admission_controller_from_env() -> Optional[AdmissionController]:
+    """
+    Build the controller configured by environment variables.
+    
+    An ADMISSION_MAX_CONCURRENCY of 0 disables admission control.
+    """
+    max_limit = int(os.getenv("ADMISSION_MAX_CONCURRENCY", 500))
+    if max_limit <= 0:
+        return None
+    min_limit = int(os.getenv("ADMISSION_MIN_CONCURRENCY", 4))
+    limit = GradientLimit(
+        initial=max(min_limit, min(max_limit, int(os.getenv("ADMISSION_INITIAL_CONCURRENCY", 20)))),
+        min_limit=min_limit,
+        max_limit=max_limit
+    )
+    return AdmissionController(
+        limit,
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", 200)),
+        queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", 500)) / 1000
+    )
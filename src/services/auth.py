@@ -0,0 +1,178 @@
+"""
+Bearer token verification
+
+Tokens are JWTs signed with HMAC-SHA256 (HS256) under a secret shared
+with the services that issue them, so verification needs no network
+call. Verified claims are cached under a hash of the token: a client
+reusing its token pays for the signature check and JSON decoding once,
+and afterwards costs one hash and a dict lookup per request.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+_HEADER = {"alg": "HS256", "typ": "JWT"}
+
+
+class InvalidToken(Exception):
+    """A bearer token is malformed, wrongly signed or expired."""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(segment: str) -> bytes:
+    try:
+        return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+    except (ValueError, TypeError):
+        raise InvalidToken("Token is not valid base64url")
+
+
+class TokenVerifier:
+    """
+    Verify HS256 JWTs and cache their claims.
+    
+    Tokens must carry an `exp` claim; `nbf`, and `iss`/`aud` when an
+    issuer or audience is configured, are checked too. A cached entry
+    lives for `cache_ttl` seconds but never past the token's own `exp`,
+    and at most `cache_size` tokens are kept, least recently used
+    evicted first. Rejected tokens are never cached, so garbage can't
+    push out valid entries. A cache_size of 0 disables caching.
+    """
+    
+    def __init__(
+        self,
+        secret: str,
+        issuer: Optional[str] = None,
+        audience: Optional[str] = None,
+        leeway: float = 30.0,
+        cache_size: int = 100000,
+        cache_ttl: float = 300.0,
+        clock: Callable[[], float] = time.time
+    ):
+        self._key = secret.encode()
+        self.issuer = issuer
+        self.audience = audience
+        self.leeway = leeway
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._clock = clock
+        # token hash -> (claims, expires_at), least recently used first
+        self._cache: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()
+    
+    def __len__(self) -> int:
+        return len(self._cache)
+    
+    def verify(self, token: str) -> dict:
+        """
+        Return the token's claims.
+        
+        Raises:
+            InvalidToken: If the token is malformed, not signed with our key,
+                expired, not yet valid, or for another issuer/audience
+        """
+        now = self._clock()
+        # Hashing keeps raw tokens out of memory and gives fixed-size keys
+        digest = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        entry = self._cache.get(digest)
+        if entry is not None:
+            if entry[1] > now:
+                self._cache.move_to_end(digest)
+                return entry[0]
+            del self._cache[digest]
+        
+        claims = self._verify(token, now)
+        if self.cache_size > 0:
+            self._cache[digest] = (claims, min(now + self.cache_ttl, claims["exp"] + self.leeway))
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return claims
+    
+    def _verify(self, token: str, now: float) -> dict:
+        parts = token.split(".")
+        if len(parts) != 3:
+            raise InvalidToken("Token must have three segments")
+        header_segment, payload_segment, signature_segment = parts
+        
+        try:
+            header = json.loads(_b64decode(header_segment))
+        except ValueError:
+            raise InvalidToken("Token header is not valid JSON")
+        # Only accept the algorithm we sign with; never "none"
+        if not isinstance(header, dict) or header.get("alg") != "HS256":
+            raise InvalidToken("Token must be signed with HS256")
+        
+        expected = hmac.new(
+            self._key, f"{header_segment}.{payload_segment}".encode(), hashlib.sha256
+        ).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature_segment)):
+            raise InvalidToken("Token signature is invalid")
+        
+        try:
+            claims = json.loads(_b64decode(payload_segment))
+        except ValueError:
+            raise InvalidToken("Token payload is not valid JSON")
+        if not isinstance(claims, dict):
+            raise InvalidToken("Token payload must be an object")
+        
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)):
+            raise InvalidToken("Token has no expiry")
+        if exp + self.leeway <= now:
+            raise InvalidToken("Token has expired")
+        nbf = claims.get("nbf")
+        if isinstance(nbf, (int, float)) and nbf - self.leeway > now:
+            raise InvalidToken("Token is not valid yet")
+        if self.issuer is not None and claims.get("iss") != self.issuer:
+            raise InvalidToken("Token issuer is not accepted")
+        if self.audience is not None:
+            audience = claims.get("aud")
+            audiences = audience if isinstance(audience, list) else [audience]
+            if self.audience not in audiences:
+                raise InvalidToken("Token audience is not accepted")
+        return claims
+    
+    def sign(self, claims: dict, ttl: float = 3600.0) -> str:
+        """
+        Issue a token for `claims` that expires in `ttl` seconds.
+        
+        For tests, benchmarks and internal callers holding the same secret.
+        """
+        claims = dict(claims)
+        claims.setdefault("exp", int(self._clock() + ttl))
+        if self.issuer is not None:
+            claims.setdefault("iss", self.issuer)
+        if self.audience is not None:
+            claims.setdefault("aud", self.audience)
+        signing_input = (
+            _b64encode(json.dumps(_HEADER, separators=(",", ":")).encode())
+            + "."
+            + _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        )
+        signature = hmac.new(self._key, signing_input.encode(), hashlib.sha256).digest()
+        return f"{signing_input}.{_b64encode(signature)}"
+
+
+def token_verifier_from_env() -> Optional[TokenVerifier]:
+    """
+    Build the verifier configured by environment variables.
+    
+    Returns None when AUTH_JWT_SECRET is unset; protected endpoints then
+    refuse every request rather than let it through unverified.
+    """
+    secret = os.getenv("AUTH_JWT_SECRET")
+    if not secret:
+        return None
+    return TokenVerifier(
+        secret,
+        issuer=os.getenv("AUTH_JWT_ISSUER") or None,
+        audience=os.getenv("AUTH_JWT_AUDIENCE") or None,
+        cache_size=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 100000)),
+        cache_ttl=float(os.getenv("AUTH_TOKEN_CACHE_TTL_SECONDS", 300))
+    )
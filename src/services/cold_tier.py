@@ -0,0 +1,414 @@
+"""
+Cold tier for old charges
+
+PaymentProcessor keeps recent charges in memory. Once they outgrow the
+memory budget, the oldest are written to an immutable segment file and
+dropped from memory, and lookups that miss in memory fall through to
+the segments.
+
+A segment holds its charges sorted by ID, i.e. in creation order, in
+the write-ahead log's record encoding, followed by sorted uint64 arrays
+for finding them: one for charge IDs, and (hash, position) entries for
+order and customer IDs. Segments are memory-mapped and the arrays are
+searched by bisection, so a lookup reads a few pages and nothing is
+kept in memory per cold charge.
+
+Each eviction writes one small segment. When `fanout` segments of the
+same level have piled up, the oldest of them, as many as fit in
+`max_segment_charges`, are merged into one of the next level. Segments
+too big to merge with their neighbour stay as they are, so after months
+of traffic lookups probe about one segment per `max_segment_charges`
+cold charges plus a few per level, rather than one per eviction.
+Merging copies the encoded records and their key hashes as they are,
+without decoding anything.
+
+The tier is derived data: the storage backend remains the record, and
+PaymentProcessor.load() rebuilds the tier on startup. Opening a
+ColdTier therefore clears its directory, and segments are not fsynced.
+
+Layout of a segment file:
+    header      magic, charge count, level, end of records, offsets of the arrays
+    records     charge payloads, sorted by ID
+    ids         each charge's ID as a 64-bit integer
+    offsets     where each charge's record starts
+    orders      order ID hash << 32 | position, sorted
+    customers   customer ID hash << 32 | position, sorted
+Arrays use the host's byte order; segments never leave the host.
+"""
+import asyncio
+import heapq
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from bisect import bisect_left
+from operator import attrgetter
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from ..utils.ids import is_valid_id
+from .records import ChargeRecord
+from .wal import _decode_charge, _encode_charge
+
+# magic, charge count, level, end of records, then where ids, offsets,
+# orders and customers start
+_HEADER = struct.Struct("<8sQQQQQQQ")
+_MAGIC = b"PAYSEG01"
+_POSITION_MASK = 0xFFFFFFFF
+
+_by_id = attrgetter("id")
+
+
+def _id_value(charge_id: str) -> int:
+    return int(charge_id[-16:], 16)
+
+
+def _key_hash(key: str) -> int:
+    # Only spreads keys over the index; matches are checked on the record
+    return zlib.crc32(key.encode())
+
+
+def _bounds(
+    after: Optional[str],
+    start: Optional[str],
+    stop: Optional[str]
+) -> Tuple[int, Optional[int]]:
+    """Turn an exclusive `after` and a [start, stop) ID range into integer bounds."""
+    low = 0 if start is None else _id_value(start)
+    if after is not None:
+        low = max(low, _id_value(after) + 1)
+    return low, None if stop is None else _id_value(stop)
+
+
+class _SegmentWriter:
+    """Stream records into a new segment file; finish() adds the arrays."""
+    
+    def __init__(self, path: str, level: int):
+        self._file = open(path, "wb")
+        self._file.write(b"\0" * _HEADER.size)
+        self._position = _HEADER.size
+        self._level = level
+        self._ids = array("Q")
+        self._offsets = array("Q")
+        self._orders = []
+        self._customers = []
+    
+    def add(self, value: int, payload, order_hash: int, customer_hash: int) -> None:
+        position = len(self._ids)
+        self._ids.append(value)
+        self._offsets.append(self._position)
+        self._orders.append(order_hash << 32 | position)
+        self._customers.append(customer_hash << 32 | position)
+        self._file.write(payload)
+        self._position += len(payload)
+    
+    def finish(self) -> None:
+        with self._file as f:
+            records_end = self._position
+            # Align the arrays so they can be cast in place
+            f.write(b"\0" * (-records_end % 8))
+            position = records_end + -records_end % 8
+            sections = []
+            for values in (
+                self._ids, self._offsets,
+                array("Q", sorted(self._orders)), array("Q", sorted(self._customers)),
+            ):
+                sections.append(position)
+                f.write(values.tobytes())
+                position += 8 * len(values)
+            f.seek(0)
+            f.write(_HEADER.pack(_MAGIC, len(self._ids), self._level, records_end, *sections))
+
+
+def write_segment(path: str, charges: Iterable[ChargeRecord], level: int) -> None:
+    """Write charges, which must come in ID order, as a segment file."""
+    writer = _SegmentWriter(path, level)
+    for charge in charges:
+        writer.add(
+            _id_value(charge.id), _encode_charge(charge),
+            _key_hash(charge.order_id), _key_hash(charge.customer_id)
+        )
+    writer.finish()
+
+
+def merge_segments(path: str, segments: List["Segment"], level: int) -> None:
+    """Write the charges of several segments, interleaved by ID, as one segment."""
+    writer = _SegmentWriter(path, level)
+    # IDs are unique, so entries never compare past their first field
+    for entry in heapq.merge(*(segment.entries() for segment in segments)):
+        writer.add(*entry)
+    writer.finish()
+
+
+class Segment:
+    """A memory-mapped segment file."""
+    
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        magic, self.count, self.level, self._records_end, *sections = (
+            _HEADER.unpack_from(self._view, 0)
+        )
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a charge segment")
+        self._ids, self._offsets, self._orders, self._customers = (
+            self._view[at:at + 8 * self.count].cast("Q") for at in sections
+        )
+        self.first = self._ids[0]
+        self.last = self._ids[-1]
+    
+    def _record(self, position: int) -> ChargeRecord:
+        return _decode_charge(self._view, self._offsets[position])
+    
+    def get(self, value: int) -> Optional[ChargeRecord]:
+        position = bisect_left(self._ids, value)
+        if position < self.count and self._ids[position] == value:
+            return self._record(position)
+        return None
+    
+    def scan(self, low: int, high: Optional[int]) -> Iterator[ChargeRecord]:
+        """Charges with low <= ID < high, in ID order."""
+        end = self.count if high is None else bisect_left(self._ids, high)
+        for position in range(bisect_left(self._ids, low), end):
+            yield self._record(position)
+    
+    def find(
+        self,
+        field: str,
+        key: str,
+        hashed: int,
+        low: int,
+        high: Optional[int]
+    ) -> Iterator[ChargeRecord]:
+        """
+        Charges whose `field` is `key`, with low <= ID < high, in ID order.
+        
+        `hashed` is _key_hash(key), computed once by the caller for all segments.
+        """
+        index = self._orders if field == "order_id" else self._customers
+        entry = hashed << 32
+        start = bisect_left(index, entry)
+        end = bisect_left(index, entry + (1 << 32), start)
+        # Entries for one hash are sorted by position, which is ID order
+        for entry in index[start:end]:
+            position = entry & _POSITION_MASK
+            value = self._ids[position]
+            if value < low:
+                continue
+            if high is not None and value >= high:
+                return
+            charge = self._record(position)
+            # Different keys can share a hash
+            if getattr(charge, field) == key:
+                yield charge
+    
+    def __iter__(self) -> Iterator[ChargeRecord]:
+        return self.scan(0, None)
+    
+    def entries(self) -> Iterator[Tuple[int, memoryview, int, int]]:
+        """(ID, encoded record, order hash, customer hash) per charge, in ID order."""
+        hashes = []
+        for index in (self._orders, self._customers):
+            by_position = array("Q", bytes(8 * self.count))
+            for entry in index:
+                by_position[entry & _POSITION_MASK] = entry >> 32
+            hashes.append(by_position)
+        ends = array("Q", self._offsets[1:])
+        ends.append(self._records_end)
+        for position, (value, start, end) in enumerate(zip(self._ids, self._offsets, ends)):
+            yield value, self._view[start:end], hashes[0][position], hashes[1][position]
+    
+    def close(self) -> None:
+        for view in (self._ids, self._offsets, self._orders, self._customers, self._view):
+            view.release()
+        self._map.close()
+
+
+class ColdTier:
+    """
+    Charges moved out of memory, in segment files under `directory`.
+    
+    Args:
+        directory: Where segments are written; cleared when opened
+        memory_budget: Bytes of charges PaymentProcessor keeps in memory
+            before it moves the oldest here
+        fanout: Segments of one level merged together into the next
+        max_segment_charges: Largest segment a merge may produce
+    """
+    
+    def __init__(
+        self,
+        directory: str,
+        memory_budget: int = 512 * 1024 * 1024,
+        fanout: int = 8,
+        max_segment_charges: int = 1000000
+    ):
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.fanout = fanout
+        self.max_segment_charges = max_segment_charges
+        self.merges = 0
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.startswith("segment-"):
+                os.remove(os.path.join(directory, name))
+        # Oldest first. Merges only take segments from the run of the
+        # newest level at the end of the list, and put the merged one
+        # where they were.
+        self._segments: List[Segment] = []
+        self._next_segment = 0
+        self._count = 0
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    @property
+    def segments(self) -> int:
+        return len(self._segments)
+    
+    async def add(self, charges: List[ChargeRecord]) -> None:
+        """
+        Write charges, sorted by ID, as a new segment and merge full levels.
+        
+        Files are written on the default executor. Readers see the new
+        segment once it is complete, and merged segments stay readable
+        until the last lookup or scan still using them finishes.
+        """
+        if not charges:
+            return
+        loop = asyncio.get_running_loop()
+        segment = await loop.run_in_executor(None, self._write, charges, 0)
+        self._segments.append(segment)
+        self._count += segment.count
+        
+        while True:
+            start, group = self._mergeable()
+            if not group:
+                return
+            merged = await loop.run_in_executor(None, self._merge, group)
+            self._segments[start:start + len(group)] = [merged]
+            self.merges += 1
+            for old in group:
+                # Unlinking keeps the mapping valid for readers still using it
+                os.remove(old.path)
+    
+    def _mergeable(self) -> Tuple[int, List[Segment]]:
+        """
+        Where the next merge starts in the segment list, and its segments.
+        
+        Once the newest level has `fanout` segments that can still grow,
+        its oldest are merged, as many as fit in max_segment_charges.
+        """
+        segments = self._segments
+        level = segments[-1].level
+        start = len(segments) - 1
+        while start and segments[start - 1].level == level:
+            start -= 1
+        # Segments too big to merge with the next one are full; skip them
+        while (start + 1 < len(segments)
+               and segments[start].count + segments[start + 1].count > self.max_segment_charges):
+            start += 1
+        if len(segments) - start < self.fanout:
+            return start, []
+        group: List[Segment] = []
+        total = 0
+        for segment in segments[start:start + self.fanout]:
+            if total + segment.count > self.max_segment_charges:
+                break
+            group.append(segment)
+            total += segment.count
+        return start, group
+    
+    def _new_path(self) -> str:
+        self._next_segment += 1
+        return os.path.join(self.directory, "segment-%08d.seg" % (self._next_segment - 1))
+    
+    def _write(self, charges: List[ChargeRecord], level: int) -> Segment:
+        path = self._new_path()
+        write_segment(path, charges, level)
+        return Segment(path)
+    
+    def _merge(self, group: List[Segment]) -> Segment:
+        # Segments can overlap in ID range (see scan()), so interleave them
+        path = self._new_path()
+        merge_segments(path, group, group[0].level + 1)
+        return Segment(path)
+    
+    def get(self, charge_id: str) -> Optional[ChargeRecord]:
+        if not self._segments or not is_valid_id(charge_id, "ch"):
+            return None
+        value = _id_value(charge_id)
+        for segment in reversed(self._segments):
+            if segment.first <= value <= segment.last:
+                charge = segment.get(value)
+                if charge is not None:
+                    return charge
+        return None
+    
+    def find(
+        self,
+        field: str,
+        key: str,
+        after: Optional[str] = None,
+        start: Optional[str] = None,
+        stop: Optional[str] = None
+    ) -> Iterator[ChargeRecord]:
+        """
+        Lazily yield charges whose `field` ("order_id" or "customer_id")
+        equals `key`, in ID order, after the ID `after` and within the
+        ID range [start, stop).
+        """
+        low, high = _bounds(after, start, stop)
+        hashed = _key_hash(key)
+        return heapq.merge(
+            *(s.find(field, key, hashed, low, high) for s in self._segments if s.last >= low),
+            key=_by_id
+        )
+    
+    def scan(
+        self,
+        after: Optional[str] = None,
+        start: Optional[str] = None,
+        stop: Optional[str] = None
+    ) -> Iterator[ChargeRecord]:
+        """
+        Lazily yield every charge in ID order; see find() for bounds.
+        
+        A charge that finished while older ones were being moved can be
+        moved later than charges with newer IDs, so segments may overlap
+        and scans merge them rather than read them one after another.
+        """
+        low, high = _bounds(after, start, stop)
+        return heapq.merge(
+            *(s.scan(low, high) for s in self._segments if s.last >= low),
+            key=_by_id
+        )
+    
+    def close(self) -> None:
+        for segment in self._segments:
+            try:
+                segment.close()
+            except BufferError:
+                # A scan still holds it; the mapping is freed with the scan
+                pass
+        self._segments = []
+        self._count = 0
+
+
+def cold_tier_from_env() -> Optional[ColdTier]:
+    """
+    Build the cold tier configured by environment variables.
+    
+    Returns None when PAYMENTS_COLD_TIER_DIR is unset, in which case
+    every charge stays in memory.
+    """
+    directory = os.getenv("PAYMENTS_COLD_TIER_DIR")
+    if not directory:
+        return None
+    return ColdTier(
+        directory,
+        memory_budget=int(os.getenv("PAYMENTS_HOT_TIER_MB", 512)) * 1024 * 1024,
+        max_segment_charges=int(os.getenv("PAYMENTS_COLD_SEGMENT_CHARGES", 1000000))
+    )
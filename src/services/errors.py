@@ -0,0 +1,11 @@
+"""
+Payment processing errors
+"""
+
+
+class ChargeNotFound(ValueError):
+    """The referenced charge does not exist."""
+
+
+class RefundExceedsCharge(ValueError):
+    """A refund would take the charge's refunded total past its amount."""
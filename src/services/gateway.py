@@ -0,0 +1,228 @@
+"""
+Payment gateway client
+"""
+import asyncio
+import os
+import random
+import time
+from typing import Callable, Optional
+
+import httpx
+
+
+class GatewayError(Exception):
+    """The payment gateway rejected or failed a request."""
+    
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class GatewayUnavailable(GatewayError):
+    """The circuit breaker is open; the gateway is not being called."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+    
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls fail fast for `reset_timeout` seconds. Then a single trial call
+    is let through (half-open): success closes the circuit, failure opens
+    it again.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = 0.0
+        self._state = self.CLOSED
+    
+    @property
+    def state(self) -> str:
+        return self._state
+    
+    def allow(self) -> bool:
+        """Return True if a call may be attempted now."""
+        if self._state == self.CLOSED:
+            return True
+        if self._clock() - self._opened_at < self.reset_timeout:
+            return False
+        # Open for long enough (or the last trial call never reported
+        # back): let one trial call through
+        self._state = self.HALF_OPEN
+        self._opened_at = self._clock()
+        return True
+    
+    def record_success(self) -> None:
+        self._failures = 0
+        self._state = self.CLOSED
+    
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            self._state = self.OPEN
+            self._opened_at = self._clock()
+
+
+class PaymentGateway:
+    """
+    Async adapter for the upstream payment gateway API.
+    
+    All calls share one pooled httpx.AsyncClient with keep-alive. Each call
+    has its own timeout, is retried on transport errors, 429 and 5xx with
+    full-jitter exponential backoff, and is guarded by a circuit breaker.
+    If `hedge_after` is set, a second identical request is started when the
+    first hasn't answered within that many seconds and the first response
+    wins. Requests carry the payload's "reference" (our charge or refund
+    ID) as the Idempotency-Key, so retries, hedges and a payment submitted
+    again after a timeout or crash never double-charge.
+    """
+    
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = 5.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.05,
+        backoff_max: float = 1.0,
+        hedge_after: Optional[float] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        max_connections: int = 100,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker()
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=30.0
+            ),
+            transport=transport
+        )
+    
+    async def charge(self, payload: dict) -> dict:
+        """Submit a charge to the gateway."""
+        return await self._call("POST", "/v1/charges", payload)
+    
+    async def refund(self, payload: dict) -> dict:
+        """Submit a refund to the gateway."""
+        return await self._call("POST", "/v1/refunds", payload)
+    
+    async def ping(self) -> None:
+        """Raise GatewayError unless the gateway health endpoint answers 200."""
+        try:
+            response = await self._client.get("/health", timeout=self.timeout)
+        except httpx.HTTPError as e:
+            raise GatewayError(f"Gateway unreachable: {e}")
+        if response.status_code != 200:
+            raise GatewayError("Gateway unhealthy", response.status_code)
+    
+    async def close(self) -> None:
+        await self._client.aclose()
+    
+    async def _call(self, method: str, path: str, payload: dict) -> dict:
+        if not self.breaker.allow():
+            raise GatewayUnavailable("Payment gateway circuit is open")
+        
+        headers = {"Idempotency-Key": payload["reference"]}
+        attempt = 0
+        while True:
+            try:
+                result = await self._attempt(method, path, payload, headers)
+            except GatewayError as e:
+                retryable = e.status_code is None or e.status_code == 429 or e.status_code >= 500
+                if not retryable:
+                    # The gateway answered; a decline is not an outage
+                    self.breaker.record_success()
+                    raise
+                if attempt >= self.max_retries:
+                    self.breaker.record_failure()
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+    
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+    
+    async def _attempt(self, method: str, path: str, payload: dict, headers: dict) -> dict:
+        if self.hedge_after is None:
+            return await self._send(method, path, payload, headers)
+        
+        tasks = {asyncio.ensure_future(self._send(method, path, payload, headers))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if not done:
+                tasks.add(asyncio.ensure_future(self._send(method, path, payload, headers)))
+            
+            error: Optional[BaseException] = None
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def _send(self, method: str, path: str, payload: dict, headers: dict) -> dict:
+        try:
+            response = await self._client.request(method, path, json=payload, headers=headers)
+        except httpx.TimeoutException:
+            raise GatewayError("Gateway request timed out")
+        except httpx.HTTPError as e:
+            raise GatewayError(f"Gateway request failed: {e}")
+        if response.status_code >= 400:
+            raise GatewayError(
+                f"Gateway returned {response.status_code}", response.status_code
+            )
+        try:
+            return response.json()
+        except ValueError:
+            # No status code, so it is retried (under the same key) and
+            # counts against the breaker like a transport error
+            raise GatewayError(f"Gateway returned {response.status_code} with a malformed body")
+
+
+def gateway_from_env() -> Optional[PaymentGateway]:
+    """
+    Build the gateway client configured by environment variables.
+    
+    Returns None when PAYMENT_GATEWAY_URL is unset, in which case charges
+    are recorded without calling a gateway.
+    """
+    base_url = os.getenv("PAYMENT_GATEWAY_URL")
+    if not base_url:
+        return None
+    hedge_after_ms = os.getenv("PAYMENT_GATEWAY_HEDGE_AFTER_MS")
+    return PaymentGateway(
+        base_url,
+        timeout=float(os.getenv("PAYMENT_GATEWAY_TIMEOUT", 5.0)),
+        max_retries=int(os.getenv("PAYMENT_GATEWAY_MAX_RETRIES", 2)),
+        hedge_after=float(hedge_after_ms) / 1000 if hedge_after_ms else None,
+        max_connections=int(os.getenv("PAYMENT_GATEWAY_MAX_CONNECTIONS", 100))
+    )
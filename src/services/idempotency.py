@@ -0,0 +1,120 @@
+"""
+Idempotency-Key response cache
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class IdempotencyConflict(Exception):
+    """An idempotency key was reused with a different request body."""
+
+
+class IdempotencyCache:
+    """
+    Bounded LRU cache with TTL for idempotent request handling.
+    
+    The first request for a key runs the operation; concurrent requests
+    with the same key wait on it instead of running it again. Finished
+    results are kept for `ttl` seconds, up to `max_entries` keys, with the
+    least recently used keys evicted first. Failed operations are not
+    cached, so a client can retry them with the same key.
+    """
+    
+    def __init__(
+        self,
+        max_entries: int = 100000,
+        ttl: float = 24 * 3600,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        # key -> (fingerprint, expires_at, result), least recently used first
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float, Any]]" = OrderedDict()
+        # key -> (fingerprint, task) for operations still running
+        self._in_flight: Dict[Hashable, Tuple[Any, asyncio.Future]] = {}
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def get(self, key: Hashable, fingerprint: Any = None) -> Optional[Any]:
+        """Return the cached result for a key, or None if absent or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        cached_fingerprint, expires_at, result = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            return None
+        if cached_fingerprint != fingerprint:
+            raise IdempotencyConflict(f"Idempotency key {key} was used with a different request")
+        self._entries.move_to_end(key)
+        return result
+    
+    async def run(
+        self,
+        key: Hashable,
+        operation: Callable[[], Awaitable[Any]],
+        fingerprint: Any = None
+    ) -> Tuple[Any, bool]:
+        """
+        Run `operation` at most once per key.
+        
+        The operation runs in a task of its own, so a request cancelled
+        while it runs (e.g. its client disconnected) doesn't cancel it:
+        requests waiting on the same key still get its result, and the
+        result is cached as usual.
+        
+        Args:
+            key: Client-supplied idempotency key, scoped to the client
+                (e.g. a (client, key) tuple) so clients can't collide
+            operation: Coroutine function producing the result
+            fingerprint: Value identifying the request body; reusing a key
+                with a different fingerprint raises IdempotencyConflict
+        
+        Returns:
+            Tuple of (result, replayed), replayed being True when the
+            result came from an earlier request
+        """
+        result = self.get(key, fingerprint)
+        if result is not None:
+            return result, True
+        
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            running_fingerprint, future = in_flight
+            if running_fingerprint != fingerprint:
+                raise IdempotencyConflict(f"Idempotency key {key} was used with a different request")
+            return await asyncio.shield(future), True
+        
+        task = asyncio.ensure_future(self._complete(key, fingerprint, operation))
+        # Mark an exception retrieved in case every request has gone
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._in_flight[key] = (fingerprint, task)
+        return await asyncio.shield(task), False
+    
+    async def _complete(
+        self,
+        key: Hashable,
+        fingerprint: Any,
+        operation: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        try:
+            result = await operation()
+        finally:
+            del self._in_flight[key]
+        self._store(key, fingerprint, result)
+        return result
+    
+    def _store(self, key: Hashable, fingerprint: Any, result: Any) -> None:
+        now = self._clock()
+        self._entries[key] = (fingerprint, now + self.ttl, result)
+        self._entries.move_to_end(key)
+        
+        while self._entries:
+            oldest_key, (_, expires_at, _) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and expires_at > now:
+                break
+            del self._entries[oldest_key]
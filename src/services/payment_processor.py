@@ -1,9 +1,45 @@
 """
 Payment processor service
 """
-import uuid
-from datetime import datetime
-from typing import Optional, Dict, List
+import asyncio
+import heapq
+import logging
+from bisect import bisect_left, bisect_right, insort
+from collections import ChainMap, OrderedDict
+from contextlib import asynccontextmanager
+from datetime import date
+from itertools import islice
+from operator import itemgetter
+from typing import Optional, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Tuple, Union
+
+from ..utils.ids import IdGenerator, default_generator, id_lower_bound, id_timestamp, is_valid_id
+from ..utils.metrics import timed
+from ..utils.money import from_minor_units, has_minor_precision, to_minor_units
+from .cold_tier import ColdTier
+from .errors import ChargeNotFound, RefundExceedsCharge
+from .gateway import PaymentGateway
+from .records import ChargeRecord, RefundRecord
+from .settlement import SettlementAggregates
+from .storage import StorageBackend
+from .webhooks import CHARGE_SUCCEEDED, REFUND_SUCCEEDED, WebhookDispatcher, event_type_of
+
+logger = logging.getLogger(__name__)
+
+# Approximate memory a charge costs in the hot tier beyond its two
+# free-form strings: the record, its ID and numbers, and its entries in
+# the ID log and indexes (measured at about 560 bytes with short IDs)
+_HOT_CHARGE_OVERHEAD = 540
+
+
+def _hot_size(charge: ChargeRecord) -> int:
+    return _HOT_CHARGE_OVERHEAD + len(charge.order_id) + len(charge.customer_id)
+
+
+def _minor_units(amount: float, currency: str) -> int:
+    # Rounding a client's 10.005 to 10.01 would charge what they never sent
+    if not has_minor_precision(amount, currency):
+        raise ValueError(f"Amount has more decimal places than {currency} allows")
+    return to_minor_units(amount, currency)
 
 
 class PaymentProcessor:
@@ -12,11 +48,73 @@ class PaymentProcessor:
     In production, this would integrate with Stripe, PayPal, etc.
     """
     
-    def __init__(self):
-        # In-memory storage for demo
-        self._charges: Dict[str, dict] = {}
-        self._refunds: Dict[str, dict] = {}
+    def __init__(
+        self,
+        storage: Optional[StorageBackend] = None,
+        gateway: Optional[PaymentGateway] = None,
+        ids: Optional[IdGenerator] = None,
+        webhooks: Optional[WebhookDispatcher] = None,
+        cold_tier: Optional[ColdTier] = None
+    ):
+        # Optional durable backend; records are written through to it
+        # before being acknowledged. Without one, state is in-memory only.
+        self._storage = storage
+        # A shared backend (one store for many worker processes) holds the
+        # authoritative state, so reads go to it and nothing is kept here
+        self._shared = storage is not None and storage.shared
+        # Optional upstream gateway; without one, charges are only recorded
+        self._gateway = gateway
+        # Optional event dispatcher; each stored charge/refund queues an
+        # event there, and delivery happens off the request path. Backends
+        # with an outbox store the event in the same write as the record.
+        self._webhooks = webhooks
+        if webhooks is not None and storage is not None and storage.enable_outbox():
+            webhooks.use_outbox(storage)
+        # Optional on-disk tier; once the charges held here outgrow its
+        # memory budget the oldest are moved there, and lookups that miss
+        # here fall through to it. Shared mode keeps nothing to move.
+        self._cold = None if self._shared else cold_tier
+        self._hot_bytes = 0
+        self._eviction: Optional[asyncio.Task] = None
+        # Time-sortable IDs; a record's created_at is its ID's timestamp.
+        # Workers sharing a store get their worker ID from it in load().
+        self._ids = ids or default_generator()
+        self._claim_worker_id = ids is None and self._shared
+        self._charges: Dict[str, ChargeRecord] = {}
+        self._refunds: Dict[str, RefundRecord] = {}
+        # Time index: all IDs kept sorted, which is creation order, so time
+        # ranges and cursors are found by bisection
+        self._charge_log: List[str] = []
+        self._refund_log: List[str] = []
+        # IDs issued to charges/refunds that haven't been recorded yet,
+        # oldest first; scans stop at the oldest so a resumed scan can't
+        # skip a record that lands behind its cursor
+        self._pending_charges: "OrderedDict[str, None]" = OrderedDict()
+        self._pending_refunds: "OrderedDict[str, None]" = OrderedDict()
+        
+        # Secondary indexes, maintained by charge() and refund().
+        # Values are lists of IDs kept sorted, i.e. in creation order.
+        self._charges_by_order: Dict[str, List[str]] = {}
+        self._charges_by_customer: Dict[str, List[str]] = {}
+        self._refunds_by_charge: Dict[str, List[str]] = {}
+        
+        # Refund ledger: running refunded total per charge (minor units),
+        # and locks for charges with a refund in progress
+        self._refunded_minor: Dict[str, int] = {}
+        self._refund_locks: Dict[str, list] = {}
+        
+        # Settlement totals, updated as records are indexed
+        self._settlement = SettlementAggregates()
+        
+        # Change counters per order: the charges and refunds indexed under
+        # it, counting only charges still in memory. order_version() adds
+        # the cold tier's share, so a version is the order's record count
+        # wherever its charges live. A charge's version is its refund
+        # count. Both are rebuilt identically by load(), so they survive
+        # restarts.
+        self._order_versions: Dict[str, int] = {}
     
+    @timed("charge")
     async def charge(
         self,
         order_id: str,
@@ -24,7 +122,7 @@ class PaymentProcessor:
         currency: str,
         customer_id: str,
         payment_method: str
-    ) -> dict:
+    ) -> ChargeRecord:
         """
         Process a payment charge.
         
@@ -33,56 +131,685 @@ class PaymentProcessor:
         2. Call payment gateway API
         3. Handle 3D Secure if needed
         4. Store transaction record
-        """
-        charge_id = f"ch_{uuid.uuid4().hex[:16]}"
         
-        charge = {
-            "id": charge_id,
-            "order_id": order_id,
-            "amount": amount,
-            "currency": currency,
-            "customer_id": customer_id,
-            "payment_method": payment_method,
-            "status": "succeeded",
-            "created_at": datetime.utcnow().isoformat(),
-        }
+        The gateway is sent exactly the amount that is recorded.
         
-        self._charges[charge_id] = charge
+        Raises:
+            ValueError: If the amount has more decimal places than the
+                currency uses
+        """
+        amount_minor = _minor_units(amount, currency)
+        charge_id = self._ids.new_id("ch")
+        self._pending_charges[charge_id] = None
+        try:
+            if self._gateway is not None:
+                await self._gateway.charge({
+                    "reference": charge_id,
+                    "amount": from_minor_units(amount_minor, currency),
+                    "currency": currency,
+                    "customer_id": customer_id,
+                    "payment_method": payment_method,
+                })
+            
+            charge = ChargeRecord(
+                id=charge_id,
+                order_id=order_id,
+                amount_minor=amount_minor,
+                currency=currency,
+                customer_id=customer_id,
+                payment_method=payment_method,
+                status="succeeded",
+                created_at=id_timestamp(charge_id),
+            )
+            
+            if self._storage is not None:
+                await self._storage.save_charge(charge)
+            if not self._shared:
+                self._index_charge(charge)
+            if self._webhooks is not None:
+                self._webhooks.publish(CHARGE_SUCCEEDED, charge)
+        finally:
+            del self._pending_charges[charge_id]
+        await self._make_room()
         return charge
     
+    async def charge_many(
+        self,
+        charges: List[dict],
+        concurrency: int = 16
+    ) -> List[Union[ChargeRecord, Exception]]:
+        """
+        Process many charges with at most `concurrency` in flight.
+        
+        Args:
+            charges: Keyword arguments for charge(), one dict per charge
+            concurrency: Maximum number of charges processed at once
+        
+        Returns:
+            One entry per input, in order: the charge, or the exception it raised
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def run(kwargs: dict) -> ChargeRecord:
+            async with semaphore:
+                return await self.charge(**kwargs)
+        
+        return await asyncio.gather(
+            *(run(kwargs) for kwargs in charges),
+            return_exceptions=True
+        )
+    
+    @timed("refund")
     async def refund(
         self,
         charge_id: str,
         amount: Optional[float] = None,
         reason: Optional[str] = None
-    ) -> dict:
-        """Process a refund for a charge."""
-        if charge_id not in self._charges:
-            raise ValueError(f"Charge {charge_id} not found")
-        
-        original_charge = self._charges[charge_id]
-        refund_amount = amount or original_charge["amount"]
-        
-        refund_id = f"re_{uuid.uuid4().hex[:16]}"
-        refund = {
-            "id": refund_id,
-            "charge_id": charge_id,
-            "amount": refund_amount,
-            "reason": reason,
-            "status": "succeeded",
-            "created_at": datetime.utcnow().isoformat(),
-        }
-        
-        self._refunds[refund_id] = refund
+    ) -> RefundRecord:
+        """
+        Process a refund for a charge.
+        
+        Refunds for the same charge are serialized by a per-charge lock and
+        checked against a running refunded total, so concurrent requests
+        can never refund more than was charged. In shared mode the store
+        reserves the amount instead, which also covers other workers.
+        
+        Args:
+            charge_id: The charge to refund
+            amount: Amount to refund; defaults to the remaining balance
+            reason: Optional reason
+        
+        Raises:
+            ChargeNotFound: If the charge doesn't exist
+            RefundExceedsCharge: If the amount is more than the remaining balance
+            ValueError: If the amount is not positive
+        """
+        original_charge = await self._find_charge(charge_id)
+        if original_charge is None:
+            raise ChargeNotFound(f"Charge {charge_id} not found")
+        
+        currency = original_charge.currency
+        requested_minor = None
+        if amount is not None:
+            requested_minor = _minor_units(amount, currency)
+            if requested_minor <= 0:
+                raise ValueError("Refund amount must be positive")
+        
+        async with self._reserve_refund(original_charge, requested_minor) as refund_minor:
+            refund_id = self._ids.new_id("re")
+            self._pending_refunds[refund_id] = None
+            try:
+                if self._gateway is not None:
+                    await self._gateway.refund({
+                        "reference": refund_id,
+                        "charge_id": charge_id,
+                        "amount": from_minor_units(refund_minor, currency),
+                        "currency": currency,
+                    })
+                
+                refund = RefundRecord(
+                    id=refund_id,
+                    charge_id=charge_id,
+                    amount_minor=refund_minor,
+                    currency=currency,
+                    reason=reason,
+                    status="succeeded",
+                    created_at=id_timestamp(refund_id),
+                )
+                
+                if self._storage is not None:
+                    await self._storage.save_refund(refund)
+                if not self._shared:
+                    self._index_refund(refund)
+                if self._webhooks is not None:
+                    self._webhooks.publish(REFUND_SUCCEEDED, refund)
+            finally:
+                del self._pending_refunds[refund_id]
         return refund
     
-    async def get_charge(self, charge_id: str) -> Optional[dict]:
+    async def get_refund_balance(self, charge_id: str) -> Tuple[int, int]:
+        """
+        Return (refunded, remaining) minor units for a charge in O(1).
+        
+        Raises:
+            ChargeNotFound: If the charge doesn't exist
+        """
+        if self._shared:
+            return await self._storage.refund_balance(charge_id)
+        charge = self._lookup(charge_id)
+        if charge is None:
+            raise ChargeNotFound(f"Charge {charge_id} not found")
+        refunded = self._refunded_minor.get(charge_id, 0)
+        return refunded, charge.amount_minor - refunded
+    
+    @asynccontextmanager
+    async def _refund_lock(self, charge_id: str) -> AsyncIterator[None]:
+        """
+        Hold the refund lock for one charge.
+        
+        Locks exist only while some refund for the charge is running or
+        waiting, so the lock table stays as small as the in-flight set.
+        """
+        entry = self._refund_locks.get(charge_id)
+        if entry is None:
+            entry = self._refund_locks[charge_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._refund_locks[charge_id]
+    
+    @asynccontextmanager
+    async def _reserve_refund(
+        self,
+        charge: ChargeRecord,
+        requested_minor: Optional[int]
+    ) -> AsyncIterator[int]:
+        """
+        Check a refund against the charge's balance and hold that amount.
+        
+        Yields the amount to refund: `requested_minor`, or the remaining
+        balance if it is None. Locally the charge's refund lock is held
+        until the refund is indexed; in shared mode the store reserves
+        the amount and it is released if the refund fails.
+        """
+        if self._shared:
+            refund_minor = await self._storage.reserve_refund(charge.id, requested_minor)
+            try:
+                yield refund_minor
+            except BaseException:
+                await self._storage.release_refund(charge.id, refund_minor)
+                raise
+            return
+        
+        async with self._refund_lock(charge.id):
+            remaining = charge.amount_minor - self._refunded_minor.get(charge.id, 0)
+            if requested_minor is None:
+                if remaining <= 0:
+                    raise RefundExceedsCharge(f"Charge {charge.id} is already fully refunded")
+                yield remaining
+            elif requested_minor > remaining:
+                raise RefundExceedsCharge(
+                    f"Refund exceeds remaining balance of charge {charge.id}"
+                )
+            else:
+                yield requested_minor
+    
+    async def load(self) -> int:
+        """
+        Rebuild in-memory state and indexes from the storage backend, and
+        queue the webhook events its outbox still holds.
+        
+        Returns:
+            Number of charges and refunds loaded
+        """
+        if self._storage is None:
+            return 0
+        if self._claim_worker_id:
+            self._ids = IdGenerator(await self._storage.claim_worker_id())
+        loaded = 0
+        for charge in self._storage.iter_charges():
+            self._index_charge(charge)
+            loaded += 1
+            if self._over_budget():
+                await self._evict()
+        for refund in self._storage.iter_refunds():
+            self._index_refund(refund)
+            loaded += 1
+        if self._webhooks is not None:
+            # Events stored but not delivered before the last shutdown
+            for record in self._storage.iter_outbox():
+                if not self._webhooks.publish(event_type_of(record), record):
+                    break  # The rest stays in the outbox until the backlog drains
+        return loaded
+    
+    def readiness_probes(self) -> Dict[str, Callable[[], Awaitable[None]]]:
+        """Probes for the dependencies this processor is configured with."""
+        probes = {}
+        if self._storage is not None:
+            probes["database"] = self._storage.ping
+        if self._gateway is not None:
+            probes["payment_gateway"] = self._gateway.ping
+        return probes
+    
+    async def close(self) -> None:
+        """Drain webhooks, then flush and close the storage backend and gateway client."""
+        if self._webhooks is not None:
+            await self._webhooks.close()
+        if self._eviction is not None:
+            await self._eviction
+        if self._cold is not None:
+            self._cold.close()
+        if self._storage is not None:
+            await self._storage.close()
+        if self._gateway is not None:
+            await self._gateway.close()
+    
+    def _index_charge(self, charge: ChargeRecord) -> None:
+        # IDs almost always arrive in order, so insort is nearly always
+        # an append; charges that finished out of order slot in behind
+        self._charges[charge.id] = charge
+        insort(self._charge_log, charge.id)
+        insort(self._charges_by_order.setdefault(charge.order_id, []), charge.id)
+        insort(self._charges_by_customer.setdefault(charge.customer_id, []), charge.id)
+        self._settlement.add_charge(charge)
+        self._order_versions[charge.order_id] = self._order_versions.get(charge.order_id, 0) + 1
+        self._hot_bytes += _hot_size(charge)
+    
+    def _index_refund(self, refund: RefundRecord) -> None:
+        self._refunds[refund.id] = refund
+        insort(self._refund_log, refund.id)
+        self._refunds_by_charge.setdefault(refund.charge_id, []).append(refund.id)
+        self._refunded_minor[refund.charge_id] = (
+            self._refunded_minor.get(refund.charge_id, 0) + refund.amount_minor
+        )
+        charge = self._lookup(refund.charge_id)
+        self._settlement.add_refund(refund, charge.payment_method)
+        if charge.id in self._charges:
+            self._order_versions[charge.order_id] += 1
+    
+    def _over_budget(self) -> bool:
+        return self._cold is not None and self._hot_bytes > self._cold.memory_budget
+    
+    async def _make_room(self) -> None:
+        """
+        Start moving old charges to the cold tier once over budget.
+        
+        The move runs in the background; a charge only waits for it when
+        the hot tier is a quarter over budget, i.e. when charges arrive
+        faster than segments are written.
+        """
+        if not self._over_budget():
+            return
+        if self._eviction is None or self._eviction.done():
+            self._eviction = asyncio.get_running_loop().create_task(self._evict_logged())
+        if self._hot_bytes > self._cold.memory_budget * 5 // 4:
+            # Shielded so a cancelled request doesn't abandon the move
+            await asyncio.shield(self._eviction)
+    
+    async def _evict_logged(self) -> None:
+        try:
+            await self._evict()
+        except Exception:
+            # The charges stay in memory and the next charge tries again
+            logger.exception("Moving charges to the cold tier failed")
+    
+    async def _evict(self) -> None:
+        """
+        Move the oldest charges to the cold tier until the hot tier is
+        back down to three quarters of its budget.
+        
+        Only charges older than every charge still in flight are moved,
+        so later charges always sort after them and the moved charges
+        stay a prefix of the ID log while their segment is written.
+        """
+        horizon = next(iter(self._pending_charges), None)
+        target = self._cold.memory_budget * 3 // 4
+        log = self._charge_log
+        freed = 0
+        count = 0
+        while count < len(log) and self._hot_bytes - freed > target:
+            if horizon is not None and log[count] >= horizon:
+                break
+            freed += _hot_size(self._charges[log[count]])
+            count += 1
+        batch = [self._charges[charge_id] for charge_id in log[:count]]
+        await self._cold.add(batch)
+        self._drop_hot(batch)
+    
+    def _drop_hot(self, batch: List[ChargeRecord]) -> None:
+        """Remove charges now in the cold tier from memory and the indexes."""
+        # Lists are replaced rather than cut in place: walks in progress
+        # hold positions in the old ones, and find moved charges through
+        # _lookup()
+        self._charge_log = self._charge_log[len(batch):]
+        last = batch[-1].id if batch else None
+        for charge in batch:
+            del self._charges[charge.id]
+            self._hot_bytes -= _hot_size(charge)
+            for index, key in (
+                (self._charges_by_order, charge.order_id),
+                (self._charges_by_customer, charge.customer_id),
+            ):
+                ids = index.get(key)
+                if ids is not None:
+                    cut = bisect_right(ids, last)
+                    if cut == len(ids):
+                        del index[key]
+                    elif cut:
+                        index[key] = ids[cut:]
+            refunds = len(self._refunds_by_charge.get(charge.id, ()))
+            remaining = self._order_versions[charge.order_id] - 1 - refunds
+            if remaining:
+                self._order_versions[charge.order_id] = remaining
+            else:
+                del self._order_versions[charge.order_id]
+    
+    @timed("get_charge")
+    async def get_charge(self, charge_id: str) -> Optional[ChargeRecord]:
         """Get a charge by ID."""
-        return self._charges.get(charge_id)
+        return await self._find_charge(charge_id)
     
-    async def get_charges_by_order(self, order_id: str) -> List[dict]:
+    async def _find_charge(self, charge_id: str) -> Optional[ChargeRecord]:
+        if self._shared:
+            return await self._storage.get_charge(charge_id)
+        return self._lookup(charge_id)
+    
+    def _lookup(self, charge_id: str) -> Optional[ChargeRecord]:
+        charge = self._charges.get(charge_id)
+        if charge is None and self._cold is not None:
+            charge = self._cold.get(charge_id)
+        return charge
+    
+    def charge_version(self, charge_id: str) -> Optional[int]:
+        """
+        Counter that changes whenever the charge or its refunds change.
+        
+        None if the charge is unknown, or in shared mode, where another
+        worker may change it without this one knowing.
+        """
+        if self._shared or self._lookup(charge_id) is None:
+            return None
+        return len(self._refunds_by_charge.get(charge_id, ()))
+    
+    def order_version(self, order_id: str) -> Optional[int]:
+        """
+        Counter that changes whenever a charge or refund is added to the order.
+        
+        0 for an order with no charges; None in shared mode.
+        """
+        if self._shared:
+            return None
+        version = self._order_versions.get(order_id, 0)
+        if self._cold:
+            for charge in self._cold.find("order_id", order_id):
+                version += 1 + len(self._refunds_by_charge.get(charge.id, ()))
+        return version
+    
+    async def get_charges_by_order(self, order_id: str) -> List[ChargeRecord]:
         """Get all charges for an order."""
+        charges, _ = await self.list_charges_by_order(order_id)
+        return charges
+    
+    @timed("list_charges_by_order")
+    async def list_charges_by_order(
+        self,
+        order_id: str,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[ChargeRecord], Optional[str]]:
+        """
+        Get a page of charges for an order, oldest first.
+        
+        Args:
+            order_id: The order to look up
+            limit: Maximum number of charges to return (None for all)
+            cursor: next_cursor from a previous page
+        
+        Returns:
+            Tuple of (charges, next_cursor); next_cursor is None on the last page
+        """
+        if self._shared:
+            return await self._shared_page("order", order_id, limit, cursor)
+        ids = self._charges_by_order.get(order_id, [])
+        return self._page_tiers("order_id", order_id, ids, limit, cursor)
+    
+    @timed("list_charges_by_customer")
+    async def list_charges_by_customer(
+        self,
+        customer_id: str,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[ChargeRecord], Optional[str]]:
+        """Get a page of charges for a customer, oldest first."""
+        if self._shared:
+            return await self._shared_page("customer", customer_id, limit, cursor)
+        ids = self._charges_by_customer.get(customer_id, [])
+        return self._page_tiers("customer_id", customer_id, ids, limit, cursor)
+    
+    def _page_tiers(
+        self,
+        field: str,
+        key: str,
+        ids: List[str],
+        limit: Optional[int],
+        cursor: Optional[str]
+    ) -> Tuple[List[ChargeRecord], Optional[str]]:
+        """_page() over a hot index plus the cold tier's charges for the same key."""
+        if not self._cold:
+            return self._page(ids, self._charges, limit, cursor)
+        start = self._start_after(ids, "ch", cursor)
+        # One more than a page from each tier tells whether another page follows
+        take = None if limit is None else limit + 1
+        cold = list(islice(self._cold.find(field, key, after=cursor), take))
+        hot = ids[start:] if take is None else ids[start:start + take]
+        merged = list(heapq.merge((c.id for c in cold), hot))
+        store = ChainMap({c.id: c for c in cold}, self._charges)
+        return self._page(merged, store, limit, None)
+    
+    async def _shared_page(
+        self,
+        index: str,
+        key: str,
+        limit: Optional[int],
+        cursor: Optional[str]
+    ) -> Tuple[List[ChargeRecord], Optional[str]]:
+        start = self._parse_position(cursor)
+        charges, end = await self._storage.list_charges(index, key, start, limit)
+        return charges, None if end is None else str(end)
+    
+    async def get_refunds_by_charge(self, charge_id: str) -> List[RefundRecord]:
+        """Get all refunds issued against a charge."""
+        if self._shared:
+            return await self._storage.get_refunds(charge_id)
         return [
-            charge for charge in self._charges.values()
-            if charge["order_id"] == order_id
+            self._refunds[refund_id]
+            for refund_id in self._refunds_by_charge.get(charge_id, [])
         ]
+    
+    @timed("settlement_report")
+    async def settlement_report(
+        self,
+        currency: Optional[str] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None
+    ) -> List[dict]:
+        """
+        Settlement buckets in minor units, in O(buckets).
+        
+        See SettlementAggregates.report() for arguments.
+        """
+        if self._shared:
+            return await self._storage.settlement_report(currency, date_from, date_to)
+        return self._settlement.report(currency, date_from, date_to)
+    
+    def iter_charges(
+        self,
+        cursor: Optional[str] = None,
+        created_from: Optional[float] = None,
+        created_to: Optional[float] = None,
+        currency: Optional[str] = None,
+        status: Optional[str] = None,
+        customer_id: Optional[str] = None
+    ) -> Iterator[Tuple[str, ChargeRecord]]:
+        """
+        Walk charges in creation order without materializing a result list.
+        
+        The cursor and time bounds are located by bisecting the time
+        index, so a range costs O(log n) plus the charges in it.
+        
+        Args:
+            cursor: Resume after the item that yielded this cursor; only
+                valid when repeated with the same filters
+            created_from: Inclusive lower bound on created_at (epoch seconds)
+            created_to: Exclusive upper bound on created_at (epoch seconds)
+            currency, status, customer_id: Exact-match filters
+        
+        Returns:
+            Iterator of (cursor, charge) tuples
+        
+        Raises:
+            ValueError: If the cursor is malformed (raised immediately)
+        """
+        # A customer filter walks that customer's index instead of the whole log
+        if customer_id is not None:
+            ids = self._charges_by_customer.get(customer_id, [])
+        else:
+            ids = self._charge_log
+        
+        def matches(charge: ChargeRecord) -> bool:
+            return (
+                (currency is None or charge.currency == currency)
+                and (status is None or charge.status == status)
+            )
+        
+        hot = self._walk(
+            ids, "ch", cursor, created_from, created_to,
+            self._lookup, self._pending_charges, matches
+        )
+        if not self._cold:
+            return hot
+        start = None if created_from is None else id_lower_bound("ch", created_from)
+        stop = None if created_to is None else id_lower_bound("ch", created_to)
+        if customer_id is not None:
+            cold = self._cold.find("customer_id", customer_id, cursor, start, stop)
+        else:
+            cold = self._cold.scan(cursor, start, stop)
+        rows = ((charge.id, charge) for charge in cold if matches(charge))
+        return heapq.merge(rows, hot, key=itemgetter(0))
+    
+    def iter_refunds(
+        self,
+        cursor: Optional[str] = None,
+        created_from: Optional[float] = None,
+        created_to: Optional[float] = None,
+        currency: Optional[str] = None,
+        status: Optional[str] = None,
+        customer_id: Optional[str] = None
+    ) -> Iterator[Tuple[str, RefundRecord]]:
+        """Walk refunds in creation order; see iter_charges() for arguments."""
+        def matches(refund: RefundRecord) -> bool:
+            return (
+                (currency is None or refund.currency == currency)
+                and (status is None or refund.status == status)
+                and (customer_id is None
+                     or self._lookup(refund.charge_id).customer_id == customer_id)
+            )
+        
+        return self._walk(
+            self._refund_log, "re", cursor, created_from, created_to,
+            self._refunds.__getitem__, self._pending_refunds, matches
+        )
+    
+    def stream_records(
+        self,
+        kind: str,
+        cursor: Optional[str] = None,
+        **filters
+    ) -> AsyncIterator[Tuple[str, object]]:
+        """
+        Asynchronously walk "charges" or "refunds" for exports.
+        
+        Takes the same arguments and yields the same (cursor, record)
+        tuples as iter_charges()/iter_refunds(). In shared mode the walk
+        pages through the store's creation-order log instead.
+        
+        Raises:
+            ValueError: If the cursor is malformed (raised immediately)
+        """
+        if self._shared:
+            return self._scan_shared(kind, self._parse_position(cursor), filters)
+        iterate = self.iter_charges if kind == "charges" else self.iter_refunds
+        return self._aiter(iterate(cursor=cursor, **filters))
+    
+    @staticmethod
+    async def _aiter(rows: Iterator[Tuple[str, object]]) -> AsyncIterator[Tuple[str, object]]:
+        for row in rows:
+            yield row
+    
+    async def _scan_shared(
+        self,
+        kind: str,
+        start: Optional[int],
+        filters: dict
+    ) -> AsyncIterator[Tuple[str, object]]:
+        while start is not None:
+            rows, start = await self._storage.scan(kind, start, filters)
+            for position, record in rows:
+                yield str(position), record
+    
+    def _walk(
+        self,
+        ids: List[str],
+        prefix: str,
+        cursor: Optional[str],
+        created_from: Optional[float],
+        created_to: Optional[float],
+        lookup: Callable[[str], object],
+        pending: "OrderedDict[str, None]",
+        matches
+    ) -> Iterator[Tuple[str, object]]:
+        """Bisect a sorted ID list to the cursor and time range, then walk it."""
+        start = self._start_after(ids, prefix, cursor)
+        if created_from is not None:
+            start = max(start, bisect_left(ids, id_lower_bound(prefix, created_from)))
+        upper = None if created_to is None else id_lower_bound(prefix, created_to)
+        if not ids:
+            return iter(())
+        # Stop at the newest ID seen now, so the walk is a stable snapshot
+        return self._walk_range(ids, start, ids[-1], upper, lookup, pending, matches)
+    
+    @staticmethod
+    def _walk_range(ids, position, last, upper, lookup, pending, matches):
+        # Everything inserted from now on sorts after the oldest pending ID,
+        # so the items before it, including the walk's position, never shift
+        while position < len(ids):
+            record_id = ids[position]
+            if record_id > last or (upper is not None and record_id >= upper):
+                return
+            if pending and record_id >= next(iter(pending)):
+                return
+            record = lookup(record_id)
+            if matches(record):
+                yield record_id, record
+            position += 1
+    
+    @staticmethod
+    def _start_after(ids: List[str], prefix: str, cursor: Optional[str]) -> int:
+        """Position just after the ID cursor in a sorted ID list."""
+        if cursor is None:
+            return 0
+        if not is_valid_id(cursor, prefix):
+            raise ValueError(f"Invalid cursor: {cursor}")
+        return bisect_right(ids, cursor)
+    
+    @staticmethod
+    def _parse_position(cursor: Optional[str]) -> int:
+        """Turn a shared store's position cursor into a list offset."""
+        if cursor is None:
+            return 0
+        if not cursor.isdigit():
+            raise ValueError(f"Invalid cursor: {cursor}")
+        return int(cursor)
+    
+    @staticmethod
+    def _page(
+        ids: List[str],
+        store: Dict[str, ChargeRecord],
+        limit: Optional[int],
+        cursor: Optional[str]
+    ) -> Tuple[List[ChargeRecord], Optional[str]]:
+        """
+        Slice a sorted charge ID list into a page.
+        
+        The cursor is the last ID of the previous page, found by
+        bisection, so each page costs O(log n + limit).
+        """
+        start = PaymentProcessor._start_after(ids, "ch", cursor)
+        end = len(ids) if limit is None else min(start + limit, len(ids))
+        items = [store[item_id] for item_id in ids[start:end]]
+        next_cursor = ids[end - 1] if end < len(ids) else None
+        return items, next_cursor
@@ -0,0 +1,97 @@
+"""
+Memory-bounded rate limiting
+
+RateLimiter implements GCRA, the generic cell rate algorithm, which
+behaves like a token bucket but stores one float per key. Keys are
+spread over shards, and each shard is an LRU with a fixed capacity, so
+memory stays bounded however many distinct customers and API keys show
+up.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+
+class RateLimiter:
+    """
+    Allow `rate` requests per second per key, in bursts of up to `burst`.
+    
+    Each key stores its theoretical arrival time (TAT): when the next
+    request would be due if requests arrived evenly. Refill is implicit
+    in the clock, so a check is O(1) with no background work. Evicting
+    an idle key only resets it to a full bucket; a key whose TAT has
+    passed is already indistinguishable from a new one.
+    
+    All checks run on the event loop, so shards need no locks.
+    """
+    
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        max_keys: int = 1000000,
+        shards: int = 16,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        self.burst = burst
+        self._interval = 1.0 / rate
+        self._tolerance = self._interval * burst
+        self._shard_capacity = max(1, max_keys // shards)
+        self._shards: List["OrderedDict[str, float]"] = [OrderedDict() for _ in range(shards)]
+        self._clock = clock
+    
+    def check(self, key: str, cost: int = 1) -> float:
+        """Like acquire(), but takes no quota."""
+        shard = self._shards[hash(key) % len(self._shards)]
+        now = self._clock()
+        tat = max(shard.get(key, now), now)
+        return max(0.0, tat + self._interval * cost - now - self._tolerance)
+    
+    def acquire(self, key: str, cost: int = 1) -> float:
+        """
+        Take `cost` requests' worth of quota for `key`, or none of it.
+        
+        A cost above `burst` is never allowed.
+        
+        Returns:
+            0.0 if the requests are allowed, otherwise the seconds until they would be
+        """
+        shard = self._shards[hash(key) % len(self._shards)]
+        now = self._clock()
+        tat = max(shard.get(key, now), now)
+        new_tat = tat + self._interval * cost
+        retry_after = new_tat - now - self._tolerance
+        if retry_after > 0:
+            # Rejected requests don't use quota, but the key is still active
+            if key in shard:
+                shard.move_to_end(key)
+            return retry_after
+        
+        shard[key] = new_tat
+        shard.move_to_end(key)
+        if len(shard) > self._shard_capacity:
+            shard.popitem(last=False)
+        return 0.0
+    
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+
+def rate_limiter_from_env(prefix: str, rate: float, burst: int) -> Optional[RateLimiter]:
+    """
+    Build a limiter from {prefix}_RPS and {prefix}_BURST.
+    
+    A rate of 0 disables the limiter. RATE_LIMIT_MAX_KEYS caps the keys
+    tracked by each limiter.
+    """
+    rate = float(os.getenv(f"{prefix}_RPS", rate))
+    if rate <= 0:
+        return None
+    return RateLimiter(
+        rate,
+        int(os.getenv(f"{prefix}_BURST", burst)),
+        max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", 1000000))
+    )
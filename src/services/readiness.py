@@ -0,0 +1,118 @@
+"""
+Background readiness probes
+
+ReadinessMonitor probes the service's dependencies on a fixed interval
+in a background task and caches the results. /ready only reads that
+cache, so however often orchestrators poll it, dependencies see one
+probe per interval and the payment hot path sees none.
+"""
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+Probe = Callable[[], Awaitable[None]]
+
+
+class ReadinessMonitor:
+    """
+    Periodically run named probes and keep their latest results.
+    
+    A probe passes by returning and fails by raising or by taking longer
+    than `timeout`. A result older than `max_staleness` counts as a
+    failure, so a stuck monitor can't keep reporting a healthy pod.
+    """
+    
+    def __init__(
+        self,
+        probes: Dict[str, Probe],
+        interval: float = 5.0,
+        timeout: float = 2.0,
+        max_staleness: float = 15.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.probes = probes
+        self.interval = interval
+        self.timeout = timeout
+        self.max_staleness = max_staleness
+        self._clock = clock
+        # name -> (passed, detail, checked_at)
+        self._results: Dict[str, tuple] = {}
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def refresh(self) -> None:
+        """Run every probe once, concurrently, and record the results."""
+        names = list(self.probes)
+        outcomes = await asyncio.gather(
+            *(self._probe(self.probes[name]) for name in names)
+        )
+        checked_at = self._clock()
+        for name, (passed, detail) in zip(names, outcomes):
+            self._results[name] = (passed, detail, checked_at)
+    
+    async def _probe(self, probe: Probe) -> tuple:
+        try:
+            await asyncio.wait_for(probe(), self.timeout)
+        except asyncio.TimeoutError:
+            return False, f"timed out after {self.timeout}s"
+        except Exception as e:
+            return False, str(e) or type(e).__name__
+        return True, None
+    
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+    
+    def snapshot(self) -> dict:
+        """
+        Readiness from cached results, without running any probe.
+        
+        Returns:
+            {"ready": bool, "checks": {name: {"status", "age_seconds", "error"?}}}
+            with status "ok", "failing", "stale" or "pending"
+        """
+        now = self._clock()
+        checks = {}
+        for name in self.probes:
+            result = self._results.get(name)
+            if result is None:
+                checks[name] = {"status": "pending", "age_seconds": None}
+                continue
+            passed, detail, checked_at = result
+            age = now - checked_at
+            if age > self.max_staleness:
+                status = "stale"
+            else:
+                status = "ok" if passed else "failing"
+            check = {"status": status, "age_seconds": round(age, 3)}
+            if detail is not None:
+                check["error"] = detail
+            checks[name] = check
+        return {
+            "ready": all(check["status"] == "ok" for check in checks.values()),
+            "checks": checks,
+        }
+
+
+def readiness_monitor_from_env(probes: Dict[str, Probe]) -> ReadinessMonitor:
+    """Build a monitor using the READINESS_* environment variables."""
+    return ReadinessMonitor(
+        probes,
+        interval=float(os.getenv("READINESS_INTERVAL_SECONDS", 5.0)),
+        timeout=float(os.getenv("READINESS_TIMEOUT_SECONDS", 2.0)),
+        max_staleness=float(os.getenv("READINESS_MAX_STALENESS_SECONDS", 15.0))
+    )
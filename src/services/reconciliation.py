@@ -0,0 +1,340 @@
+"""
+Settlement reconciliation
+
+Matches the payment processor's daily settlement file against our
+charges and refunds. Our records for the period are packed into a
+Ledger (an ID -> position index with amounts and currencies in flat
+arrays), which every worker of a process pool receives once, by fork
+where available. The settlement file is then read in line-aligned
+chunks of raw bytes; workers parse their chunk and probe the ledger
+(a hash join on the ID, then a comparison of amount and currency), and
+the parent keeps one byte per ledger record to tell which were settled.
+However large the file, memory is the ledger plus the chunks in flight.
+
+The file is CSV with a header row naming at least the `reference` (our
+charge or refund ID), `amount` (decimal, in major units) and `currency`
+columns. Quoted fields, such as descriptions, may span lines. The sign
+of the amount is ignored, since processors list refunds as negative
+amounts.
+
+Usage:
+    python -m src.services.reconciliation settlement.csv \\
+        --date-from 2024-01-01 --date-to 2024-01-01 --output discrepancies.csv
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal, DecimalException, ROUND_HALF_UP
+from typing import BinaryIO, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ..utils.money import currency_exponent, from_minor_units
+from .payment_processor import PaymentProcessor
+
+MISSING = "missing"
+EXTRA = "extra"
+AMOUNT_MISMATCH = "amount_mismatch"
+DUPLICATE = "duplicate"
+INVALID = "invalid"
+
+REQUIRED_COLUMNS = ("reference", "amount", "currency")
+
+# (kind, id, currency, expected_minor, settled_minor)
+Discrepancy = Tuple[str, str, str, Optional[int], Optional[int]]
+
+
+class Ledger:
+    """Amount and currency of each of our charges and refunds, by ID."""
+    
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.ids: List[str] = []
+        self.amounts = array("q")
+        self.currencies: List[str] = []
+    
+    def add(self, record) -> None:
+        if record.id in self.index:
+            return
+        self.index[record.id] = len(self.ids)
+        self.ids.append(record.id)
+        self.amounts.append(record.amount_minor)
+        self.currencies.append(record.currency)
+    
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+
+async def build_ledger(
+    processor: PaymentProcessor,
+    created_from: Optional[float] = None,
+    created_to: Optional[float] = None
+) -> Ledger:
+    """Ledger of the processor's charges and refunds created in [created_from, created_to)."""
+    ledger = Ledger()
+    for kind in ("charges", "refunds"):
+        async for _, record in processor.stream_records(
+            kind, created_from=created_from, created_to=created_to
+        ):
+            ledger.add(record)
+    return ledger
+
+
+def read_ledger(
+    records: Iterable,
+    created_from: Optional[float] = None,
+    created_to: Optional[float] = None
+) -> Ledger:
+    """Ledger of the stored `records` created in [created_from, created_to)."""
+    ledger = Ledger()
+    for record in records:
+        if ((created_from is None or record.created_at >= created_from)
+                and (created_to is None or record.created_at < created_to)):
+            ledger.add(record)
+    return ledger
+
+
+def read_chunks(f: BinaryIO, chunk_bytes: int) -> Iterator[bytes]:
+    """
+    Yield about `chunk_bytes` at a time from `f`, always ending on a row break.
+    
+    A line break inside a quoted field doesn't end the row. Quotes in CSV
+    come in pairs (a quote inside a field is doubled), and chunks start
+    on row breaks, so a chunk ends inside a field exactly when it holds an
+    odd number of quotes.
+    """
+    while True:
+        chunk = f.read(chunk_bytes)
+        if not chunk:
+            return
+        if not chunk.endswith(b"\n"):
+            chunk += f.readline()
+        quotes = chunk.count(b'"')
+        while quotes % 2:
+            line = f.readline()
+            if not line:
+                break
+            chunk += line
+            quotes += line.count(b'"')
+        yield chunk
+
+
+def parse_minor(amount: str, currency: str) -> int:
+    """
+    Minor units of a decimal amount, rounding half up and ignoring the sign.
+    
+    Raises:
+        DecimalException: If the amount is not a number or is out of range
+        ValueError: If the amount is infinite or NaN
+    """
+    exponent = currency_exponent(currency)
+    whole, _, fraction = amount.strip().lstrip("+-").partition(".")
+    # Plain amounts with no more decimals than the currency has: integer
+    # math. isdigit() alone also accepts digits such as "²" that int() rejects.
+    if (whole.isascii() and whole.isdigit() and len(fraction) <= exponent
+            and (not fraction or (fraction.isascii() and fraction.isdigit()))):
+        return int(whole) * 10 ** exponent + int(fraction.ljust(exponent, "0") or 0)
+    value = Decimal(amount.strip())
+    if not value.is_finite():
+        raise ValueError(f"Amount {amount!r} is not finite")
+    scaled = value.copy_abs().scaleb(exponent)
+    return int(scaled.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+# Set in each worker by _init_worker
+_ledger: Optional[Ledger] = None
+
+
+def _init_worker(ledger: Ledger) -> None:
+    global _ledger
+    _ledger = ledger
+
+
+def _match_chunk(chunk: bytes, columns: Tuple[int, int, int]) -> Tuple[int, array, List[Discrepancy]]:
+    """
+    Probe the ledger with one chunk of settlement rows.
+    
+    Returns:
+        (rows, ledger positions settled, discrepancies found in the chunk)
+    """
+    index, amounts, currencies = _ledger.index, _ledger.amounts, _ledger.currencies
+    reference_column, amount_column, currency_column = columns
+    width = max(columns) + 1
+    settled = array("q")
+    discrepancies: List[Discrepancy] = []
+    # Settlement amounts repeat a lot (price points), so parse each once
+    parsed: Dict[str, int] = {}
+    rows = 0
+    for row in csv.reader(io.StringIO(chunk.decode("utf-8"))):
+        if not row:
+            continue
+        rows += 1
+        if len(row) < width:
+            discrepancies.append((INVALID, row[0] if row else "", "", None, None))
+            continue
+        reference, currency, amount = row[reference_column], row[currency_column], row[amount_column]
+        key = currency + amount
+        amount_minor = parsed.get(key)
+        if amount_minor is None:
+            try:
+                amount_minor = parsed[key] = parse_minor(amount, currency)
+            except (DecimalException, ValueError):
+                discrepancies.append((INVALID, reference, currency, None, None))
+                continue
+        position = index.get(reference)
+        if position is None:
+            discrepancies.append((EXTRA, reference, currency, None, amount_minor))
+            continue
+        settled.append(position)
+        if amounts[position] != amount_minor or currencies[position] != currency:
+            discrepancies.append((
+                AMOUNT_MISMATCH, reference, currency, amounts[position], amount_minor
+            ))
+    return rows, settled, discrepancies
+
+
+def _columns(header: bytes) -> Tuple[int, int, int]:
+    names = [name.strip().lower() for name in next(csv.reader([header.decode("utf-8-sig")]))]
+    missing = [name for name in REQUIRED_COLUMNS if name not in names]
+    if missing:
+        raise ValueError(f"Settlement file has no {', '.join(missing)} column")
+    return tuple(names.index(name) for name in REQUIRED_COLUMNS)
+
+
+def reconcile(
+    f: BinaryIO,
+    ledger: Ledger,
+    on_discrepancy: Callable[[Discrepancy], None],
+    workers: Optional[int] = None,
+    chunk_bytes: int = 8 * 1024 * 1024
+) -> Dict[str, int]:
+    """
+    Match a settlement file against `ledger`.
+    
+    Args:
+        f: Settlement CSV opened in binary mode
+        ledger: Our records for the settlement period
+        on_discrepancy: Called with each discrepancy as it is found;
+            missing records are reported last
+        workers: Worker processes (default: one per CPU); 0 matches in
+            this process
+        chunk_bytes: Bytes of the file per chunk
+    
+    Returns:
+        Counts of settlement rows, matched records and each kind of
+        discrepancy
+    
+    Raises:
+        ValueError: If the header lacks a required column
+    """
+    columns = _columns(f.readline())
+    counts = {"rows": 0, "matched": 0, MISSING: 0, EXTRA: 0, AMOUNT_MISMATCH: 0, DUPLICATE: 0, INVALID: 0}
+    seen = bytearray(len(ledger))
+    
+    def collect(result: Tuple[int, array, List[Discrepancy]]) -> None:
+        rows, settled, discrepancies = result
+        counts["rows"] += rows
+        mismatched = set()
+        for discrepancy in discrepancies:
+            counts[discrepancy[0]] += 1
+            if discrepancy[0] == AMOUNT_MISMATCH:
+                mismatched.add(ledger.index[discrepancy[1]])
+            on_discrepancy(discrepancy)
+        for position in settled:
+            if seen[position]:
+                counts[DUPLICATE] += 1
+                on_discrepancy((DUPLICATE, ledger.ids[position], ledger.currencies[position],
+                                ledger.amounts[position], None))
+                continue
+            seen[position] = 1
+            if position not in mismatched:
+                counts["matched"] += 1
+    
+    if workers == 0:
+        _init_worker(ledger)
+        for chunk in read_chunks(f, chunk_bytes):
+            collect(_match_chunk(chunk, columns))
+    else:
+        workers = workers or os.cpu_count() or 1
+        # Fork hands the ledger to workers without pickling it
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        with ProcessPoolExecutor(workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(ledger,)) as pool:
+            in_flight: Deque[Future] = deque()
+            for chunk in read_chunks(f, chunk_bytes):
+                # Bound the chunks held in memory
+                if len(in_flight) >= 2 * workers:
+                    collect(in_flight.popleft().result())
+                in_flight.append(pool.submit(_match_chunk, chunk, columns))
+            while in_flight:
+                collect(in_flight.popleft().result())
+    
+    for position, record_id in enumerate(ledger.ids):
+        if not seen[position]:
+            counts[MISSING] += 1
+            on_discrepancy((MISSING, record_id, ledger.currencies[position], ledger.amounts[position], None))
+    return counts
+
+
+def _day_start(value: date) -> float:
+    return datetime(value.year, value.month, value.day, tzinfo=timezone.utc).timestamp()
+
+
+def _load_ledger(date_from: Optional[date], date_to: Optional[date]) -> Ledger:
+    # Straight from the files, read-only: opening the service's storage or
+    # cold tier here would repair, compact and clear files it is using
+    from .storage import read_records_from_env
+    return read_ledger(
+        itertools.chain(read_records_from_env("charges"), read_records_from_env("refunds")),
+        created_from=None if date_from is None else _day_start(date_from),
+        created_to=None if date_to is None else _day_start(date_to + timedelta(days=1))
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("settlement", help="Settlement CSV from the payment processor")
+    parser.add_argument("--date-from", type=date.fromisoformat, help="First day of our records to match (UTC)")
+    parser.add_argument("--date-to", type=date.fromisoformat, help="Last day of our records to match (UTC)")
+    parser.add_argument("--output", help="Write discrepancies to this CSV (default: stdout)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPUs)")
+    parser.add_argument("--chunk-mb", type=float, default=8, help="Settlement file read per chunk")
+    args = parser.parse_args()
+    
+    # Records come from the same storage the service is configured with
+    try:
+        ledger = _load_ledger(args.date_from, args.date_to)
+    except ValueError as e:
+        parser.error(str(e))
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = csv.writer(out)
+        writer.writerow(["type", "reference", "currency", "expected_amount", "settled_amount"])
+        
+        def write(discrepancy: Discrepancy) -> None:
+            kind, reference, currency, expected, settled = discrepancy
+            writer.writerow([
+                kind, reference, currency,
+                "" if expected is None else from_minor_units(expected, currency),
+                "" if settled is None else from_minor_units(settled, currency),
+            ])
+        
+        with open(args.settlement, "rb") as f:
+            counts = reconcile(f, ledger, write, workers=args.workers,
+                               chunk_bytes=int(args.chunk_mb * 1024 * 1024))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(json.dumps({"records": len(ledger), **counts}), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Compact charge and refund records
+
+PaymentProcessor holds millions of these, so they use __slots__ instead
+of a per-record dict, keep amounts as integer minor units and timestamps
+as epoch seconds, and intern the low-cardinality strings (currency,
+payment method, status) so every record shares one copy. Records are
+converted to API dicts only when a response is serialized.
+"""
+import sys
+from datetime import datetime
+from typing import Optional
+
+from ..utils.money import from_minor_units
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.utcfromtimestamp(timestamp).isoformat()
+
+
+class ChargeRecord:
+    """A single charge."""
+    
+    __slots__ = (
+        "id", "order_id", "amount_minor", "currency", "customer_id",
+        "payment_method", "status", "created_at",
+    )
+    
+    def __init__(
+        self,
+        id: str,
+        order_id: str,
+        amount_minor: int,
+        currency: str,
+        customer_id: str,
+        payment_method: str,
+        status: str,
+        created_at: float
+    ):
+        self.id = id
+        self.order_id = order_id
+        self.amount_minor = amount_minor
+        self.currency = sys.intern(currency)
+        self.customer_id = customer_id
+        self.payment_method = sys.intern(payment_method)
+        self.status = sys.intern(status)
+        self.created_at = created_at
+    
+    @property
+    def amount(self) -> float:
+        return from_minor_units(self.amount_minor, self.currency)
+    
+    def to_dict(self) -> dict:
+        """Serialize to the API representation."""
+        return {
+            "id": self.id,
+            "order_id": self.order_id,
+            "amount": self.amount,
+            "currency": self.currency,
+            "customer_id": self.customer_id,
+            "payment_method": self.payment_method,
+            "status": self.status,
+            "created_at": _isoformat(self.created_at),
+        }
+    
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ChargeRecord):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+    
+    __hash__ = None
+    
+    def __repr__(self) -> str:
+        return f"ChargeRecord(id={self.id!r}, order_id={self.order_id!r}, amount_minor={self.amount_minor})"
+
+
+class RefundRecord:
+    """A single refund against a charge."""
+    
+    __slots__ = (
+        "id", "charge_id", "amount_minor", "currency", "reason", "status", "created_at",
+    )
+    
+    def __init__(
+        self,
+        id: str,
+        charge_id: str,
+        amount_minor: int,
+        currency: str,
+        reason: Optional[str],
+        status: str,
+        created_at: float
+    ):
+        self.id = id
+        self.charge_id = charge_id
+        self.amount_minor = amount_minor
+        self.currency = sys.intern(currency)
+        self.reason = reason
+        self.status = sys.intern(status)
+        self.created_at = created_at
+    
+    @property
+    def amount(self) -> float:
+        return from_minor_units(self.amount_minor, self.currency)
+    
+    def to_dict(self) -> dict:
+        """Serialize to the API representation."""
+        return {
+            "id": self.id,
+            "charge_id": self.charge_id,
+            "amount": self.amount,
+            "reason": self.reason,
+            "status": self.status,
+            "created_at": _isoformat(self.created_at),
+        }
+    
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, RefundRecord):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+    
+    __hash__ = None
+    
+    def __repr__(self) -> str:
+        return f"RefundRecord(id={self.id!r}, charge_id={self.charge_id!r}, amount_minor={self.amount_minor})"
@@ -0,0 +1,77 @@
+"""
+Pre-serialized response cache
+
+Polled lookups answer with the same JSON until the resource changes.
+ResponseCache keeps the encoded body for each URL together with the
+version of the resource it was built from. A read at the same version
+returns the bytes as they are, without building or serializing
+anything. Once charge() or refund() bumps the version, the old entry no
+longer matches and is replaced on the next read.
+"""
+import json
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+
+def encode_json(content: Any) -> bytes:
+    """Encode a response body the way FastAPI's JSONResponse does."""
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def make_etag(version: int) -> str:
+    return f'"v{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header value matches `etag` (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    """
+    Bounded LRU of encoded response bodies tagged with a version.
+    
+    Args:
+        max_entries: Bodies kept before the least recently used is evicted;
+            0 disables the cache
+    """
+    
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # url -> (version, body), least recently used first
+        self._entries: "OrderedDict[str, Tuple[int, bytes]]" = OrderedDict()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def get(self, key: str, version: int) -> Optional[bytes]:
+        """The cached body for `key` if it was built at `version`."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+    
+    def put(self, key: str, version: int, body: bytes) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (version, body)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,149 @@
+"""
+Running settlement aggregates
+
+Totals are kept per (currency, day, payment_method, status) bucket and
+updated as each charge and refund is recorded, so a report costs
+O(buckets) no matter how many charges are stored. Charges count toward
+the day they were created; refunds toward the day they were issued,
+under the refunded charge's payment method.
+"""
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from ..utils.formatting import format_amounts
+from ..utils.money import Money
+from .records import ChargeRecord, RefundRecord
+
+SECONDS_PER_DAY = 86400
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Bucket counters: [charge_count, gross_minor, refund_count, refunded_minor]
+_CHARGE_COUNT, _GROSS, _REFUND_COUNT, _REFUNDED = range(4)
+
+BucketKey = Tuple[str, int, str, str]
+
+# Amount fields of report rows, kept as <field>_minor until summarize()
+_AMOUNTS = ("gross", "refunded", "net")
+
+
+def _day_number(timestamp: float) -> int:
+    return int(timestamp // SECONDS_PER_DAY)
+
+
+def _day_of(value: date) -> int:
+    return value.toordinal() - _EPOCH_ORDINAL
+
+
+class SettlementAggregates:
+    """Gross, refunded and net totals per settlement bucket."""
+    
+    def __init__(self):
+        self._buckets: Dict[BucketKey, List[int]] = {}
+    
+    def add_charge(self, charge: ChargeRecord) -> None:
+        bucket = self._bucket(
+            charge.currency, charge.created_at, charge.payment_method, charge.status
+        )
+        bucket[_CHARGE_COUNT] += 1
+        bucket[_GROSS] += charge.amount_minor
+    
+    def add_refund(self, refund: RefundRecord, payment_method: str) -> None:
+        bucket = self._bucket(refund.currency, refund.created_at, payment_method, refund.status)
+        bucket[_REFUND_COUNT] += 1
+        bucket[_REFUNDED] += refund.amount_minor
+    
+    def _bucket(self, currency: str, created_at: float, payment_method: str, status: str) -> List[int]:
+        key = (currency, _day_number(created_at), payment_method, status)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [0, 0, 0, 0]
+        return bucket
+    
+    def report(
+        self,
+        currency: Optional[str] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None
+    ) -> List[dict]:
+        """
+        Buckets sorted by day, currency, payment method and status.
+        
+        Args:
+            currency: Only report this currency
+            date_from: First day to include (UTC)
+            date_to: Last day to include (UTC)
+        
+        Returns:
+            One dict per bucket with counts and gross/refunded/net amounts
+        """
+        first = None if date_from is None else _day_of(date_from)
+        last = None if date_to is None else _day_of(date_to)
+        rows = []
+        for key in sorted(self._buckets, key=lambda k: (k[1], k[0], k[2], k[3])):
+            bucket_currency, day, payment_method, status = key
+            if ((currency is not None and bucket_currency != currency)
+                    or (first is not None and day < first)
+                    or (last is not None and day > last)):
+                continue
+            counts = self._buckets[key]
+            rows.append({
+                "currency": bucket_currency,
+                "date": date.fromordinal(day + _EPOCH_ORDINAL).isoformat(),
+                "payment_method": payment_method,
+                "status": status,
+                "charge_count": counts[_CHARGE_COUNT],
+                "refund_count": counts[_REFUND_COUNT],
+                "gross_minor": counts[_GROSS],
+                "refunded_minor": counts[_REFUNDED],
+                "net_minor": counts[_GROSS] - counts[_REFUNDED],
+            })
+        return rows
+
+
+def summarize(buckets: List[dict], locale: Optional[str] = None) -> dict:
+    """
+    Convert report buckets to major units and total them per currency.
+    
+    With a locale, each bucket and total also gets a "display" dict of
+    its gross, refunded and net amounts formatted for that locale.
+    
+    Raises:
+        ValueError: If the locale is not supported
+    
+    Returns:
+        {"buckets": [...], "totals": {currency: {...}}}
+    """
+    totals: Dict[str, dict] = {}
+    out = []
+    for row in buckets:
+        currency = row["currency"]
+        bucket = _with_money(row)
+        total = totals.get(currency)
+        if total is None:
+            total = totals[currency] = {
+                "charge_count": 0, "refund_count": 0, **dict.fromkeys(_AMOUNTS, Money(0, currency)),
+            }
+        for field in total:
+            total[field] += bucket[field]
+        out.append(bucket)
+    totals = dict(sorted(totals.items()))
+    rows = out + list(totals.values())
+    if locale is not None:
+        # Format the whole report in one batch, looking up each currency's formatter once
+        formatted = iter(format_amounts(
+            ((row[field].amount_minor, row[field].currency) for row in rows for field in _AMOUNTS), locale
+        ))
+        for row in rows:
+            row["display"] = {field: next(formatted) for field in _AMOUNTS}
+    for row in rows:
+        for field in _AMOUNTS:
+            row[field] = row[field].amount
+    return {"buckets": out, "totals": totals}
+
+
+def _with_money(row: dict) -> dict:
+    """A report row with its minor-unit amounts as Money."""
+    converted = {k: v for k, v in row.items() if not k.endswith("_minor")}
+    for field in _AMOUNTS:
+        converted[field] = Money(row[f"{field}_minor"], row["currency"])
+    return converted
@@ -0,0 +1,546 @@
+"""
+Shared charge store for multi-worker deployments
+
+With `uvicorn --workers N` each worker process has its own
+PaymentProcessor. In shared mode every worker uses SharedStorage, a
+client for one local store-server process that holds all charges,
+refunds and indexes, so a charge acknowledged by one worker is visible
+to every worker immediately.
+
+The server handles each client connection on its own thread. State is
+split into shards by key, each behind its own lock, so requests for
+different charges, orders and customers don't contend. Refund balances
+are checked and reserved on the server under the charge's shard lock,
+which keeps the refund ledger correct across workers.
+
+The server serves from memory. With PAYMENTS_WAL_DIR or PAYMENTS_DB_PATH
+set it also writes every charge and refund through to that backend
+before acknowledging it, and reloads from it on startup; without them
+state lasts only as long as the server process.
+
+Usage:
+    PAYMENTS_WAL_DIR=/var/lib/payments/wal python -m src.services.shared_store --socket /tmp/payments-store.sock
+    PAYMENTS_SHARED_STORE=/tmp/payments-store.sock uvicorn src.main:app --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import threading
+from datetime import date
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from ..utils.ids import MAX_WORKER_ID
+from .errors import ChargeNotFound, RefundExceedsCharge
+from .records import ChargeRecord, RefundRecord
+from .settlement import SettlementAggregates
+from .storage import StorageBackend, durable_storage_from_env
+
+# Records travel as JSON lists in __slots__ order
+_CHARGE = {name: i for i, name in enumerate(ChargeRecord.__slots__)}
+_REFUND = {name: i for i, name in enumerate(RefundRecord.__slots__)}
+
+
+def _row(record) -> list:
+    return [getattr(record, field) for field in record.__slots__]
+
+
+# Every message is a 4-byte big-endian length followed by a JSON body
+_HEADER = struct.Struct(">I")
+
+# Log entries examined per scan request, which bounds how long one
+# export page can hold a server thread
+SCAN_PAGE_SIZE = 1000
+
+
+class SharedStoreError(Exception):
+    """The store server rejected or failed a request."""
+
+
+class _StoreError(Exception):
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+def _frame(message: Any) -> bytes:
+    body = json.dumps(message, separators=(",", ":")).encode()
+    return _HEADER.pack(len(body)) + body
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    """Read exactly `size` bytes, or return None if the peer closed."""
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+class _Shard:
+    __slots__ = ("lock", "charges", "saving", "refunded", "refunds", "by_order", "by_customer")
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.charges: Dict[str, list] = {}
+        # IDs of charges being written to storage, not yet visible
+        self.saving: set = set()
+        # Refund ledger: refunded plus reserved minor units per charge
+        self.refunded: Dict[str, int] = {}
+        self.refunds: Dict[str, List[list]] = {}
+        self.by_order: Dict[str, List[list]] = {}
+        self.by_customer: Dict[str, List[list]] = {}
+
+
+class StoreState:
+    """
+    Sharded in-memory state behind the store server.
+    
+    A charge, its refunds and its ledger entry live in the shard of the
+    charge ID; order and customer indexes live in the shard of the order
+    or customer ID. Index lists are append-only, so position cursors
+    work the same way as PaymentProcessor's.
+    
+    With `save`, each new charge or refund is passed to it, and only
+    becomes visible once it returns; see StoreServer.
+    """
+    
+    OPS = frozenset({
+        "ping", "claim_worker_id", "put_charge", "get_charge", "list_charges", "put_refund",
+        "get_refunds", "reserve_refund", "release_refund", "refund_balance", "scan",
+        "settlement_report",
+    })
+    
+    def __init__(self, shards: int = 16, save: Optional[Callable[[object], None]] = None):
+        self._shards = [_Shard() for _ in range(shards)]
+        self._save = save
+        self._log_lock = threading.Lock()
+        self._charge_log: List[list] = []
+        self._refund_log: List[list] = []
+        self._next_worker_id = 0
+        self._settlement_lock = threading.Lock()
+        self._settlement = SettlementAggregates()
+    
+    def handle(self, request: dict) -> dict:
+        """Run one request and build its reply."""
+        op = request.get("op")
+        if op not in self.OPS:
+            return {"error": "bad_request", "message": f"Unknown operation: {op}"}
+        try:
+            return {"result": getattr(self, op)(**request.get("args", {}))}
+        except _StoreError as e:
+            return {"error": e.code, "message": str(e)}
+        except (TypeError, ValueError, KeyError, IndexError) as e:
+            return {"error": "bad_request", "message": f"Malformed {op} request: {e}"}
+    
+    def _shard(self, key: str) -> _Shard:
+        return self._shards[hash(key) % len(self._shards)]
+    
+    def ping(self) -> bool:
+        return True
+    
+    def claim_worker_id(self) -> int:
+        """Hand out ID generator worker IDs, so workers never share one."""
+        with self._log_lock:
+            worker_id = self._next_worker_id
+            self._next_worker_id = (worker_id + 1) % (MAX_WORKER_ID + 1)
+            return worker_id
+    
+    def load(self, charges: Iterator[ChargeRecord], refunds: Iterator[RefundRecord]) -> None:
+        """Rebuild state and the refund ledger from stored records."""
+        for charge in charges:
+            self._add_charge(_row(charge))
+        for refund in refunds:
+            row = _row(refund)
+            shard = self._shard(refund.charge_id)
+            with shard.lock:
+                shard.refunded[refund.charge_id] = (
+                    shard.refunded.get(refund.charge_id, 0) + refund.amount_minor
+                )
+            self._add_refund(row, self.get_charge(refund.charge_id))
+    
+    def _persist(self, record) -> None:
+        if self._save is None:
+            return
+        try:
+            self._save(record)
+        except Exception as e:
+            raise _StoreError("storage", f"Storing {record.id} failed: {e}")
+    
+    def put_charge(self, row: list) -> None:
+        charge_id = row[_CHARGE["id"]]
+        shard = self._shard(charge_id)
+        with shard.lock:
+            if charge_id in shard.charges or charge_id in shard.saving:
+                raise _StoreError("duplicate", f"Charge {charge_id} already exists")
+            shard.saving.add(charge_id)
+        try:
+            self._persist(ChargeRecord(*row))
+        except BaseException:
+            with shard.lock:
+                shard.saving.discard(charge_id)
+            raise
+        self._add_charge(row)
+    
+    def _add_charge(self, row: list) -> None:
+        charge_id = row[_CHARGE["id"]]
+        shard = self._shard(charge_id)
+        with shard.lock:
+            shard.saving.discard(charge_id)
+            shard.charges[charge_id] = row
+        for index, key in (("by_order", row[_CHARGE["order_id"]]),
+                           ("by_customer", row[_CHARGE["customer_id"]])):
+            shard = self._shard(key)
+            with shard.lock:
+                getattr(shard, index).setdefault(key, []).append(row)
+        with self._log_lock:
+            self._charge_log.append(row)
+        with self._settlement_lock:
+            self._settlement.add_charge(ChargeRecord(*row))
+    
+    def get_charge(self, charge_id: str) -> Optional[list]:
+        shard = self._shard(charge_id)
+        with shard.lock:
+            return shard.charges.get(charge_id)
+    
+    def list_charges(self, index: str, key: str, start: int, limit: Optional[int]) -> dict:
+        if index not in ("order", "customer"):
+            raise ValueError(f"unknown index {index}")
+        shard = self._shard(key)
+        with shard.lock:
+            rows = getattr(shard, f"by_{index}").get(key, [])
+            end = len(rows) if limit is None else min(start + limit, len(rows))
+            return {"rows": rows[start:end], "next": end if end < len(rows) else None}
+    
+    def put_refund(self, row: list) -> None:
+        charge = self.get_charge(row[_REFUND["charge_id"]])
+        if charge is None:
+            raise _StoreError("not_found", f"Charge {row[_REFUND['charge_id']]} not found")
+        self._persist(RefundRecord(*row))
+        self._add_refund(row, charge)
+    
+    def _add_refund(self, row: list, charge: list) -> None:
+        shard = self._shard(row[_REFUND["charge_id"]])
+        with shard.lock:
+            shard.refunds.setdefault(row[_REFUND["charge_id"]], []).append(row)
+        with self._log_lock:
+            self._refund_log.append(row)
+        with self._settlement_lock:
+            self._settlement.add_refund(RefundRecord(*row), charge[_CHARGE["payment_method"]])
+    
+    def get_refunds(self, charge_id: str) -> List[list]:
+        shard = self._shard(charge_id)
+        with shard.lock:
+            return list(shard.refunds.get(charge_id, []))
+    
+    def reserve_refund(self, charge_id: str, amount_minor: Optional[int]) -> int:
+        """
+        Check a refund against the charge's balance and reserve it.
+        
+        None reserves the whole remaining balance. Returns the reserved
+        amount; the caller either records the refund or releases it.
+        """
+        shard = self._shard(charge_id)
+        with shard.lock:
+            charge = shard.charges.get(charge_id)
+            if charge is None:
+                raise _StoreError("not_found", f"Charge {charge_id} not found")
+            refunded = shard.refunded.get(charge_id, 0)
+            remaining = charge[_CHARGE["amount_minor"]] - refunded
+            if amount_minor is None:
+                amount_minor = remaining
+                if amount_minor <= 0:
+                    raise _StoreError("exceeds", f"Charge {charge_id} is already fully refunded")
+            elif amount_minor > remaining:
+                raise _StoreError(
+                    "exceeds", f"Refund exceeds remaining balance of charge {charge_id}"
+                )
+            shard.refunded[charge_id] = refunded + amount_minor
+            return amount_minor
+    
+    def release_refund(self, charge_id: str, amount_minor: int) -> None:
+        shard = self._shard(charge_id)
+        with shard.lock:
+            shard.refunded[charge_id] = shard.refunded.get(charge_id, 0) - amount_minor
+    
+    def refund_balance(self, charge_id: str) -> List[int]:
+        shard = self._shard(charge_id)
+        with shard.lock:
+            charge = shard.charges.get(charge_id)
+            if charge is None:
+                raise _StoreError("not_found", f"Charge {charge_id} not found")
+            refunded = shard.refunded.get(charge_id, 0)
+            return [refunded, charge[_CHARGE["amount_minor"]] - refunded]
+    
+    def settlement_report(
+        self,
+        currency: Optional[str],
+        date_from: Optional[str],
+        date_to: Optional[str]
+    ) -> List[dict]:
+        with self._settlement_lock:
+            return self._settlement.report(
+                currency,
+                None if date_from is None else date.fromisoformat(date_from),
+                None if date_to is None else date.fromisoformat(date_to),
+            )
+    
+    def scan(self, kind: str, start: int, filters: dict) -> dict:
+        """
+        Examine up to SCAN_PAGE_SIZE log entries from `start`.
+        
+        Returns the matching rows as [cursor, row] pairs, and the start
+        of the next page, or None once the log (as of now) is exhausted.
+        """
+        if kind not in ("charges", "refunds"):
+            raise ValueError(f"unknown kind {kind}")
+        with self._log_lock:
+            log = self._charge_log if kind == "charges" else self._refund_log
+            end = min(start + SCAN_PAGE_SIZE, len(log))
+            total = len(log)
+            page = log[start:end]
+        matches = self._matcher(kind, **filters)
+        rows = [[start + offset + 1, row] for offset, row in enumerate(page) if matches(row)]
+        return {"rows": rows, "next": end if end < total else None}
+    
+    def _matcher(
+        self,
+        kind: str,
+        created_from: Optional[float] = None,
+        created_to: Optional[float] = None,
+        currency: Optional[str] = None,
+        status: Optional[str] = None,
+        customer_id: Optional[str] = None
+    ) -> Callable[[list], bool]:
+        fields = _CHARGE if kind == "charges" else _REFUND
+        created, cur, sts = fields["created_at"], fields["currency"], fields["status"]
+        
+        def matches(row: list) -> bool:
+            if not ((created_from is None or row[created] >= created_from)
+                    and (created_to is None or row[created] < created_to)
+                    and (currency is None or row[cur] == currency)
+                    and (status is None or row[sts] == status)):
+                return False
+            if customer_id is None:
+                return True
+            if kind == "charges":
+                return row[_CHARGE["customer_id"]] == customer_id
+            charge = self.get_charge(row[_REFUND["charge_id"]])
+            return charge is not None and charge[_CHARGE["customer_id"]] == customer_id
+        
+        return matches
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        state: StoreState = self.server.state
+        while True:
+            header = _recv_exact(self.request, _HEADER.size)
+            if header is None:
+                return
+            body = _recv_exact(self.request, _HEADER.unpack(header)[0])
+            if body is None:
+                return
+            self.request.sendall(_frame(state.handle(json.loads(body))))
+
+
+class StoreServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Store server listening on a Unix socket, one thread per connection.
+    
+    With a `storage` backend, state is loaded from it on startup and
+    every charge and refund is written through to it before the write
+    is acknowledged. Backends are asyncio-based, so their calls run on
+    one event loop thread owned by the server; writes from different
+    connections still share a commit or fsync there.
+    """
+    
+    daemon_threads = True
+    
+    def __init__(self, path: str, shards: int = 16, storage: Optional[StorageBackend] = None):
+        self.storage = storage
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        save = None
+        if storage is not None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, name="store-storage", daemon=True).start()
+            save = self._save
+        self.state = StoreState(shards, save=save)
+        if storage is not None:
+            self.state.load(storage.iter_charges(), storage.iter_refunds())
+        # Clear a socket left behind by a previous run, but nothing else
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        super().__init__(path, _Handler)
+    
+    def _save(self, record) -> None:
+        if isinstance(record, ChargeRecord):
+            write = self.storage.save_charge(record)
+        else:
+            write = self.storage.save_refund(record)
+        asyncio.run_coroutine_threadsafe(write, self._loop).result()
+    
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.storage.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+
+_ERRORS = {
+    "not_found": ChargeNotFound,
+    "exceeds": RefundExceedsCharge,
+}
+
+
+class SharedStorage(StorageBackend):
+    """
+    Storage backend backed by a StoreServer.
+    
+    The server is the source of truth: PaymentProcessor keeps no local
+    state in shared mode and sends every read and write here. Requests
+    go over a small pool of Unix socket connections.
+    """
+    
+    shared = True
+    
+    def __init__(self, path: str, pool_size: int = 8):
+        self.path = path
+        self.pool_size = pool_size
+        # Created on first use: this is built at import time, and on
+        # Python 3.9 a semaphore binds to the loop current at creation
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+    
+    async def save_charge(self, charge: ChargeRecord) -> None:
+        await self._call("put_charge", row=_row(charge))
+    
+    async def save_refund(self, refund: RefundRecord) -> None:
+        await self._call("put_refund", row=_row(refund))
+    
+    def iter_charges(self) -> Iterator[ChargeRecord]:
+        # State lives in the store server; workers have nothing to rebuild
+        return iter(())
+    
+    def iter_refunds(self) -> Iterator[RefundRecord]:
+        return iter(())
+    
+    async def ping(self) -> None:
+        await self._call("ping")
+    
+    async def claim_worker_id(self) -> int:
+        return await self._call("claim_worker_id")
+    
+    async def get_charge(self, charge_id: str) -> Optional[ChargeRecord]:
+        row = await self._call("get_charge", charge_id=charge_id)
+        return None if row is None else ChargeRecord(*row)
+    
+    async def list_charges(
+        self,
+        index: str,
+        key: str,
+        start: int,
+        limit: Optional[int]
+    ) -> Tuple[List[ChargeRecord], Optional[int]]:
+        """Page through the "order" or "customer" index for `key`."""
+        page = await self._call("list_charges", index=index, key=key, start=start, limit=limit)
+        return [ChargeRecord(*row) for row in page["rows"]], page["next"]
+    
+    async def get_refunds(self, charge_id: str) -> List[RefundRecord]:
+        rows = await self._call("get_refunds", charge_id=charge_id)
+        return [RefundRecord(*row) for row in rows]
+    
+    async def reserve_refund(self, charge_id: str, amount_minor: Optional[int]) -> int:
+        return await self._call("reserve_refund", charge_id=charge_id, amount_minor=amount_minor)
+    
+    async def release_refund(self, charge_id: str, amount_minor: int) -> None:
+        await self._call("release_refund", charge_id=charge_id, amount_minor=amount_minor)
+    
+    async def refund_balance(self, charge_id: str) -> Tuple[int, int]:
+        refunded, remaining = await self._call("refund_balance", charge_id=charge_id)
+        return refunded, remaining
+    
+    async def settlement_report(
+        self,
+        currency: Optional[str],
+        date_from: Optional[date],
+        date_to: Optional[date]
+    ) -> List[dict]:
+        return await self._call(
+            "settlement_report",
+            currency=currency,
+            date_from=None if date_from is None else date_from.isoformat(),
+            date_to=None if date_to is None else date_to.isoformat(),
+        )
+    
+    async def scan(
+        self,
+        kind: str,
+        start: int,
+        filters: dict
+    ) -> Tuple[List[Tuple[int, object]], Optional[int]]:
+        """Fetch one page of the "charges" or "refunds" log; see StoreState.scan()."""
+        page = await self._call("scan", kind=kind, start=start, filters=filters)
+        record_type = ChargeRecord if kind == "charges" else RefundRecord
+        return [(cursor, record_type(*row)) for cursor, row in page["rows"]], page["next"]
+    
+    async def close(self) -> None:
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+            await writer.wait_closed()
+    
+    async def _call(self, op: str, **args) -> Any:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        async with self._slots:
+            if self._idle:
+                reader, writer = self._idle.pop()
+            else:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            try:
+                writer.write(_frame({"op": op, "args": args}))
+                await writer.drain()
+                size, = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+                reply = json.loads(await reader.readexactly(size))
+            except BaseException:
+                # The stream may hold half a reply; never reuse it
+                writer.close()
+                raise
+            self._idle.append((reader, writer))
+        if "error" in reply:
+            raise _ERRORS.get(reply["error"], SharedStoreError)(reply["message"])
+        return reply["result"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Shared charge store server")
+    parser.add_argument("--socket", default="/tmp/payments-store.sock", help="Unix socket path")
+    parser.add_argument("--shards", type=int, default=16, help="Number of lock shards")
+    args = parser.parse_args()
+    
+    storage = durable_storage_from_env()
+    server = StoreServer(args.socket, shards=args.shards, storage=storage)
+    print(
+        f"Shared store listening on {args.socket} ({args.shards} shards, "
+        f"{'writing through to ' + type(storage).__name__ if storage else 'memory only'})"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+Durable storage backends for charges and refunds
+"""
+import asyncio
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Iterator, List, Optional, Tuple, Union
+
+from .records import ChargeRecord, RefundRecord
+
+
+class StorageBackend(ABC):
+    """
+    Interface for persisting charges and refunds.
+    
+    PaymentProcessor keeps its working set and indexes in memory and
+    writes every record through to a backend before acknowledging it.
+    On startup the processor rebuilds its state from iter_charges()
+    and iter_refunds().
+    
+    Backends that support a webhook outbox store each record's event in
+    the same write as the record once enable_outbox() is called, and keep
+    it until mark_delivered() is called for the record.
+    """
+    
+    # Shared backends are the source of truth for reads as well as
+    # writes, so the processor reads through instead of caching locally
+    shared = False
+    # Whether saved records also go into the webhook outbox
+    outbox = False
+    
+    @abstractmethod
+    async def save_charge(self, charge: ChargeRecord) -> None:
+        """Durably store a charge."""
+    
+    @abstractmethod
+    async def save_refund(self, refund: RefundRecord) -> None:
+        """Durably store a refund."""
+    
+    @abstractmethod
+    def iter_charges(self) -> Iterator[ChargeRecord]:
+        """Yield every stored charge in insertion order."""
+    
+    @abstractmethod
+    def iter_refunds(self) -> Iterator[RefundRecord]:
+        """Yield every stored refund in insertion order."""
+    
+    def enable_outbox(self) -> bool:
+        """
+        Store each record's webhook event with it from now on.
+        
+        Returns False if the backend keeps no outbox; events then live
+        only in the dispatcher's memory.
+        """
+        return False
+    
+    def iter_outbox(self) -> Iterator[Union[ChargeRecord, RefundRecord]]:
+        """Yield the records whose events haven't been marked delivered."""
+        return iter(())
+    
+    async def mark_delivered(self, record_ids: List[str]) -> None:
+        """Durably remove delivered events from the outbox."""
+    
+    async def ping(self) -> None:
+        """Raise if the backend can't currently serve reads and writes."""
+    
+    async def close(self) -> None:
+        """Flush pending writes and release resources."""
+
+
+_CHARGE_COLUMNS = ChargeRecord.__slots__
+_REFUND_COLUMNS = RefundRecord.__slots__
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS charges (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    order_id TEXT NOT NULL,
+    amount_minor INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    customer_id TEXT NOT NULL,
+    payment_method TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refunds (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    charge_id TEXT NOT NULL,
+    amount_minor INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    reason TEXT,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    record_id TEXT NOT NULL UNIQUE
+);
+"""
+
+_INSERT_CHARGE = (
+    f"INSERT INTO charges ({', '.join(_CHARGE_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(_CHARGE_COLUMNS))})"
+)
+_INSERT_REFUND = (
+    f"INSERT INTO refunds ({', '.join(_REFUND_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(_REFUND_COLUMNS))})"
+)
+_INSERT_OUTBOX = "INSERT INTO outbox (record_id) VALUES (?)"
+_DELETE_OUTBOX = "DELETE FROM outbox WHERE record_id = ?"
+
+_STOP = object()
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    SQLite backend in WAL mode with group commit.
+    
+    All writes go through a single writer thread. With group_commit
+    enabled, the writer drains every write queued while the previous
+    transaction was committing and commits them together, so concurrent
+    charge()/refund() calls share one fsync instead of paying one each.
+    Each caller is only acknowledged once its transaction has committed.
+    With the outbox enabled, a record and its outbox row are inserted in
+    the same transaction.
+    """
+    
+    def __init__(self, path: str, group_commit: bool = True, max_batch: int = 1000):
+        self.path = path
+        self.group_commit = group_commit
+        self.max_batch = max_batch if group_commit else 1
+        self.commits = 0
+        self.writes = 0
+        
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        conn.close()
+        
+        self._queue: "queue.Queue" = queue.Queue()
+        self._writer = threading.Thread(
+            target=self._write_loop, name="sqlite-writer", daemon=True
+        )
+        self._writer.start()
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # FULL fsyncs the WAL on every commit, which is what makes each
+        # acknowledged payment durable. Group commit amortizes that cost.
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+    
+    async def save_charge(self, charge: ChargeRecord) -> None:
+        await self._submit(self._with_event(
+            charge.id, _INSERT_CHARGE, tuple(getattr(charge, c) for c in _CHARGE_COLUMNS)
+        ))
+    
+    async def save_refund(self, refund: RefundRecord) -> None:
+        await self._submit(self._with_event(
+            refund.id, _INSERT_REFUND, tuple(getattr(refund, c) for c in _REFUND_COLUMNS)
+        ))
+    
+    def _with_event(self, record_id: str, sql: str, params: tuple) -> List[Tuple[str, tuple]]:
+        statements = [(sql, params)]
+        if self.outbox:
+            statements.append((_INSERT_OUTBOX, (record_id,)))
+        return statements
+    
+    def iter_charges(self) -> Iterator[ChargeRecord]:
+        return self._iter_rows("charges", _CHARGE_COLUMNS, ChargeRecord)
+    
+    def iter_refunds(self) -> Iterator[RefundRecord]:
+        return self._iter_rows("refunds", _REFUND_COLUMNS, RefundRecord)
+    
+    def enable_outbox(self) -> bool:
+        self.outbox = True
+        return True
+    
+    def iter_outbox(self) -> Iterator[Union[ChargeRecord, RefundRecord]]:
+        yield from self._iter_rows("charges", _CHARGE_COLUMNS, ChargeRecord, outbox=True)
+        yield from self._iter_rows("refunds", _REFUND_COLUMNS, RefundRecord, outbox=True)
+    
+    async def mark_delivered(self, record_ids: List[str]) -> None:
+        await self._submit([(_DELETE_OUTBOX, (record_id,)) for record_id in record_ids])
+    
+    async def ping(self) -> None:
+        if not self._writer.is_alive():
+            raise RuntimeError("SQLite writer thread is not running")
+        await asyncio.get_running_loop().run_in_executor(None, self._probe)
+    
+    def _probe(self) -> None:
+        conn = sqlite3.connect(self.path, timeout=1.0)
+        try:
+            conn.execute("SELECT 1 FROM charges LIMIT 1").fetchall()
+        finally:
+            conn.close()
+    
+    async def close(self) -> None:
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            await asyncio.get_running_loop().run_in_executor(None, self._writer.join)
+    
+    def _iter_rows(
+        self,
+        table: str,
+        columns: Tuple[str, ...],
+        record_type: type,
+        outbox: bool = False
+    ) -> Iterator:
+        conn = self._connect()
+        try:
+            if outbox:
+                cursor = conn.execute(
+                    f"SELECT {', '.join(f'r.{c}' for c in columns)} FROM outbox o "
+                    f"JOIN {table} r ON r.id = o.record_id ORDER BY o.seq"
+                )
+            else:
+                cursor = conn.execute(
+                    f"SELECT {', '.join(columns)} FROM {table} ORDER BY seq"
+                )
+            for row in cursor:
+                yield record_type(*row)
+        finally:
+            conn.close()
+    
+    async def _submit(self, statements: List[Tuple[str, tuple]]) -> None:
+        """Run statements in one transaction, possibly shared with other callers."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((statements, loop, future))
+        await future
+    
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            batch: List[tuple] = []
+            item = self._queue.get()
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.max_batch:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._commit(conn, batch)
+        conn.close()
+    
+    def _commit(self, conn: sqlite3.Connection, batch: List[tuple]) -> None:
+        error: Optional[BaseException] = None
+        try:
+            conn.execute("BEGIN")
+            for statements, _, _ in batch:
+                for sql, params in statements:
+                    conn.execute(sql, params)
+            conn.execute("COMMIT")
+            self.commits += 1
+            self.writes += len(batch)
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if len(batch) > 1:
+                # Don't let one bad row fail everyone else in the group
+                for item in batch:
+                    self._commit(conn, [item])
+                return
+            error = e
+        
+        for _, loop, future in batch:
+            loop.call_soon_threadsafe(_resolve, future, error)
+
+
+def read_database(path: str, kind: str) -> Iterator:
+    """
+    Yield the "charges" or "refunds" stored in a SQLite database, read-only.
+    
+    Opening a SQLiteStorage creates tables and starts a writer; this only
+    opens a read-only connection, so it is safe next to a live service.
+    """
+    columns, record_type = (
+        (_CHARGE_COLUMNS, ChargeRecord) if kind == "charges" else (_REFUND_COLUMNS, RefundRecord)
+    )
+    conn = sqlite3.connect(pathlib.Path(path).absolute().as_uri() + "?mode=ro", uri=True)
+    try:
+        for row in conn.execute(f"SELECT {', '.join(columns)} FROM {kind} ORDER BY seq"):
+            yield record_type(*row)
+    finally:
+        conn.close()
+
+
+def _resolve(future: asyncio.Future, error: Optional[BaseException]) -> None:
+    if future.cancelled():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+def storage_from_env() -> Optional[StorageBackend]:
+    """
+    Build the storage backend configured by environment variables.
+    
+    PAYMENTS_SHARED_STORE points every worker at one store server (see
+    shared_store), which does the durable writes itself; otherwise see
+    durable_storage_from_env(). Without any of them the service keeps
+    everything in memory only.
+    """
+    shared_path = os.getenv("PAYMENTS_SHARED_STORE")
+    if shared_path:
+        from .shared_store import SharedStorage
+        return SharedStorage(shared_path, pool_size=int(os.getenv("PAYMENTS_SHARED_STORE_POOL", 8)))
+    return durable_storage_from_env()
+
+
+def durable_storage_from_env() -> Optional[StorageBackend]:
+    """
+    Build the on-disk backend configured by environment variables.
+    
+    PAYMENTS_WAL_DIR enables the write-ahead log backend (see wal) and
+    PAYMENTS_DB_PATH the SQLite backend; returns None if neither is set.
+    """
+    wal_dir = os.getenv("PAYMENTS_WAL_DIR")
+    if wal_dir:
+        from .wal import WALStorage
+        return WALStorage(wal_dir, snapshot_every=int(os.getenv("PAYMENTS_WAL_SNAPSHOT_EVERY", 1000000)))
+    path = os.getenv("PAYMENTS_DB_PATH")
+    if not path:
+        return None
+    group_commit = os.getenv("PAYMENTS_DB_GROUP_COMMIT", "true").lower() != "false"
+    return SQLiteStorage(path, group_commit=group_commit)
+
+
+def read_records_from_env(kind: str) -> Iterator:
+    """
+    Read the "charges" or "refunds" in the configured durable backend.
+    
+    For offline tools running next to the service: files are only read,
+    never repaired, compacted or locked for writing.
+    
+    Raises:
+        ValueError: If neither PAYMENTS_WAL_DIR nor PAYMENTS_DB_PATH is set
+    """
+    wal_dir = os.getenv("PAYMENTS_WAL_DIR")
+    if wal_dir:
+        from .wal import CHARGE, REFUND, read_log
+        return read_log(wal_dir, CHARGE if kind == "charges" else REFUND)
+    path = os.getenv("PAYMENTS_DB_PATH")
+    if path:
+        return read_database(path, kind)
+    raise ValueError("No durable storage configured (PAYMENTS_WAL_DIR or PAYMENTS_DB_PATH)")
@@ -0,0 +1,84 @@
+"""
+Local stub payment gateway for offline load testing
+
+Serves the same endpoints PaymentGateway calls, with configurable
+latency and error rate. Use it in-process through httpx.ASGITransport,
+or run it as a server:
+    
+    python -m src.services.stub_gateway --port 4010 --latency-ms 20 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import random
+import uuid
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def create_stub_gateway(
+    latency_ms: float = 0.0,
+    jitter_ms: float = 0.0,
+    error_rate: float = 0.0,
+    seed: Optional[int] = None
+) -> FastAPI:
+    """
+    Build the stub gateway app.
+    
+    Args:
+        latency_ms: Base latency added to every charge/refund call
+        jitter_ms: Extra latency drawn uniformly from [0, jitter_ms]
+        error_rate: Fraction of calls answered with 503
+        seed: Random seed for reproducible runs
+    """
+    app = FastAPI(title="Stub Payment Gateway")
+    rng = random.Random(seed)
+    app.state.requests = 0
+    
+    async def respond(prefix: str, request: Request) -> JSONResponse:
+        app.state.requests += 1
+        delay = latency_ms + rng.uniform(0, jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if rng.random() < error_rate:
+            return JSONResponse({"error": "upstream unavailable"}, status_code=503)
+        payload = await request.json()
+        return JSONResponse({
+            "id": f"{prefix}_{uuid.uuid4().hex[:16]}",
+            "status": "succeeded",
+            "idempotency_key": request.headers.get("Idempotency-Key"),
+            "amount": payload.get("amount"),
+        })
+    
+    @app.post("/v1/charges")
+    async def charge(request: Request):
+        return await respond("gw_ch", request)
+    
+    @app.post("/v1/refunds")
+    async def refund(request: Request):
+        return await respond("gw_re", request)
+    
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+    
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+    
+    parser = argparse.ArgumentParser(description="Run the stub payment gateway")
+    parser.add_argument("--port", type=int, default=4010)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    uvicorn.run(
+        create_stub_gateway(args.latency_ms, args.jitter_ms, args.error_rate, args.seed),
+        host="127.0.0.1",
+        port=args.port,
+        log_level="warning"
+    )
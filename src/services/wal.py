@@ -0,0 +1,662 @@
+"""
+Write-ahead log storage with snapshots
+
+WALStorage appends every charge and refund to a binary write-ahead log
+and only acknowledges it once the log has been fsynced. Like
+SQLiteStorage's group commit, one writer thread drains everything
+queued while the previous fsync ran and syncs it together. A batch
+whose write or fsync fails is cut off the log again, so a write its
+callers were told failed never reappears after a restart; if even that
+fails, the writer refuses everything after it.
+
+The log is split into numbered segments. Once a segment holds
+`snapshot_every` records the writer starts a new one, and a background
+thread compacts the previous snapshot plus the finished segments into a
+new snapshot and deletes them. Snapshots are denser than the log: no
+per-record framing, and currency, payment method and status are stored
+as indexes into a string table.
+
+Recovery memory-maps the latest snapshot and then replays only the log
+segments written after it. A record whose frame is cut short or fails
+its CRC marks a torn write from a crash; the log is truncated there.
+
+With the webhook outbox enabled, a record's frame carries a flag saying
+its event is undelivered, so the event is written and synced with the
+record. Delivered events are logged as frames listing their record IDs,
+and snapshots keep the IDs of events still undelivered.
+
+Layout of `directory`:
+    snapshot-<N>.bin    every record from segments before N, then the outbox
+    wal-<N>.log         segment N: frames of (length, crc32, kind, payload)
+"""
+import asyncio
+import mmap
+import os
+import queue
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .records import ChargeRecord, RefundRecord
+from .storage import StorageBackend, _resolve
+
+CHARGE = 1
+REFUND = 2
+# Payload: newline-separated IDs of records whose events were delivered
+DELIVERED = 3
+# Set on a record's kind while its webhook event is undelivered
+EVENT = 0x80
+
+# Log frame header: payload length, CRC32 of kind + payload, record kind
+_FRAME = struct.Struct(">IIB")
+# String length marking a None refund reason
+_NONE = 0xFFFFFFFF
+
+# Log payloads: numbers, then string lengths, then the UTF-8 strings
+# Charge: amount_minor, created_at | id, order_id, currency, customer_id, payment_method, status
+_CHARGE_LOG = struct.Struct(">qd6I")
+# Refund: amount_minor, created_at | id, charge_id, currency, reason, status
+_REFUND_LOG = struct.Struct(">qd5I")
+
+# Snapshot records: currency/payment_method/status are string-table indexes
+# Charge: amount_minor, created_at, currency, payment_method, status | id, order_id, customer_id
+_CHARGE_SNAP = struct.Struct(">qd3I3I")
+# Refund: amount_minor, created_at, currency, status | id, charge_id, reason
+_REFUND_SNAP = struct.Struct(">qd2I3I")
+# magic, charge count, refund count, offset of refunds, offset of string table
+_SNAP_HEADER = struct.Struct(">8sQQQQ")
+_SNAP_MAGIC = b"PAYSNAP1"
+
+_STOP = object()
+
+
+def _encode_strings(values) -> Tuple[List[int], bytes]:
+    encoded = [b"" if v is None else v.encode() for v in values]
+    lengths = [_NONE if v is None else len(e) for v, e in zip(values, encoded)]
+    return lengths, b"".join(encoded)
+
+
+def _decode_strings(buf, pos: int, lengths) -> Tuple[list, int]:
+    values = []
+    for length in lengths:
+        if length == _NONE:
+            values.append(None)
+            continue
+        values.append(str(buf[pos:pos + length], "utf-8"))
+        pos += length
+    return values, pos
+
+
+def _encode_charge(charge: ChargeRecord) -> bytes:
+    # Unrolled like the decoders below: this runs for every charge logged
+    # or moved to the cold tier
+    a = charge.id.encode()
+    b = charge.order_id.encode()
+    c = charge.currency.encode()
+    d = charge.customer_id.encode()
+    e = charge.payment_method.encode()
+    f = charge.status.encode()
+    return b"".join((
+        _CHARGE_LOG.pack(
+            charge.amount_minor, charge.created_at,
+            len(a), len(b), len(c), len(d), len(e), len(f)
+        ),
+        a, b, c, d, e, f,
+    ))
+
+
+def encode_frame(record, event: bool = False) -> bytes:
+    """Encode a charge or refund as one log frame, flagged if its event is undelivered."""
+    if isinstance(record, ChargeRecord):
+        kind = CHARGE
+        payload = _encode_charge(record)
+    else:
+        kind = REFUND
+        lengths, strings = _encode_strings((
+            record.id, record.charge_id, record.currency, record.reason, record.status,
+        ))
+        payload = _REFUND_LOG.pack(record.amount_minor, record.created_at, *lengths) + strings
+    if event:
+        kind |= EVENT
+    return _pack_frame(kind, payload)
+
+
+def encode_delivered(record_ids: Iterable[str]) -> bytes:
+    """Encode a frame marking the events of these records delivered."""
+    return _pack_frame(DELIVERED, "\n".join(record_ids).encode())
+
+
+def _pack_frame(kind: int, payload: bytes) -> bytes:
+    crc = zlib.crc32(payload, _KIND_CRC[kind])
+    return _FRAME.pack(len(payload), crc, kind) + payload
+
+
+# The decoders below run once per record on recovery, so they unpack
+# strings inline instead of looping through _decode_strings
+def _decode_charge(buf, pos: int) -> ChargeRecord:
+    amount, created, n1, n2, n3, n4, n5, n6 = _CHARGE_LOG.unpack_from(buf, pos)
+    a = pos + _CHARGE_LOG.size
+    b = a + n1
+    c = b + n2
+    d = c + n3
+    e = d + n4
+    f = e + n5
+    return ChargeRecord(
+        str(buf[a:b], "utf-8"), str(buf[b:c], "utf-8"), amount, str(buf[c:d], "utf-8"),
+        str(buf[d:e], "utf-8"), str(buf[e:f], "utf-8"), str(buf[f:f + n6], "utf-8"), created
+    )
+
+
+def _decode_refund(buf, pos: int) -> RefundRecord:
+    amount, created, n1, n2, n3, n4, n5 = _REFUND_LOG.unpack_from(buf, pos)
+    a = pos + _REFUND_LOG.size
+    b = a + n1
+    c = b + n2
+    d = c + n3
+    if n4 == _NONE:
+        reason, e = None, d
+    else:
+        e = d + n4
+        reason = str(buf[d:e], "utf-8")
+    return RefundRecord(
+        str(buf[a:b], "utf-8"), str(buf[b:c], "utf-8"), amount, str(buf[c:d], "utf-8"),
+        reason, str(buf[e:e + n5], "utf-8"), created
+    )
+
+
+_DECODERS = {
+    CHARGE: _decode_charge,
+    REFUND: _decode_refund,
+    CHARGE | EVENT: _decode_charge,
+    REFUND | EVENT: _decode_refund,
+}
+_KIND_CRC = {kind: zlib.crc32(bytes((kind,))) for kind in (*_DECODERS, DELIVERED)}
+
+
+def _scan_frames(buf) -> Iterator[Tuple[int, int, int]]:
+    """Yield (kind, payload offset, frame end) for each intact frame."""
+    pos = 0
+    size = len(buf)
+    while pos + _FRAME.size <= size:
+        length, crc, kind = _FRAME.unpack_from(buf, pos)
+        start = pos + _FRAME.size
+        end = start + length
+        seed = _KIND_CRC.get(kind)
+        if end > size or seed is None or zlib.crc32(buf[start:end], seed) != crc:
+            return
+        yield kind, start, end
+        pos = end
+
+
+@contextmanager
+def _mapped(path: str) -> Iterator[memoryview]:
+    """
+    Memory-map a file read-only.
+    
+    Slicing the memoryview doesn't copy, so CRCs and string decoding read
+    straight from the page cache.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield memoryview(b"")
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    try:
+        yield view
+    finally:
+        view.release()
+        mapped.close()
+
+
+def read_segment(path: str, kind: int) -> Iterator:
+    """Yield the charges or refunds in a log segment, stopping at a torn tail."""
+    with _mapped(path) as buf:
+        for frame_kind, start, _ in _scan_frames(buf):
+            if frame_kind & ~EVENT == kind:
+                yield _DECODERS[frame_kind](buf, start)
+
+
+def _replay_outbox(path: str, pending: "OrderedDict[str, object]") -> None:
+    """Add a segment's undelivered records to `pending` and drop those it marks delivered."""
+    with _mapped(path) as buf:
+        for kind, start, end in _scan_frames(buf):
+            if kind == DELIVERED:
+                for record_id in str(buf[start:end], "utf-8").split("\n"):
+                    pending.pop(record_id, None)
+            elif kind & EVENT:
+                record = _DECODERS[kind](buf, start)
+                pending[record.id] = record
+
+
+def read_snapshot(path: str, kind: int) -> Iterator:
+    """Yield the charges or refunds stored in a snapshot."""
+    with _mapped(path) as buf:
+        magic, charges, refunds, refunds_at, table_at = _SNAP_HEADER.unpack_from(buf, 0)
+        if magic != _SNAP_MAGIC:
+            raise ValueError(f"{path} is not a payments snapshot")
+        table, _ = _read_string_list(buf, table_at)
+        
+        if kind == CHARGE:
+            pos = _SNAP_HEADER.size
+            for _ in range(charges):
+                amount, created, cur, method, status, n1, n2, n3 = _CHARGE_SNAP.unpack_from(buf, pos)
+                a = pos + _CHARGE_SNAP.size
+                b = a + n1
+                c = b + n2
+                pos = c + n3
+                yield ChargeRecord(
+                    str(buf[a:b], "utf-8"), str(buf[b:c], "utf-8"), amount, table[cur],
+                    str(buf[c:pos], "utf-8"), table[method], table[status], created
+                )
+        else:
+            pos = refunds_at
+            for _ in range(refunds):
+                amount, created, cur, status, *lengths = _REFUND_SNAP.unpack_from(buf, pos)
+                (id, charge_id, reason), pos = _decode_strings(buf, pos + _REFUND_SNAP.size, lengths)
+                yield RefundRecord(id, charge_id, amount, table[cur], reason, table[status], created)
+
+
+def _read_string_list(buf, pos: int) -> Tuple[list, int]:
+    (count,) = struct.unpack_from(">I", buf, pos)
+    return _decode_strings(buf, pos + 4 + 4 * count, struct.unpack_from(f">{count}I", buf, pos + 4))
+
+
+def read_snapshot_outbox(path: str) -> List[str]:
+    """
+    IDs of the records in a snapshot whose events were undelivered.
+    
+    The list follows the string table; snapshots written before the
+    outbox existed end at the table and have none.
+    """
+    with _mapped(path) as buf:
+        magic, _, _, _, table_at = _SNAP_HEADER.unpack_from(buf, 0)
+        if magic != _SNAP_MAGIC:
+            raise ValueError(f"{path} is not a payments snapshot")
+        _, end = _read_string_list(buf, table_at)
+        if end == len(buf):
+            return []
+        return _read_string_list(buf, end)[0]
+
+
+def _list_directory(directory: str) -> Tuple[List[int], List[int], List[str]]:
+    """Sequence numbers of the snapshots and segments in a log directory, and leftover temp files."""
+    snapshots, segments, leftovers = [], [], []
+    for name in os.listdir(directory):
+        if name.endswith(".tmp"):
+            leftovers.append(name)
+        elif name.startswith("snapshot-") and name.endswith(".bin"):
+            snapshots.append(int(name[9:-4]))
+        elif name.startswith("wal-") and name.endswith(".log"):
+            segments.append(int(name[4:-4]))
+    return snapshots, sorted(segments), leftovers
+
+
+def read_log(directory: str, kind: int) -> Iterator:
+    """
+    Yield the charges or refunds stored in a log directory, read-only.
+    
+    Unlike opening a WALStorage, this repairs, compacts and deletes
+    nothing, so it is safe to run against the directory of a live
+    service. A torn or half-written tail is skipped. If a compaction
+    removes files mid-read, the read starts over from the new snapshot,
+    so records may repeat but none are missed.
+    """
+    while True:
+        snapshots, segments, _ = _list_directory(directory)
+        snapshot_seq = max(snapshots, default=0)
+        try:
+            if snapshot_seq:
+                yield from read_snapshot(os.path.join(directory, f"snapshot-{snapshot_seq:08d}.bin"), kind)
+            for seq in segments:
+                if seq >= snapshot_seq:
+                    yield from read_segment(os.path.join(directory, f"wal-{seq:08d}.log"), kind)
+            return
+        except FileNotFoundError:
+            continue
+
+
+def read_outbox(directory: str) -> List[Union[ChargeRecord, RefundRecord]]:
+    """
+    The records in a log directory whose events are undelivered, oldest first.
+    
+    Read-only, like read_log(), so it can run while the writer appends
+    and compacts.
+    """
+    while True:
+        snapshots, segments, _ = _list_directory(directory)
+        snapshot_seq = max(snapshots, default=0)
+        pending: "OrderedDict[str, object]" = OrderedDict()
+        try:
+            if snapshot_seq:
+                path = os.path.join(directory, f"snapshot-{snapshot_seq:08d}.bin")
+                ids = read_snapshot_outbox(path)
+                if ids:
+                    wanted = set(ids)
+                    found = {
+                        record.id: record
+                        for kind in (CHARGE, REFUND)
+                        for record in read_snapshot(path, kind) if record.id in wanted
+                    }
+                    pending.update((record_id, found[record_id]) for record_id in ids)
+            for seq in segments:
+                if seq >= snapshot_seq:
+                    _replay_outbox(os.path.join(directory, f"wal-{seq:08d}.log"), pending)
+            return list(pending.values())
+        except FileNotFoundError:
+            continue
+
+
+def write_snapshot(
+    path: str,
+    charges: Iterator[ChargeRecord],
+    refunds: Iterator[RefundRecord],
+    outbox: List[str] = ()
+) -> None:
+    """
+    Write records to a snapshot file atomically (temp file, fsync, rename).
+    
+    `outbox` lists the IDs of records whose events are undelivered.
+    """
+    table: Dict[str, int] = {}
+    
+    def index(value: str) -> int:
+        position = table.get(value)
+        if position is None:
+            position = table[value] = len(table)
+        return position
+    
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(b"\0" * _SNAP_HEADER.size)
+        charge_count = 0
+        for c in charges:
+            lengths, strings = _encode_strings((c.id, c.order_id, c.customer_id))
+            f.write(_CHARGE_SNAP.pack(
+                c.amount_minor, c.created_at,
+                index(c.currency), index(c.payment_method), index(c.status), *lengths
+            ) + strings)
+            charge_count += 1
+        
+        refunds_at = f.tell()
+        refund_count = 0
+        for r in refunds:
+            lengths, strings = _encode_strings((r.id, r.charge_id, r.reason))
+            f.write(_REFUND_SNAP.pack(
+                r.amount_minor, r.created_at, index(r.currency), index(r.status), *lengths
+            ) + strings)
+            refund_count += 1
+        
+        table_at = f.tell()
+        for values in (list(table), list(outbox)):
+            lengths, strings = _encode_strings(values)
+            f.write(struct.pack(f">I{len(lengths)}I", len(lengths), *lengths) + strings)
+        f.seek(0)
+        f.write(_SNAP_HEADER.pack(_SNAP_MAGIC, charge_count, refund_count, refunds_at, table_at))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_directory(os.path.dirname(path))
+
+
+def _fsync_directory(directory: str) -> None:
+    # Make renames and deletions durable too
+    fd = os.open(directory or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WALStorage(StorageBackend):
+    """
+    Append-only binary log with batched fsync and periodic snapshots.
+    
+    Args:
+        directory: Where segments and snapshots live; created if missing
+        snapshot_every: Records per log segment before it is compacted
+        max_batch: Most records written per fsync
+        sync: fsync each batch; turning it off trades durability for speed
+    """
+    
+    def __init__(
+        self,
+        directory: str,
+        snapshot_every: int = 1000000,
+        max_batch: int = 1000,
+        sync: bool = True
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.max_batch = max_batch
+        self.sync = sync
+        self.fsyncs = 0
+        self.writes = 0
+        self.snapshots = 0
+        # Set once a failed batch couldn't be rolled back; every later write is refused
+        self._failed: Optional[OSError] = None
+        
+        self._snapshot_seq, segments = self._scan_directory()
+        self._segment_seq = segments[-1] if segments else max(self._snapshot_seq, 1)
+        self._segment_records = self._repair_tail(self._segment_path(self._segment_seq))
+        self._segment = open(self._segment_path(self._segment_seq), "ab")
+        self._compaction: Optional[threading.Thread] = None
+        
+        self._queue: "queue.Queue" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="wal-writer", daemon=True)
+        self._writer.start()
+    
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"wal-{seq:08d}.log")
+    
+    def _snapshot_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"snapshot-{seq:08d}.bin")
+    
+    def _scan_directory(self) -> Tuple[int, List[int]]:
+        """Find the newest snapshot and the segments after it; clear leftovers."""
+        snapshots, segments, leftovers = _list_directory(self.directory)
+        for name in leftovers:
+            os.remove(os.path.join(self.directory, name))  # An interrupted compaction
+        snapshot_seq = max(snapshots, default=0)
+        # Anything older than the newest snapshot is already part of it
+        for seq in snapshots:
+            if seq < snapshot_seq:
+                os.remove(self._snapshot_path(seq))
+        for seq in segments:
+            if seq < snapshot_seq:
+                os.remove(self._segment_path(seq))
+        return snapshot_seq, [seq for seq in segments if seq >= snapshot_seq]
+    
+    @staticmethod
+    def _repair_tail(path: str) -> int:
+        """Truncate a torn write off the end of a segment; return its record count."""
+        if not os.path.exists(path):
+            return 0
+        records, good_end = 0, 0
+        with _mapped(path) as buf:
+            for _, _, end in _scan_frames(buf):
+                records += 1
+                good_end = end
+            size = len(buf)
+        if good_end < size:
+            with open(path, "r+b") as f:
+                f.truncate(good_end)
+                os.fsync(f.fileno())
+        return records
+    
+    async def save_charge(self, charge: ChargeRecord) -> None:
+        await self._submit(encode_frame(charge, self.outbox))
+    
+    async def save_refund(self, refund: RefundRecord) -> None:
+        await self._submit(encode_frame(refund, self.outbox))
+    
+    def enable_outbox(self) -> bool:
+        self.outbox = True
+        return True
+    
+    def iter_outbox(self) -> Iterator[Union[ChargeRecord, RefundRecord]]:
+        return iter(read_outbox(self.directory))
+    
+    async def mark_delivered(self, record_ids: List[str]) -> None:
+        await self._submit(encode_delivered(record_ids))
+    
+    def iter_charges(self) -> Iterator[ChargeRecord]:
+        return self._iter_records(CHARGE)
+    
+    def iter_refunds(self) -> Iterator[RefundRecord]:
+        return self._iter_records(REFUND)
+    
+    def _iter_records(self, kind: int) -> Iterator:
+        if self._snapshot_seq and os.path.exists(self._snapshot_path(self._snapshot_seq)):
+            yield from read_snapshot(self._snapshot_path(self._snapshot_seq), kind)
+        for seq in range(self._snapshot_seq or 1, self._segment_seq + 1):
+            path = self._segment_path(seq)
+            if os.path.exists(path):
+                yield from read_segment(path, kind)
+    
+    async def snapshot(self) -> None:
+        """Start a new segment and compact everything before it now."""
+        await self._submit(None)
+    
+    async def ping(self) -> None:
+        if not self._writer.is_alive():
+            raise RuntimeError("WAL writer thread is not running")
+        if self._failed is not None:
+            raise RuntimeError(f"WAL writer failed: {self._failed}")
+    
+    async def close(self) -> None:
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            await asyncio.get_running_loop().run_in_executor(None, self._writer.join)
+    
+    async def _submit(self, frame: Optional[bytes]) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((frame, loop, future))
+        await future
+    
+    def _write_loop(self) -> None:
+        stopping = False
+        while not stopping:
+            batch: List[tuple] = []
+            item = self._queue.get()
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                if item[0] is None:
+                    # Snapshot request: flush what came before it first
+                    if batch:
+                        self._write(batch)
+                        batch = []
+                    self._rotate(wait=True)
+                    item[1].call_soon_threadsafe(_resolve, item[2], None)
+                else:
+                    batch.append(item)
+                if len(batch) >= self.max_batch:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+                if self._segment_records >= self.snapshot_every:
+                    self._rotate(wait=False)
+        self._segment.close()
+        if self._compaction is not None:
+            self._compaction.join()
+    
+    def _write(self, batch: List[tuple]) -> None:
+        error: Optional[BaseException] = self._failed
+        if error is None:
+            start = self._segment.tell()
+            try:
+                self._segment.write(b"".join(frame for frame, _, _ in batch))
+                self._segment.flush()
+                if self.sync:
+                    os.fsync(self._segment.fileno())
+                    self.fsyncs += 1
+                self.writes += len(batch)
+                self._segment_records += len(batch)
+            except OSError as e:
+                error = e
+                self._roll_back(start)
+        for _, loop, future in batch:
+            loop.call_soon_threadsafe(_resolve, future, error)
+    
+    def _roll_back(self, offset: int) -> None:
+        """
+        Cut a failed batch off the segment and reopen it for appending.
+        
+        The callers are told the batch failed, so none of it may be
+        recovered later, and a torn frame left in the middle of the log
+        would hide every record written after it from recovery.
+        """
+        path = self._segment_path(self._segment_seq)
+        try:
+            self._segment.close()
+        except OSError:
+            pass  # Flushing the rest of the batch failed again; truncated below
+        try:
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+                os.fsync(f.fileno())
+            self._segment = open(path, "ab")
+        except OSError as e:
+            self._failed = e
+    
+    def _rotate(self, wait: bool) -> None:
+        """Close the current segment, open the next, and compact the closed ones."""
+        self._segment.close()
+        self._segment_seq += 1
+        self._segment = open(self._segment_path(self._segment_seq), "ab")
+        self._segment_records = 0
+        
+        if self._compaction is not None and self._compaction.is_alive():
+            if not wait:
+                return  # The next rotation will pick these segments up
+            self._compaction.join()
+        self._compaction = threading.Thread(
+            target=self._compact, args=(self._segment_seq,), name="wal-compaction", daemon=True
+        )
+        self._compaction.start()
+        if wait:
+            self._compaction.join()
+    
+    def _compact(self, upto: int) -> None:
+        """Fold the snapshot and every segment before `upto` into snapshot-<upto>."""
+        old = self._snapshot_seq
+        sources: List[Callable[[int], Iterator]] = []
+        if old and os.path.exists(self._snapshot_path(old)):
+            sources.append(lambda kind: read_snapshot(self._snapshot_path(old), kind))
+        for seq in range(old or 1, upto):
+            if os.path.exists(self._segment_path(seq)):
+                sources.append(lambda kind, seq=seq: read_segment(self._segment_path(seq), kind))
+        
+        def records(kind: int) -> Iterator:
+            for source in sources:
+                yield from source(kind)
+        
+        # Undelivered events carry over: the old snapshot's, plus those
+        # flagged in the segments, less those the segments mark delivered
+        outbox: "OrderedDict[str, object]" = OrderedDict()
+        if old and os.path.exists(self._snapshot_path(old)):
+            outbox.update(dict.fromkeys(read_snapshot_outbox(self._snapshot_path(old))))
+        for seq in range(old or 1, upto):
+            if os.path.exists(self._segment_path(seq)):
+                _replay_outbox(self._segment_path(seq), outbox)
+        
+        write_snapshot(self._snapshot_path(upto), records(CHARGE), records(REFUND), list(outbox))
+        self._snapshot_seq = upto
+        self.snapshots += 1
+        if old:
+            os.remove(self._snapshot_path(old))
+        for seq in range(old or 1, upto):
+            if os.path.exists(self._segment_path(seq)):
+                os.remove(self._segment_path(seq))
+        _fsync_directory(self.directory)
@@ -0,0 +1,342 @@
+"""
+Payment event webhooks
+
+PaymentProcessor publishes a charge.succeeded or refund.succeeded event
+as soon as each record is stored. Publishing only appends the event to
+an in-memory queue per endpoint; background tasks deliver the queues
+in batches over one pooled HTTP client. A charge therefore never waits
+on a webhook, and a slow or failing endpoint only backs up its own
+queue.
+
+With a durable storage backend the events also sit in the storage's
+outbox, written in the same write as their records. An event leaves
+the outbox once every endpoint has accepted it, so events still queued
+at a crash or shutdown are sent again by the next PaymentProcessor.load().
+
+Delivery is at least once: a batch is retried until the endpoint
+answers 2xx, and events can be sent again after a restart, so
+receivers should dedupe on the event ID, which is derived from the
+record ID and never changes.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, List, Optional, Set, Union
+
+import httpx
+
+from .records import ChargeRecord, RefundRecord
+from .storage import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+CHARGE_SUCCEEDED = "charge.succeeded"
+REFUND_SUCCEEDED = "refund.succeeded"
+
+
+def make_event(event_type: str, record: Union[ChargeRecord, RefundRecord]) -> dict:
+    """Build the webhook payload for a stored charge or refund."""
+    return {
+        "id": f"evt_{record.id}",
+        "type": event_type,
+        "data": record.to_dict(),
+    }
+
+
+def event_type_of(record: Union[ChargeRecord, RefundRecord]) -> str:
+    """The event a stored charge or refund publishes."""
+    return CHARGE_SUCCEEDED if isinstance(record, ChargeRecord) else REFUND_SUCCEEDED
+
+
+class WebhookError(Exception):
+    """An endpoint failed or rejected a delivery."""
+    
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class WebhookDispatcher:
+    """
+    Batched, retrying delivery of events to webhook endpoints.
+    
+    Each endpoint gets a queue and a delivery loop that POSTs up to
+    `batch_size` events at a time as {"events": [...]}. Failed batches
+    (transport errors, 408, 429 and 5xx) are retried with full-jitter
+    exponential backoff, up to `max_retries` times; other responses and
+    exhausted retries move the batch to `dead_letters`.
+    
+    At most `max_in_flight` requests are open across all endpoints, and
+    each endpoint has at most `endpoint_concurrency` batches out, so a
+    failing endpoint can't take every slot.
+    
+    Up to `max_pending` events are held in memory until every endpoint
+    has taken them. With a storage outbox (see use_outbox()), events
+    published past that stay only in storage and are read back once
+    the backlog halves; without one they are held anyway. Either way a
+    warning is logged and `overflowed` counts them; nothing is dropped.
+    """
+    
+    def __init__(
+        self,
+        endpoints: List[str],
+        batch_size: int = 100,
+        max_in_flight: int = 16,
+        endpoint_concurrency: int = 4,
+        max_pending: int = 100000,
+        max_retries: int = 8,
+        backoff_base: float = 0.5,
+        backoff_max: float = 60.0,
+        timeout: float = 5.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.endpoints = list(endpoints)
+        self.batch_size = batch_size
+        self.endpoint_concurrency = endpoint_concurrency
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_in_flight = max_in_flight
+        self.delivered = 0
+        self.overflowed = 0
+        # (endpoint, events, error) for batches given up on, newest last
+        self.dead_letters: Deque[tuple] = deque(maxlen=1000)
+        
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_in_flight,
+                max_keepalive_connections=max_in_flight,
+                keepalive_expiry=30.0
+            ),
+            transport=transport
+        )
+        self._queues: Dict[str, Deque[tuple]] = {url: deque() for url in self.endpoints}
+        # The dispatcher is built at import time, before the server's event
+        # loop exists, so start() creates what binds to a loop (on Python
+        # 3.9, primitives bind to the loop current when they are created)
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        self._loops: List[asyncio.Task] = []
+        # Delivery task -> the batch it is sending
+        self._deliveries: Dict[asyncio.Task, List[tuple]] = {}
+        # Record ID -> endpoints still to accept its event
+        self._unacked: Dict[str, int] = {}
+        # Events being removed from the storage outbox, and events dead-
+        # lettered this run; reading the backlog back skips both
+        self._acking: Set[str] = set()
+        self._given_up: Set[str] = set()
+        self._storage: Optional[StorageBackend] = None
+        # Set while events are past max_pending, i.e. held over the limit
+        # or left in storage
+        self._backlogged = False
+        self._refill: Optional[asyncio.Task] = None
+    
+    def use_outbox(self, storage: StorageBackend) -> None:
+        """
+        Acknowledge delivered events in `storage`'s outbox.
+        
+        The storage must store every published event with its record.
+        """
+        self._storage = storage
+    
+    def publish(self, event_type: str, record: Union[ChargeRecord, RefundRecord]) -> bool:
+        """
+        Queue an event for every endpoint; never blocks or does I/O.
+        
+        Only the record is queued. The payload is built when its batch is
+        sent, so publishing costs a deque append per endpoint.
+        
+        Returns:
+            False if the queues are full and the event was left in the
+            storage outbox, to be read back later
+        """
+        if len(self._unacked) >= self.max_pending:
+            if not self._backlogged:
+                logger.warning(
+                    "%d webhook events are undelivered; %s", len(self._unacked),
+                    "leaving new ones in the storage outbox" if self._storage is not None
+                    else "holding new ones over WEBHOOK_MAX_PENDING"
+                )
+                self._backlogged = True
+            self.overflowed += 1
+            if self._storage is not None:
+                return False
+        self._unacked[record.id] = len(self._queues)
+        event = (event_type, record)
+        for queue in self._queues.values():
+            queue.append(event)
+        for wakeup in self._wakeups.values():
+            wakeup.set()
+        return True
+    
+    def pending(self) -> int:
+        """Events queued or being delivered, summed over endpoints."""
+        queued = sum(len(queue) for queue in self._queues.values())
+        return queued + sum(len(batch) for batch in self._deliveries.values())
+    
+    def start(self) -> None:
+        """Start delivering, from inside the event loop that will run the dispatcher."""
+        if not self._loops:
+            loop = asyncio.get_running_loop()
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+            self._wakeups = {url: asyncio.Event() for url in self.endpoints}
+            self._loops = [loop.create_task(self._run(url)) for url in self.endpoints]
+    
+    async def close(self, drain_timeout: float = 5.0) -> None:
+        """Give queued events up to `drain_timeout` seconds to go out, then stop."""
+        if self._loops:
+            deadline = time.monotonic() + drain_timeout
+            while self.pending() and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            tasks = self._loops + list(self._deliveries)
+            if self._refill is not None:
+                tasks.append(self._refill)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._loops = []
+        await self._client.aclose()
+    
+    async def _run(self, url: str) -> None:
+        queue = self._queues[url]
+        wakeup = self._wakeups[url]
+        slots = asyncio.Semaphore(self.endpoint_concurrency)
+        while True:
+            if not queue:
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+            await slots.acquire()
+            batch = [queue.popleft() for _ in range(min(self.batch_size, len(queue)))]
+            if not batch:
+                slots.release()
+                continue
+            task = asyncio.ensure_future(self._deliver(url, batch))
+            self._deliveries[task] = batch
+            task.add_done_callback(lambda done: self._finished(done, slots))
+    
+    def _finished(self, task: asyncio.Task, slots: asyncio.Semaphore) -> None:
+        del self._deliveries[task]
+        slots.release()
+    
+    async def _deliver(self, url: str, batch: List[tuple]) -> None:
+        events = [make_event(event_type, record) for event_type, record in batch]
+        attempt = 0
+        while True:
+            try:
+                async with self._in_flight:
+                    await self._send(url, events)
+            except WebhookError as e:
+                retryable = (
+                    e.status_code is None or e.status_code in (408, 429) or e.status_code >= 500
+                )
+                if not retryable or attempt >= self.max_retries:
+                    self.dead_letters.append((url, events, str(e)))
+                    await self._settle(batch, delivered=False)
+                    return
+                # Back off without holding an in-flight slot
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            self.delivered += len(batch)
+            await self._settle(batch, delivered=True)
+            return
+    
+    async def _settle(self, batch: List[tuple], delivered: bool) -> None:
+        """
+        Count a batch off at one endpoint.
+        
+        Events every endpoint has accepted are removed from the storage
+        outbox. A dead-lettered event stays there, so it is sent again
+        after a restart, but it isn't read back before then.
+        """
+        done = []
+        for _, record in batch:
+            remaining = self._unacked.get(record.id)
+            if remaining is None:
+                continue  # Dead-lettered at another endpoint
+            if not delivered:
+                del self._unacked[record.id]
+                if self._storage is not None:
+                    self._given_up.add(record.id)
+            elif remaining == 1:
+                del self._unacked[record.id]
+                done.append(record.id)
+            else:
+                self._unacked[record.id] = remaining - 1
+        if done and self._storage is not None:
+            self._acking.update(done)
+            try:
+                await self._storage.mark_delivered(done)
+            except Exception:
+                logger.exception("Removing delivered webhook events from the outbox failed")
+            finally:
+                self._acking.difference_update(done)
+        if self._backlogged and len(self._unacked) <= self.max_pending // 2:
+            if self._storage is None:
+                self._backlogged = False
+            elif self._refill is None or self._refill.done():
+                self._refill = asyncio.ensure_future(self._read_backlog())
+    
+    async def _read_backlog(self) -> None:
+        """Queue events that were left in the storage outbox while the queues were full."""
+        self._backlogged = False
+        room = self.max_pending - len(self._unacked)
+        
+        def read() -> list:
+            skip = (self._unacked, self._acking, self._given_up)
+            return list(islice(
+                (r for r in self._storage.iter_outbox() if not any(r.id in s for s in skip)),
+                room
+            ))
+        
+        try:
+            records = await asyncio.get_running_loop().run_in_executor(None, read)
+        except Exception:
+            logger.exception("Reading webhook events back from the outbox failed")
+            self._backlogged = True
+            return
+        for record in records:
+            if record.id not in self._unacked and not self.publish(event_type_of(record), record):
+                break
+        if len(records) == room:
+            self._backlogged = True  # There may be more; read again once these drain
+    
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+    
+    async def _send(self, url: str, events: List[dict]) -> None:
+        try:
+            response = await self._client.post(url, json={"events": events})
+        except httpx.TimeoutException:
+            raise WebhookError("Webhook request timed out")
+        except httpx.HTTPError as e:
+            raise WebhookError(f"Webhook request failed: {e}")
+        if response.status_code >= 300:
+            raise WebhookError(f"Webhook returned {response.status_code}", response.status_code)
+
+
+def webhook_dispatcher_from_env() -> Optional[WebhookDispatcher]:
+    """
+    Build the dispatcher configured by environment variables.
+    
+    Returns None when WEBHOOK_URLS (comma-separated) is unset, in which
+    case no events are published.
+    """
+    urls = [url.strip() for url in os.getenv("WEBHOOK_URLS", "").split(",") if url.strip()]
+    if not urls:
+        return None
+    return WebhookDispatcher(
+        urls,
+        batch_size=int(os.getenv("WEBHOOK_BATCH_SIZE", 100)),
+        max_in_flight=int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", 16)),
+        max_pending=int(os.getenv("WEBHOOK_MAX_PENDING", 100000)),
+        max_retries=int(os.getenv("WEBHOOK_MAX_RETRIES", 8)),
+        timeout=float(os.getenv("WEBHOOK_TIMEOUT", 5.0))
+    )
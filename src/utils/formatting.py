@@ -2,12 +2,37 @@
 Formatting utilities for payments service
 
 This module demonstrates the API contract change issue with shared-utils v2.0.0
+
+Amounts are formatted from integer minor units by formatters built once
+per (currency, locale) and cached, so formatting a report of thousands
+of amounts doesn't redo the symbol and separator lookups for each one.
 """
+from decimal import Decimal
+from functools import lru_cache
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from .money import currency_exponent, to_minor_units
 
 # Simulating import from shared-utils
 # In real scenario, this would be: from shared_utils import format_currency
 # For demo, we simulate the function call pattern
 
+CURRENCY_SYMBOLS = {
+    "USD": "$",
+    "EUR": "€",
+    "GBP": "£",
+    "JPY": "¥",
+}
+
+# Locale conventions: (group separator, decimal separator, symbol after the amount)
+LOCALES = {
+    "en-US": (",", ".", False),
+    "en-GB": (",", ".", False),
+    "ja-JP": (",", ".", False),
+    "de-DE": (".", ",", True),
+    "fr-FR": ("\u202f", ",", True),
+}
+
 
 def format_currency_wrapper(amount: float) -> str:
     """
@@ -39,6 +64,75 @@ def format_currency_wrapper(amount: float) -> str:
     )
 
 
+# Below this many minor units, dividing as a float and rounding to the
+# currency's decimals gives back the exact amount
+_EXACT_AS_FLOAT = 10 ** 15
+
+
+@lru_cache(maxsize=256)
+def currency_formatter(currency: str, locale: Optional[str] = None) -> Callable[[int], str]:
+    """
+    Formatter of minor-unit amounts in `currency` for `locale`.
+    
+    Formatters are cached per (currency, locale). With no locale, amounts
+    are formatted as `format_payment_amount` does: the symbol, then the
+    amount without grouping.
+    
+    Raises:
+        ValueError: If the locale is not supported
+    """
+    if locale is None:
+        group, decimal, symbol_after = "", ".", False
+    elif locale in LOCALES:
+        group, decimal, symbol_after = LOCALES[locale]
+    else:
+        raise ValueError(f"Unsupported locale: {locale}")
+    symbol = CURRENCY_SYMBOLS.get(currency, currency)
+    exponent = currency_exponent(currency)
+    scale = 10 ** exponent
+    spec = f"{',' if group else ''}.{exponent}f"
+    # format() groups with "," and "."; swap in the locale's separators
+    separators = None
+    if (group or ",", decimal) != (",", "."):
+        separators = str.maketrans({",": group, ".": decimal})
+    prefix, suffix = ("", "\u00a0" + symbol) if symbol_after else (symbol, "")
+    
+    def format_minor(amount_minor: int) -> str:
+        sign = ""
+        if amount_minor < 0:
+            sign, amount_minor = "-", -amount_minor
+        if amount_minor < _EXACT_AS_FLOAT:
+            number = format(amount_minor / scale, spec)
+        else:
+            number = format(Decimal(amount_minor).scaleb(-exponent), spec)
+        if separators is not None:
+            number = number.translate(separators)
+        return f"{sign}{prefix}{number}{suffix}"
+    
+    return format_minor
+
+
+def format_amounts(amounts: Iterable[Tuple[int, str]], locale: Optional[str] = "en-US") -> List[str]:
+    """
+    Format many (amount_minor, currency) pairs, e.g. for a report or export.
+    
+    Args:
+        amounts: Minor-unit amounts with their currencies
+        locale: Locale to format for (see `currency_formatter`)
+        
+    Returns:
+        Formatted amounts, in order
+    """
+    formatters = {}
+    out = []
+    for amount_minor, currency in amounts:
+        formatter = formatters.get(currency)
+        if formatter is None:
+            formatter = formatters[currency] = currency_formatter(currency, locale)
+        out.append(formatter(amount_minor))
+    return out
+
+
 def format_payment_amount(amount: float, currency: str = "USD") -> str:
     """
     Format a payment amount for display.
@@ -48,13 +142,6 @@ def format_payment_amount(amount: float, currency: str = "USD") -> str:
         currency: Currency code
         
     Returns:
-        Formatted amount string
-    """
-    currency_symbols = {
-        "USD": "$",
-        "EUR": "€",
-        "GBP": "£",
-        "JPY": "¥",
-    }
-    symbol = currency_symbols.get(currency, currency)
-    return f"{symbol}{amount:.2f}"
+        Formatted amount string, with the currency's number of decimals
+    """
+    return currency_formatter(currency)(to_minor_units(amount, currency))
@@ -0,0 +1,176 @@
+"""
+In-process metrics with Prometheus text exposition
+
+Latencies are recorded in HDR-style log-linear histograms: each power
+of two is split into a few linear sub-buckets, so recording is a couple
+of integer operations and the relative error is bounded at every scale.
+"""
+import functools
+import time
+from typing import Callable, Dict, List, Tuple
+
+# Sub-buckets per power of two (must be a power of two). 4 bounds the
+# relative bucket width at 25%.
+SUB_BUCKETS = 4
+_SUB_BITS = SUB_BUCKETS.bit_length() - 1
+# Tracked range, in microseconds: 16us .. ~134s
+_MIN_EXPONENT = 4
+_MAX_EXPONENT = 26
+
+
+def _bucket_index(micros: int) -> int:
+    if micros < (1 << _MIN_EXPONENT):
+        return 0
+    exponent = micros.bit_length() - 1
+    if exponent > _MAX_EXPONENT:
+        return len(_BOUNDS)
+    sub = (micros >> (exponent - _SUB_BITS)) & (SUB_BUCKETS - 1)
+    return (exponent - _MIN_EXPONENT) * SUB_BUCKETS + sub + 1
+
+
+def _bucket_bounds() -> List[float]:
+    """Upper bound, in seconds, of every bucket except the overflow bucket."""
+    bounds = [(1 << _MIN_EXPONENT) / 1e6]
+    for exponent in range(_MIN_EXPONENT, _MAX_EXPONENT + 1):
+        step = 1 << (exponent - _SUB_BITS)
+        for sub in range(SUB_BUCKETS):
+            bounds.append(((1 << exponent) + (sub + 1) * step) / 1e6)
+    return bounds
+
+
+_BOUNDS = _bucket_bounds()
+
+
+class Histogram:
+    """Log-linear latency histogram."""
+    
+    __slots__ = ("counts", "count", "total")
+    
+    def __init__(self):
+        self.counts = [0] * (len(_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+    
+    def observe(self, seconds: float) -> None:
+        self.counts[_bucket_index(int(seconds * 1e6))] += 1
+        self.count += 1
+        self.total += seconds
+    
+    def quantile(self, q: float) -> float:
+        """Approximate quantile: the upper bound of the bucket holding it."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return _BOUNDS[index] if index < len(_BOUNDS) else float("inf")
+        return float("inf")
+
+
+class MetricsRegistry:
+    """
+    Request and operation metrics for the service.
+    
+    Updates and rendering all happen on the event loop thread, so
+    recording is plain dict and list operations with no locking.
+    """
+    
+    def __init__(self):
+        self.request_latency: Dict[Tuple[str, str], Histogram] = {}
+        self.request_count: Dict[Tuple[str, str, int], int] = {}
+        self.in_flight: Dict[str, int] = {}
+        self.operation_latency: Dict[str, Histogram] = {}
+        self.operation_errors: Dict[str, int] = {}
+    
+    def request_started(self, method: str) -> None:
+        self.in_flight[method] = self.in_flight.get(method, 0) + 1
+    
+    def request_finished(self, method: str, route: str, status: int, seconds: float) -> None:
+        self.in_flight[method] -= 1
+        key = (method, route)
+        histogram = self.request_latency.get(key)
+        if histogram is None:
+            histogram = self.request_latency[key] = Histogram()
+        histogram.observe(seconds)
+        count_key = (method, route, status)
+        self.request_count[count_key] = self.request_count.get(count_key, 0) + 1
+    
+    def observe_operation(self, operation: str, seconds: float, failed: bool = False) -> None:
+        histogram = self.operation_latency.get(operation)
+        if histogram is None:
+            histogram = self.operation_latency[operation] = Histogram()
+        histogram.observe(seconds)
+        if failed:
+            self.operation_errors[operation] = self.operation_errors.get(operation, 0) + 1
+    
+    def render(self) -> str:
+        """Render all metrics in Prometheus text exposition format."""
+        lines: List[str] = []
+        
+        lines.append("# HELP http_requests_in_flight Requests currently being served.")
+        lines.append("# TYPE http_requests_in_flight gauge")
+        for method, value in sorted(self.in_flight.items()):
+            lines.append(f'http_requests_in_flight{{method="{method}"}} {value}')
+        
+        lines.append("# HELP http_requests_total Requests served, by route and status code.")
+        lines.append("# TYPE http_requests_total counter")
+        for (method, route, status), value in sorted(self.request_count.items()):
+            lines.append(
+                f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {value}'
+            )
+        
+        lines.append("# HELP http_request_duration_seconds Request latency by route.")
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for (method, route), histogram in sorted(self.request_latency.items()):
+            _render_histogram(
+                lines, "http_request_duration_seconds",
+                f'method="{method}",route="{route}"', histogram
+            )
+        
+        lines.append("# HELP payment_processor_operation_seconds PaymentProcessor operation latency.")
+        lines.append("# TYPE payment_processor_operation_seconds histogram")
+        for operation, histogram in sorted(self.operation_latency.items()):
+            _render_histogram(
+                lines, "payment_processor_operation_seconds",
+                f'operation="{operation}"', histogram
+            )
+        
+        lines.append("# HELP payment_processor_operation_errors_total PaymentProcessor operations that raised.")
+        lines.append("# TYPE payment_processor_operation_errors_total counter")
+        for operation, value in sorted(self.operation_errors.items()):
+            lines.append(f'payment_processor_operation_errors_total{{operation="{operation}"}} {value}')
+        
+        return "\n".join(lines) + "\n"
+
+
+def _render_histogram(lines: List[str], name: str, labels: str, histogram: Histogram) -> None:
+    cumulative = 0
+    for bound, count in zip(_BOUNDS, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound:.6g}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.total:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+
+# Process-wide registry used by the middleware, the processor and /metrics
+REGISTRY = MetricsRegistry()
+
+
+def timed(operation: str, registry: MetricsRegistry = REGISTRY) -> Callable:
+    """Decorator recording an async function's latency as an operation metric."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = await func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                registry.observe_operation(operation, time.perf_counter() - start, failed)
+        return wrapper
+    return decorator
@@ -0,0 +1,139 @@
+"""
+Minor-unit money helpers
+
+Amounts are stored as integers in the currency's minor unit (cents for
+USD, yen for JPY) and only converted to decimal amounts at the API edge.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Union
+
+# ISO 4217 minor-unit exponents; currencies not listed use 2
+CURRENCY_EXPONENTS = {
+    "BIF": 0, "CLP": 0, "DJF": 0, "GNF": 0, "ISK": 0, "JPY": 0, "KMF": 0,
+    "KRW": 0, "PYG": 0, "RWF": 0, "UGX": 0, "VND": 0, "VUV": 0, "XAF": 0,
+    "XOF": 0, "XPF": 0,
+    "BHD": 3, "IQD": 3, "JOD": 3, "KWD": 3, "LYD": 3, "OMR": 3, "TND": 3,
+}
+
+
+def currency_exponent(currency: str) -> int:
+    """Return the number of decimal places used by a currency."""
+    return CURRENCY_EXPONENTS.get(currency, 2)
+
+
+def has_minor_precision(amount: float, currency: str) -> bool:
+    """
+    Whether an amount has no more decimal places than the currency uses.
+    
+    round() works from the float's exact decimal value, so 10.005 USD and
+    99.99 JPY fail while 19.99 USD passes despite its binary error.
+    """
+    return round(amount, currency_exponent(currency)) == amount
+
+
+def to_minor_units(amount: float, currency: str) -> int:
+    """Convert a decimal amount to integer minor units, rounding half up."""
+    if isinstance(amount, int):
+        return amount * 10 ** currency_exponent(currency)
+    scaled = amount * 10 ** currency_exponent(currency)
+    if abs(scaled) < 1e12:
+        nearest = round(scaled)
+        # Well away from a half unit, float error can't change the rounding
+        if abs(scaled - nearest) < 0.49:
+            return nearest
+    # Go through the shortest repr so 1.005 rounds like the 1.005 the
+    # client sent, not like the binary float just below it
+    scaled = Decimal(repr(amount)).scaleb(currency_exponent(currency))
+    return int(scaled.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor_units(amount_minor: int, currency: str) -> float:
+    """Convert integer minor units back to a decimal amount."""
+    exponent = currency_exponent(currency)
+    if exponent == 0:
+        return float(amount_minor)
+    return amount_minor / 10 ** exponent
+
+
+class Money:
+    """
+    An amount in integer minor units of one currency.
+    
+    Sums of Money are exact, unlike sums of float amounts, and adding or
+    comparing amounts in different currencies raises ValueError. Money
+    is immutable, so it is safe to hash and to share.
+    """
+    
+    __slots__ = ("_amount_minor", "_currency")
+    
+    def __init__(self, amount_minor: int, currency: str):
+        object.__setattr__(self, "_amount_minor", amount_minor)
+        object.__setattr__(self, "_currency", currency)
+    
+    def __setattr__(self, name: str, value) -> None:
+        raise AttributeError("Money is immutable")
+    
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError("Money is immutable")
+    
+    @property
+    def amount_minor(self) -> int:
+        return self._amount_minor
+    
+    @property
+    def currency(self) -> str:
+        return self._currency
+    
+    @classmethod
+    def of(cls, amount: Union[int, float], currency: str) -> "Money":
+        """Money from a decimal amount in major units, rounding half up."""
+        return cls(to_minor_units(amount, currency), currency)
+    
+    @property
+    def amount(self) -> float:
+        return from_minor_units(self.amount_minor, self.currency)
+    
+    def _same_currency(self, other: "Money") -> None:
+        if self.currency != other.currency:
+            raise ValueError(f"Cannot combine {self.currency} and {other.currency} amounts")
+    
+    def __add__(self, other: "Money") -> "Money":
+        if not isinstance(other, Money):
+            return NotImplemented
+        self._same_currency(other)
+        return Money(self.amount_minor + other.amount_minor, self.currency)
+    
+    def __radd__(self, other) -> "Money":
+        # sum() starts from 0
+        if other == 0:
+            return self
+        return NotImplemented
+    
+    def __sub__(self, other: "Money") -> "Money":
+        if not isinstance(other, Money):
+            return NotImplemented
+        self._same_currency(other)
+        return Money(self.amount_minor - other.amount_minor, self.currency)
+    
+    def __neg__(self) -> "Money":
+        return Money(-self.amount_minor, self.currency)
+    
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Money):
+            return NotImplemented
+        return self.amount_minor == other.amount_minor and self.currency == other.currency
+    
+    def __lt__(self, other: "Money") -> bool:
+        if not isinstance(other, Money):
+            return NotImplemented
+        self._same_currency(other)
+        return self.amount_minor < other.amount_minor
+    
+    def __le__(self, other: "Money") -> bool:
+        return self == other or self < other
+    
+    def __hash__(self) -> int:
+        return hash((self.amount_minor, self.currency))
+    
+    def __repr__(self) -> str:
+        return f"Money({self.amount_minor!r}, {self.currency!r})"
@@ -0,0 +1,44 @@
+"""
+Per-request phase timings
+
+SlowRequestMiddleware starts a RequestTimer for each request. Route
+code calls lap() as each phase ends, and the time since the previous
+lap (or the start of the request) is added to that phase, so phases
+cover the request end to end without nesting. Outside a timed request
+lap() is a no-op.
+"""
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional
+
+
+class RequestTimer:
+    """Phase durations of one request, in seconds."""
+    
+    __slots__ = ("start", "phases", "_last")
+    
+    def __init__(self):
+        self.start = self._last = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+    
+    def lap(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self._last)
+        self._last = now
+    
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+
+current_timer: ContextVar[Optional[RequestTimer]] = ContextVar("current_timer", default=None)
+
+# The latest requests over the slow-request threshold, oldest first
+SLOW_REQUESTS: Deque[dict] = deque(maxlen=100)
+
+
+def lap(phase: str) -> None:
+    """Charge the time since the last lap to `phase` of the current request."""
+    timer = current_timer.get()
+    if timer is not None:
+        timer.lap(phase)
@@ -3,7 +3,29 @@ Validation utilities for payments service
 
 ISSUE: This is DUPLICATED LOGIC - the same validation exists in shared-utils
 Both services implement their own version instead of using the shared library
+
+The validate_* functions check one value. The batch functions check whole
+columns for bulk ingest: they use NumPy when it is installed and fall back
+to plain Python otherwise, and give the same answer as the scalar versions.
 """
+from typing import List, Optional, Sequence, Union
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; batch validation falls back to Python
+    np = None
+
+MAX_ORDER_TOTAL = 1000000
+VALID_CURRENCIES = frozenset({"USD", "EUR", "GBP", "JPY", "CAD", "AUD"})
+VALID_PAYMENT_METHODS = frozenset({"card", "bank_transfer", "paypal", "apple_pay", "google_pay"})
+
+# Per-row error flags returned by validate_batch(); 0 means the row is valid
+INVALID_AMOUNT = 1
+INVALID_CURRENCY = 2
+INVALID_PAYMENT_METHOD = 4
+
+# A NumPy array when NumPy is installed, otherwise a list
+Mask = Union["np.ndarray", List[bool]]
 
 
 def validate_order_total(total: float) -> bool:
@@ -26,7 +48,7 @@ def validate_order_total(total: float) -> bool:
         return False
     if total < 0:
         return False
-    if total > 1000000:
+    if total > MAX_ORDER_TOTAL:
         return False
     return True
 
@@ -41,8 +63,7 @@ def validate_currency(currency: str) -> bool:
     Returns:
         True if valid, False otherwise
     """
-    valid_currencies = {"USD", "EUR", "GBP", "JPY", "CAD", "AUD"}
-    return currency in valid_currencies
+    return currency in VALID_CURRENCIES
 
 
 def validate_payment_method(method: str) -> bool:
@@ -55,5 +76,88 @@ def validate_payment_method(method: str) -> bool:
     Returns:
         True if valid, False otherwise
     """
-    valid_methods = {"card", "bank_transfer", "paypal", "apple_pay", "google_pay"}
-    return method in valid_methods
+    return method in VALID_PAYMENT_METHODS
+
+
+def validate_order_totals(totals: Sequence) -> Mask:
+    """
+    Validate a column of order totals.
+    
+    Args:
+        totals: Order totals; a list or a NumPy array
+        
+    Returns:
+        Per-row mask, True where validate_order_total() would be True
+    """
+    if np is None:
+        return [isinstance(t, (int, float)) and 0 <= t <= MAX_ORDER_TOTAL for t in totals]
+    
+    values = totals if isinstance(totals, np.ndarray) else np.asarray(totals)
+    if values.dtype.kind not in "biuf":
+        # Mixed column (strings, None, ...): only real numbers can pass
+        values = np.fromiter(
+            (t if isinstance(t, (int, float)) else np.nan for t in totals),
+            dtype=np.float64,
+            count=len(totals)
+        )
+    # NaN fails both comparisons, matching the scalar NaN check
+    return (values >= 0) & (values <= MAX_ORDER_TOTAL)
+
+
+def validate_currencies(currencies: Sequence) -> Mask:
+    """Validate a column of currency codes; see validate_order_totals()."""
+    return _member_mask(currencies, VALID_CURRENCIES)
+
+
+def validate_payment_methods(methods: Sequence) -> Mask:
+    """Validate a column of payment methods; see validate_order_totals()."""
+    return _member_mask(methods, VALID_PAYMENT_METHODS)
+
+
+def _member_mask(values: Sequence, table: frozenset) -> Mask:
+    if np is None:
+        return list(map(table.__contains__, values))
+    if isinstance(values, np.ndarray) and values.dtype.kind == "U":
+        return np.isin(values, np.array(sorted(table)))
+    # Frozenset membership runs in C via map(); NumPy only holds the result
+    return np.fromiter(map(table.__contains__, values), dtype=bool, count=len(values))
+
+
+def validate_batch(
+    amounts: Sequence,
+    currencies: Optional[Sequence] = None,
+    methods: Optional[Sequence] = None
+) -> Mask:
+    """
+    Validate columns of a bulk upload row by row.
+    
+    Args:
+        amounts: Order totals
+        currencies: Currency codes, or None to skip the check
+        methods: Payment methods, or None to skip the check
+        
+    Returns:
+        Per-row error flags: INVALID_AMOUNT | INVALID_CURRENCY |
+        INVALID_PAYMENT_METHOD, or 0 for a valid row
+        
+    Raises:
+        ValueError: If the columns have different lengths
+    """
+    columns = [(validate_order_totals(amounts), INVALID_AMOUNT)]
+    if currencies is not None:
+        columns.append((validate_currencies(currencies), INVALID_CURRENCY))
+    if methods is not None:
+        columns.append((validate_payment_methods(methods), INVALID_PAYMENT_METHOD))
+    if any(len(mask) != len(amounts) for mask, _ in columns):
+        raise ValueError("All columns must have the same number of rows")
+    
+    if np is None:
+        flags = [0] * len(amounts)
+        for mask, flag in columns:
+            flags = [f if ok else f | flag for f, ok in zip(flags, mask)]
+        return flags
+    
+    flags = np.zeros(len(amounts), dtype=np.uint8)
+    for mask, flag in columns:
+        flags[~mask] |= flag
+    return flags
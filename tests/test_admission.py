@@ -0,0 +1,179 @@
+"""
+Tests for adaptive admission control
+"""
+import asyncio
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.admission import READ, WRITE, AdmissionController, GradientLimit, Overloaded
+
+
+def fixed_limit(n: int) -> GradientLimit:
+    return GradientLimit(initial=n, min_limit=n, max_limit=n)
+
+
+class TestGradientLimit:
+    """Tests for the latency-driven limit"""
+    
+    def test_grows_while_latency_is_steady(self):
+        limit = GradientLimit(initial=10, max_limit=100)
+        for _ in range(50):
+            limit.update(0.010, in_flight=int(limit.limit))
+        assert limit.limit > 20
+    
+    def test_shrinks_when_latency_rises(self):
+        limit = GradientLimit(initial=50, min_limit=4)
+        for _ in range(200):
+            limit.update(0.010, in_flight=50)
+        grown = limit.limit
+        for _ in range(30):
+            limit.update(0.100, in_flight=int(limit.limit))
+        assert limit.limit < grown / 2
+    
+    def test_idle_samples_do_not_grow_limit(self):
+        limit = GradientLimit(initial=20)
+        for _ in range(100):
+            limit.update(0.010, in_flight=1)
+        assert limit.limit == 20
+    
+    def test_mix_of_kinds_is_not_congestion(self):
+        limit = GradientLimit(initial=20)
+        for i in range(200):
+            # Fast lookups and slow charges, each at their usual latency
+            limit.update(0.0005 if i % 2 else 0.020, in_flight=int(limit.limit), kind=i % 2)
+        assert limit.limit > 20
+    
+    def test_congested_kind_holds_back_growth(self):
+        limit = GradientLimit(initial=20, min_limit=4)
+        for _ in range(50):
+            limit.update(0.020, in_flight=20, kind=WRITE)
+        for _ in range(20):
+            limit.update(0.200, in_flight=int(limit.limit), kind=WRITE)
+        shrunk = limit.limit
+        for _ in range(100):
+            limit.update(0.0005, in_flight=int(limit.limit), kind=READ)
+        assert limit.limit <= shrunk
+    
+    def test_fast_outliers_do_not_set_the_baseline(self):
+        limit = GradientLimit(initial=40)
+        for i in range(1000):
+            # 1% of requests far faster than the rest, e.g. early failures
+            limit.update(0.00005 if i % 100 == 0 else 0.020, in_flight=int(limit.limit))
+        assert limit.limit == 500
+    
+    def test_bounds(self):
+        limit = GradientLimit(initial=10, min_limit=5, max_limit=12)
+        for _ in range(100):
+            limit.update(0.010, in_flight=12)
+        assert limit.limit == 12
+        for _ in range(100):
+            limit.update(10.0, in_flight=12)
+        assert limit.limit == 5
+
+
+class TestAdmissionController:
+    """Tests for queueing, deadlines and priorities"""
+    
+    async def test_admits_up_to_limit_then_queues(self):
+        controller = AdmissionController(fixed_limit(2), queue_timeout=1.0)
+        first = await controller.acquire(READ)
+        await controller.acquire(READ)
+        waiter = asyncio.ensure_future(controller.acquire(READ))
+        await asyncio.sleep(0)
+        assert controller.queued == 1 and not waiter.done()
+        
+        controller.release(first, READ)
+        await waiter
+        assert controller.in_flight == 2
+        assert controller.queued == 0
+    
+    async def test_queue_deadline(self):
+        controller = AdmissionController(fixed_limit(1), queue_timeout=0.01)
+        await controller.acquire(WRITE)
+        with pytest.raises(Overloaded, match="Timed out"):
+            await controller.acquire(WRITE)
+        assert controller.queued == 0
+        assert controller.shed == 1
+    
+    async def test_sheds_early_when_wait_would_exceed_deadline(self):
+        controller = AdmissionController(fixed_limit(1), queue_timeout=0.5)
+        controller.limit.update(1.0, in_flight=1)
+        await controller.acquire(READ)
+        # One request ahead at ~1 s each can't start within 0.5 s
+        with pytest.raises(Overloaded, match="in time"):
+            await controller.acquire(READ)
+    
+    async def test_full_queue_sheds(self):
+        controller = AdmissionController(fixed_limit(1), max_queue=1, queue_timeout=1.0)
+        await controller.acquire(READ)
+        waiter = asyncio.ensure_future(controller.acquire(READ))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded, match="queued"):
+            await controller.acquire(READ)
+        waiter.cancel()
+    
+    async def test_writes_start_before_queued_reads(self):
+        controller = AdmissionController(fixed_limit(1), queue_timeout=1.0, read_share=0)
+        started = await controller.acquire(READ)
+        order = []
+        
+        async def request(priority, name):
+            await controller.acquire(priority)
+            order.append(name)
+        
+        tasks = [
+            asyncio.ensure_future(request(READ, "read-1")),
+            asyncio.ensure_future(request(READ, "read-2")),
+            asyncio.ensure_future(request(WRITE, "write")),
+        ]
+        await asyncio.sleep(0)
+        controller.release(started, READ)
+        await asyncio.sleep(0)
+        assert order == ["write"]
+        controller.release(0.0, WRITE)
+        await asyncio.sleep(0)
+        controller.release(0.0, READ)
+        await asyncio.sleep(0)
+        assert order == ["write", "read-1", "read-2"]
+        await asyncio.gather(*tasks)
+    
+    async def test_reads_keep_a_share_of_slots(self):
+        controller = AdmissionController(fixed_limit(10), queue_timeout=1.0, read_share=0.2)
+        for _ in range(10):
+            await controller.acquire(WRITE)
+        write = asyncio.ensure_future(controller.acquire(WRITE))
+        read = asyncio.ensure_future(controller.acquire(READ))
+        await asyncio.sleep(0)
+        
+        controller.release(0.0, WRITE)
+        await asyncio.sleep(0)
+        # No reads running, so the freed slot goes to the read
+        assert read.done() and not write.done()
+        controller.release(0.0, WRITE)
+        await write
+    
+    async def test_write_displaces_queued_read(self):
+        controller = AdmissionController(fixed_limit(1), max_queue=1, queue_timeout=1.0)
+        await controller.acquire(READ)
+        read = asyncio.ensure_future(controller.acquire(READ))
+        await asyncio.sleep(0)
+        write = asyncio.ensure_future(controller.acquire(WRITE))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded, match="Displaced"):
+            await read
+        assert controller.queued == 1
+        write.cancel()
+    
+    async def test_cancelled_waiter_leaves_queue(self):
+        controller = AdmissionController(fixed_limit(1), queue_timeout=1.0)
+        started = await controller.acquire(READ)
+        waiter = asyncio.ensure_future(controller.acquire(READ))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert controller.queued == 0
+        controller.release(started, READ)
+        assert controller.in_flight == 0
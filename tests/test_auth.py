@@ -0,0 +1,133 @@
+"""
+Tests for bearer token verification
+"""
+import base64
+import json
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.auth import InvalidToken, TokenVerifier
+
+
+class FakeClock:
+    def __init__(self, now=1704067200.0):
+        self.now = now
+    
+    def __call__(self):
+        return self.now
+
+
+def b64(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+
+class TestTokenVerifier:
+    """Tests for signature and claim checks"""
+    
+    def test_round_trip(self):
+        verifier = TokenVerifier("secret")
+        claims = verifier.verify(verifier.sign({"sub": "client-1"}))
+        assert claims["sub"] == "client-1"
+    
+    def test_wrong_key_rejected(self):
+        token = TokenVerifier("other").sign({"sub": "client-1"})
+        with pytest.raises(InvalidToken, match="signature"):
+            TokenVerifier("secret").verify(token)
+    
+    def test_tampered_payload_rejected(self):
+        verifier = TokenVerifier("secret")
+        header, _, signature = verifier.sign({"sub": "client-1"}).split(".")
+        forged = f"{header}.{b64({'sub': 'admin', 'exp': 9999999999})}.{signature}"
+        with pytest.raises(InvalidToken, match="signature"):
+            verifier.verify(forged)
+    
+    def test_alg_none_rejected(self):
+        token = f"{b64({'alg': 'none'})}.{b64({'sub': 'admin', 'exp': 9999999999})}."
+        with pytest.raises(InvalidToken, match="HS256"):
+            TokenVerifier("secret").verify(token)
+    
+    @pytest.mark.parametrize("token", ["", "abc", "a.b", "a.b.c.d", "!!.??.##"])
+    def test_malformed_rejected(self, token):
+        with pytest.raises(InvalidToken):
+            TokenVerifier("secret").verify(token)
+    
+    def test_expiry_with_leeway(self):
+        clock = FakeClock()
+        verifier = TokenVerifier("secret", leeway=30, cache_size=0, clock=clock)
+        token = verifier.sign({"sub": "client-1"}, ttl=60)
+        clock.now += 80
+        verifier.verify(token)
+        clock.now += 20
+        with pytest.raises(InvalidToken, match="expired"):
+            verifier.verify(token)
+    
+    def test_expiry_required(self):
+        verifier = TokenVerifier("secret")
+        token = verifier.sign({"sub": "client-1", "exp": None})
+        with pytest.raises(InvalidToken, match="expiry"):
+            verifier.verify(token)
+    
+    def test_not_before(self):
+        clock = FakeClock()
+        verifier = TokenVerifier("secret", leeway=0, clock=clock)
+        token = verifier.sign({"nbf": clock.now + 60})
+        with pytest.raises(InvalidToken, match="not valid yet"):
+            verifier.verify(token)
+        clock.now += 60
+        verifier.verify(token)
+    
+    def test_issuer_and_audience(self):
+        verifier = TokenVerifier("secret", issuer="auth", audience="payments")
+        assert verifier.verify(verifier.sign({}))["aud"] == "payments"
+        assert verifier.verify(verifier.sign({"aud": ["orders", "payments"]}))
+        with pytest.raises(InvalidToken, match="issuer"):
+            verifier.verify(verifier.sign({"iss": "elsewhere"}))
+        with pytest.raises(InvalidToken, match="audience"):
+            verifier.verify(verifier.sign({"aud": "orders"}))
+
+
+class TestTokenCache:
+    """Tests for the verified-claims cache"""
+    
+    def test_repeat_verification_skips_signature_check(self, monkeypatch):
+        verifier = TokenVerifier("secret")
+        token = verifier.sign({"sub": "client-1"})
+        calls = 0
+        original = verifier._verify
+        
+        def counting(*args):
+            nonlocal calls
+            calls += 1
+            return original(*args)
+        
+        monkeypatch.setattr(verifier, "_verify", counting)
+        for _ in range(5):
+            verifier.verify(token)
+        assert calls == 1
+        assert len(verifier) == 1
+    
+    def test_cached_token_still_expires(self):
+        clock = FakeClock()
+        verifier = TokenVerifier("secret", leeway=0, cache_ttl=600, clock=clock)
+        token = verifier.sign({"sub": "client-1"}, ttl=60)
+        verifier.verify(token)
+        clock.now += 61
+        with pytest.raises(InvalidToken, match="expired"):
+            verifier.verify(token)
+        assert len(verifier) == 0
+    
+    def test_cache_is_bounded(self):
+        verifier = TokenVerifier("secret", cache_size=3)
+        for i in range(10):
+            verifier.verify(verifier.sign({"sub": f"client-{i}"}))
+        assert len(verifier) == 3
+    
+    def test_rejected_tokens_not_cached(self):
+        verifier = TokenVerifier("secret")
+        token = TokenVerifier("other").sign({"sub": "client-1"})
+        for _ in range(2):
+            with pytest.raises(InvalidToken):
+                verifier.verify(token)
+        assert len(verifier) == 0
@@ -5,6 +5,7 @@ WARNING: This test file contains FLAKY TESTS that depend on:
 1. time.sleep() - makes tests slow and timing-dependent
 2. Real network calls to httpbin.org - can fail due to network issues
 """
+import json
 import pytest
 import time
 import requests
@@ -15,8 +16,14 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 from src.main import app
+from src.routes import payments
+from src.services.auth import TokenVerifier
 
-client = TestClient(app)
+payments.token_verifier = TokenVerifier("test-secret")
+AUTH_HEADERS = {"Authorization": "Bearer " + payments.token_verifier.sign({"sub": "test-client"})}
+
+client = TestClient(app, headers=AUTH_HEADERS)
+anonymous_client = TestClient(app)
 
 
 class TestChargeEndpoint:
@@ -53,14 +60,24 @@ class TestChargeEndpoint:
         )
         assert response.status_code == 400
     
-    def test_charge_missing_auth_vulnerability(self):
-        """
-        Test demonstrating the missing auth vulnerability.
-        This test PASSES but highlights a security issue:
-        The /charge endpoint accepts requests without any authorization.
-        """
-        # No authorization header provided - but request still succeeds!
-        response = client.post(
+    def test_create_charge_rejects_extra_decimals(self):
+        for amount, currency in ((99.99, "JPY"), (10.005, "USD")):
+            response = client.post(
+                "/api/payments/charge",
+                json={
+                    "order_id": "order-123",
+                    "amount": amount,
+                    "currency": currency,
+                    "customer_id": "cust-456",
+                    "payment_method": "card"
+                }
+            )
+            assert response.status_code == 400
+            assert response.json()["detail"] == f"Amount has more decimal places than {currency} allows"
+    
+    def test_charge_requires_auth(self):
+        """Test that charge endpoint rejects requests without a token"""
+        response = anonymous_client.post(
             "/api/payments/charge",
             json={
                 "order_id": "order-999",
@@ -69,11 +86,56 @@ class TestChargeEndpoint:
                 "customer_id": "victim-customer",
                 "payment_method": "card"
             }
-            # NOTE: No Authorization header!
         )
-        # BUG: This should return 401, but returns 200
-        # The endpoint lacks authorization check
-        assert response.status_code == 200  # This is the vulnerability!
+        assert response.status_code == 401
+        assert response.headers["WWW-Authenticate"] == "Bearer"
+    
+    def test_charge_rejects_forged_token(self):
+        """Test that a token signed with another key is rejected"""
+        forged = TokenVerifier("other-secret").sign({"sub": "attacker"})
+        response = anonymous_client.post(
+            "/api/payments/charge",
+            json={
+                "order_id": "order-999",
+                "amount": 1000.00,
+                "currency": "USD",
+                "customer_id": "victim-customer",
+                "payment_method": "card"
+            },
+            headers={"Authorization": f"Bearer {forged}"}
+        )
+        assert response.status_code == 401
+    
+    def test_charge_rejects_token_without_subject(self):
+        """Test that a token must name the caller"""
+        token = payments.token_verifier.sign({"scope": "payments"})
+        response = anonymous_client.post(
+            "/api/payments/charge",
+            json={
+                "order_id": "order-999",
+                "amount": 10.00,
+                "currency": "USD",
+                "customer_id": "cust-456",
+                "payment_method": "card"
+            },
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 401
+        assert response.json()["detail"] == "Token has no subject"
+    
+    def test_batch_requires_auth(self):
+        """Test that batch charges need a token too"""
+        response = anonymous_client.post(
+            "/api/payments/charges/batch",
+            json={"charges": [{
+                "order_id": "order-999",
+                "amount": 10.00,
+                "currency": "USD",
+                "customer_id": "victim-customer",
+                "payment_method": "card"
+            }]}
+        )
+        assert response.status_code == 401
 
 
 class TestFlakyTests:
@@ -171,16 +233,26 @@ class TestRefundEndpoint:
     
     def test_refund_requires_auth(self):
         """Test that refund endpoint requires authorization"""
-        response = client.post(
+        response = anonymous_client.post(
             "/api/payments/refund",
             json={
                 "charge_id": "ch_123456",
                 "amount": 50.00
             }
         )
-        # Refund correctly requires auth (unlike /charge)
         assert response.status_code == 401
     
+    def test_refund_rejects_expired_token(self):
+        """Test that an expired token is rejected"""
+        expired = payments.token_verifier.sign({"sub": "test-client"}, ttl=-3600)
+        response = anonymous_client.post(
+            "/api/payments/refund",
+            json={"charge_id": "ch_123456", "amount": 50.00},
+            headers={"Authorization": f"Bearer {expired}"}
+        )
+        assert response.status_code == 401
+        assert response.json()["detail"] == "Token has expired"
+    
     def test_refund_with_auth(self):
         """Test refund with proper authorization"""
         # First create a charge
@@ -203,7 +275,497 @@ class TestRefundEndpoint:
                 "charge_id": charge_id,
                 "amount": 50.00,
                 "reason": "Customer request"
-            },
-            headers={"Authorization": "Bearer test-token"}
+            }
         )
         assert response.status_code == 200
+
+
+class TestChargeLookups:
+    """Tests for order and customer charge lookups"""
+    
+    def test_customer_charges_paginated(self):
+        for i in range(3):
+            client.post(
+                "/api/payments/charge",
+                json={
+                    "order_id": f"order-page-{i}",
+                    "amount": 10.00,
+                    "currency": "USD",
+                    "customer_id": "cust-page",
+                    "payment_method": "card"
+                }
+            )
+        
+        response = client.get("/api/payments/customers/cust-page/charges?limit=2")
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["charges"]) == 2
+        assert data["next_cursor"] is not None
+        
+        response = client.get(
+            f"/api/payments/customers/cust-page/charges?limit=2&cursor={data['next_cursor']}"
+        )
+        data = response.json()
+        assert len(data["charges"]) == 1
+        assert data["next_cursor"] is None
+    
+    def test_order_charges_invalid_cursor(self):
+        response = client.get("/api/payments/orders/order-123/charges?cursor=bogus")
+        assert response.status_code == 400
+    
+    def test_charge_and_refund_reads_require_auth(self):
+        # IDs are time-ordered and guessable, so reads need a token too
+        charge_url = "/api/payments/charges/ch_0000000000000001"
+        for url in (charge_url, charge_url + "/refunds"):
+            assert anonymous_client.get(url).status_code == 401
+    
+    def test_order_and_customer_lists_require_auth(self):
+        for url in ("/api/payments/orders/order-123/charges", "/api/payments/customers/cust-456/charges"):
+            assert anonymous_client.get(url).status_code == 401
+
+
+class TestBatchChargeEndpoint:
+    """Tests for the /api/payments/charges/batch endpoint"""
+    
+    def test_batch_returns_per_item_results_in_order(self):
+        items = [
+            {
+                "order_id": f"order-batch-{i}",
+                "amount": 10.00,
+                "currency": "USD",
+                "customer_id": "cust-batch",
+                "payment_method": "card"
+            }
+            for i in range(3)
+        ]
+        items[1]["amount"] = -5
+        items.append(dict(items[0], order_id="order-batch-3", amount=10.005))
+        
+        response = client.post("/api/payments/charges/batch", json={"charges": items})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["succeeded"] == 2
+        assert data["failed"] == 2
+        assert [r["index"] for r in data["results"]] == [0, 1, 2, 3]
+        assert data["results"][0]["charge"]["order_id"] == "order-batch-0"
+        assert data["results"][1]["error"] == "Invalid amount"
+        assert data["results"][1]["charge"] is None
+        assert data["results"][3]["error"] == "Amount has more decimal places than USD allows"
+    
+    def test_batch_rejects_empty(self):
+        response = client.post("/api/payments/charges/batch", json={"charges": []})
+        assert response.status_code == 422
+
+
+class TestChargeIdempotency:
+    """Tests for Idempotency-Key handling on /charge"""
+    
+    def test_retry_returns_original_charge(self):
+        body = {
+            "order_id": "order-idem",
+            "amount": 42.00,
+            "currency": "USD",
+            "customer_id": "cust-idem",
+            "payment_method": "card"
+        }
+        headers = {"Idempotency-Key": "idem-retry-1"}
+        first = client.post("/api/payments/charge", json=body, headers=headers)
+        second = client.post("/api/payments/charge", json=body, headers=headers)
+        
+        assert first.status_code == 200
+        assert second.status_code == 200
+        assert second.json()["id"] == first.json()["id"]
+        assert second.headers["Idempotent-Replayed"] == "true"
+    
+    def test_key_reuse_with_different_body(self):
+        body = {
+            "order_id": "order-idem-2",
+            "amount": 10.00,
+            "currency": "USD",
+            "customer_id": "cust-idem",
+            "payment_method": "card"
+        }
+        headers = {"Idempotency-Key": "idem-conflict-1"}
+        client.post("/api/payments/charge", json=body, headers=headers)
+        response = client.post(
+            "/api/payments/charge",
+            json={**body, "amount": 20.00},
+            headers=headers
+        )
+        assert response.status_code == 422
+        assert response.json()["detail"] == "Idempotency key idem-conflict-1 was used with a different request"
+    
+    def test_keys_are_scoped_to_the_token_subject(self):
+        body = {
+            "order_id": "order-idem-3",
+            "amount": 10.00,
+            "currency": "USD",
+            "customer_id": "cust-idem",
+            "payment_method": "card"
+        }
+        other = "Bearer " + payments.token_verifier.sign({"sub": "other-client"})
+        first = client.post("/api/payments/charge", json=body, headers={"Idempotency-Key": "idem-shared-1"})
+        second = client.post(
+            "/api/payments/charge",
+            json=body,
+            headers={"Idempotency-Key": "idem-shared-1", "Authorization": other}
+        )
+        
+        assert second.status_code == 200
+        assert second.json()["id"] != first.json()["id"]
+        assert "Idempotent-Replayed" not in second.headers
+
+
+class TestExportEndpoint:
+    """Tests for the /api/payments/export NDJSON stream"""
+    
+    def test_export_streams_ndjson(self):
+        for i in range(3):
+            client.post(
+                "/api/payments/charge",
+                json={
+                    "order_id": f"order-export-{i}",
+                    "amount": 5.00,
+                    "currency": "GBP",
+                    "customer_id": "cust-export",
+                    "payment_method": "card"
+                }
+            )
+        
+        response = client.get("/api/payments/export?customer_id=cust-export")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line["data"]["order_id"] for line in lines] == [
+            "order-export-0", "order-export-1", "order-export-2"
+        ]
+        assert all(line["type"] == "charge" for line in lines)
+        
+        resumed = client.get(
+            f"/api/payments/export?customer_id=cust-export&cursor={lines[0]['cursor']}"
+        )
+        assert len(resumed.text.splitlines()) == 2
+    
+    def test_export_requires_auth(self):
+        response = anonymous_client.get("/api/payments/export")
+        assert response.status_code == 401
+    
+    def test_export_invalid_cursor(self):
+        response = client.get("/api/payments/export?cursor=bad")
+        assert response.status_code == 400
+
+
+class TestRefundLedgerEndpoints:
+    """Tests for refund balance checks over HTTP"""
+    
+    def test_over_refund_rejected_and_history_listed(self):
+        charge_id = client.post(
+            "/api/payments/charge",
+            json={
+                "order_id": "order-ledger",
+                "amount": 20.00,
+                "currency": "USD",
+                "customer_id": "cust-ledger",
+                "payment_method": "card"
+            }
+        ).json()["id"]
+        
+        ok = client.post(
+            "/api/payments/refund",
+            json={"charge_id": charge_id, "amount": 15.00}
+        )
+        too_much = client.post(
+            "/api/payments/refund",
+            json={"charge_id": charge_id, "amount": 10.00}
+        )
+        assert ok.status_code == 200
+        assert too_much.status_code == 400
+        
+        history = client.get(f"/api/payments/charges/{charge_id}/refunds").json()
+        assert history["amount_refunded"] == 15.00
+        assert history["amount_remaining"] == 5.00
+        assert [r["id"] for r in history["refunds"]] == [ok.json()["id"]]
+    
+    def test_refund_unknown_charge(self):
+        response = client.post(
+            "/api/payments/refund",
+            json={"charge_id": "ch_unknown", "amount": 1.00}
+        )
+        assert response.status_code == 404
+
+
+class TestSettlementReportEndpoint:
+    """Tests for /api/payments/reports/settlement"""
+    
+    def test_report_includes_new_charge(self):
+        before = client.get("/api/payments/reports/settlement?currency=CHF").json()
+        gross_before = before["totals"].get("CHF", {}).get("gross", 0)
+        
+        client.post(
+            "/api/payments/charge",
+            json={
+                "order_id": "order-settle",
+                "amount": 12.50,
+                "currency": "CHF",
+                "customer_id": "cust-settle",
+                "payment_method": "card"
+            }
+        )
+        
+        report = client.get("/api/payments/reports/settlement?currency=CHF").json()
+        assert report["totals"]["CHF"]["gross"] == gross_before + 12.50
+        assert all(bucket["currency"] == "CHF" for bucket in report["buckets"])
+        assert {"date", "payment_method", "status", "charge_count", "net"} <= set(report["buckets"][0])
+    
+    def test_report_requires_auth(self):
+        response = anonymous_client.get("/api/payments/reports/settlement")
+        assert response.status_code == 401
+    
+    def test_report_rejects_bad_date(self):
+        response = client.get("/api/payments/reports/settlement?date_from=yesterday")
+        assert response.status_code == 422
+    
+    def test_report_formats_for_locale(self):
+        report = client.get("/api/payments/reports/settlement?locale=de-DE").json()
+        assert all("display" in bucket for bucket in report["buckets"])
+        assert client.get("/api/payments/reports/settlement?locale=xx-XX").status_code == 400
+
+
+class TestRateLimiting:
+    """Tests for 429 responses from the payments rate limits"""
+    
+    def test_customer_limit_returns_429_with_retry_after(self, monkeypatch):
+        from src.routes import payments
+        from src.services.rate_limit import RateLimiter
+        monkeypatch.setattr(payments, "customer_rate_limiter", RateLimiter(rate=0.01, burst=2))
+        
+        body = {
+            "order_id": "order-limited",
+            "amount": 1.00,
+            "currency": "USD",
+            "customer_id": "cust-limited",
+            "payment_method": "card"
+        }
+        statuses = [client.post("/api/payments/charge", json=body).status_code for _ in range(3)]
+        assert statuses == [200, 200, 429]
+        
+        response = client.post("/api/payments/charge", json=body)
+        assert int(response.headers["Retry-After"]) >= 1
+        
+        other = dict(body, customer_id="cust-unlimited")
+        assert client.post("/api/payments/charge", json=other).status_code == 200
+    
+    def test_batch_counts_each_customer(self, monkeypatch):
+        from src.routes import payments
+        from src.services.rate_limit import RateLimiter
+        monkeypatch.setattr(payments, "customer_rate_limiter", RateLimiter(rate=0.01, burst=1))
+        
+        item = {
+            "order_id": "order-limited-batch",
+            "amount": 1.00,
+            "currency": "USD",
+            "customer_id": "cust-limited-batch",
+            "payment_method": "card"
+        }
+        client.post("/api/payments/charge", json=item)
+        response = client.post("/api/payments/charges/batch", json={"charges": [item]})
+        assert response.status_code == 429
+    
+    def test_batch_takes_one_unit_per_charge(self, monkeypatch):
+        from src.routes import payments
+        from src.services.rate_limit import RateLimiter
+        monkeypatch.setattr(payments, "customer_rate_limiter", RateLimiter(rate=0.01, burst=3))
+        
+        def item(customer_id):
+            return {
+                "order_id": "order-limited-items",
+                "amount": 1.00,
+                "currency": "USD",
+                "customer_id": customer_id,
+                "payment_method": "card"
+            }
+        
+        batch = [item("cust-items-a")] * 2 + [item("cust-items-b")]
+        assert client.post("/api/payments/charges/batch", json={"charges": batch}).status_code == 200
+        # cust-items-a has one unit left, so the whole batch is refused and
+        # cust-items-b keeps its allowance
+        response = client.post("/api/payments/charges/batch", json={"charges": batch})
+        assert response.status_code == 429
+        assert "cust-items-a" in response.json()["detail"]
+        assert client.post("/api/payments/charge", json=item("cust-items-b")).status_code == 200
+        assert client.post("/api/payments/charge", json=item("cust-items-b")).status_code == 200
+        
+        too_many = {"charges": [item("cust-items-c")] * 4}
+        assert client.post("/api/payments/charges/batch", json=too_many).status_code == 400
+    
+    def test_client_limit_is_per_token_subject(self, monkeypatch):
+        from src.routes import payments
+        from src.services.rate_limit import RateLimiter
+        monkeypatch.setattr(payments, "client_rate_limiter", RateLimiter(rate=0.01, burst=1))
+        
+        def bearer(sub, ttl):
+            return {"Authorization": "Bearer " + payments.token_verifier.sign({"sub": sub}, ttl=ttl)}
+        
+        url = "/api/payments/charges/ch_missing"
+        assert client.get(url, headers=bearer("limited", 60)).status_code == 404
+        # A fresh token for the same subject shares its allowance
+        assert client.get(url, headers=bearer("limited", 120)).status_code == 429
+        assert client.get(url, headers=bearer("other", 60)).status_code == 404
+    
+    def test_made_up_credentials_share_the_address_limit(self, monkeypatch):
+        from src.routes import payments
+        from src.services.rate_limit import RateLimiter
+        monkeypatch.setattr(payments, "client_rate_limiter", RateLimiter(rate=0.01, burst=1))
+        
+        url = "/api/payments/charges/ch_missing"
+        assert anonymous_client.get(url, headers={"Authorization": "Bearer junk-1"}).status_code == 401
+        assert anonymous_client.get(url, headers={"Authorization": "Bearer junk-2"}).status_code == 429
+        assert anonymous_client.get(url, headers={"X-API-Key": "key-3"}).status_code == 429
+    
+    def test_unauthenticated_charges_do_not_use_customer_limit(self, monkeypatch):
+        from src.routes import payments
+        from src.services.rate_limit import RateLimiter
+        monkeypatch.setattr(payments, "customer_rate_limiter", RateLimiter(rate=0.01, burst=1))
+        
+        body = {
+            "order_id": "order-victim",
+            "amount": 1.00,
+            "currency": "USD",
+            "customer_id": "cust-victim",
+            "payment_method": "card"
+        }
+        for _ in range(3):
+            assert anonymous_client.post("/api/payments/charge", json=body).status_code == 401
+        assert client.post("/api/payments/charge", json=body).status_code == 200
+
+
+class TestConditionalGet:
+    """Tests for ETag / If-None-Match on polled lookups"""
+    
+    def create_charge(self, order_id):
+        return client.post(
+            "/api/payments/charge",
+            json={
+                "order_id": order_id,
+                "amount": 30.00,
+                "currency": "USD",
+                "customer_id": "cust-etag",
+                "payment_method": "card"
+            }
+        ).json()["id"]
+    
+    def test_unchanged_charge_returns_304(self):
+        charge_id = self.create_charge("order-etag-1")
+        first = client.get(f"/api/payments/charges/{charge_id}")
+        assert first.status_code == 200
+        etag = first.headers["ETag"]
+        
+        again = client.get(f"/api/payments/charges/{charge_id}", headers={"If-None-Match": etag})
+        assert again.status_code == 304
+        assert again.content == b""
+        assert again.headers["ETag"] == etag
+        
+        cached = client.get(f"/api/payments/charges/{charge_id}")
+        assert cached.content == first.content
+        assert cached.json()["id"] == charge_id
+    
+    def test_refund_changes_charge_etag(self):
+        charge_id = self.create_charge("order-etag-2")
+        before = client.get(f"/api/payments/charges/{charge_id}/refunds")
+        etag = before.headers["ETag"]
+        
+        client.post("/api/payments/refund", json={"charge_id": charge_id, "amount": 10.00})
+        
+        after = client.get(
+            f"/api/payments/charges/{charge_id}/refunds", headers={"If-None-Match": etag}
+        )
+        assert after.status_code == 200
+        assert after.headers["ETag"] != etag
+        assert after.json()["amount_refunded"] == 10.00
+    
+    def test_new_charge_changes_order_etag(self):
+        self.create_charge("order-etag-3")
+        before = client.get("/api/payments/orders/order-etag-3/charges")
+        etag = before.headers["ETag"]
+        assert client.get(
+            "/api/payments/orders/order-etag-3/charges", headers={"If-None-Match": etag}
+        ).status_code == 304
+        
+        self.create_charge("order-etag-3")
+        after = client.get(
+            "/api/payments/orders/order-etag-3/charges", headers={"If-None-Match": etag}
+        )
+        assert after.status_code == 200
+        assert len(after.json()["charges"]) == 2
+    
+    def test_pages_are_cached_separately(self):
+        for _ in range(3):
+            self.create_charge("order-etag-4")
+        page = client.get("/api/payments/orders/order-etag-4/charges?limit=2").json()
+        full = client.get("/api/payments/orders/order-etag-4/charges").json()
+        assert len(page["charges"]) == 2
+        assert len(full["charges"]) == 3
+    
+    def test_unknown_charge_still_404(self):
+        response = client.get("/api/payments/charges/ch_missing_etag")
+        assert response.status_code == 404
+        assert "ETag" not in response.headers
+
+
+class TestAdmissionControl:
+    """Tests for 503 load shedding on the payments endpoints"""
+    
+    def make_controller(self, slots=1):
+        from src.services.admission import AdmissionController, GradientLimit
+        return AdmissionController(
+            GradientLimit(initial=slots, min_limit=slots, max_limit=slots), max_queue=0
+        )
+    
+    def test_shed_requests_get_503_with_retry_after(self, monkeypatch):
+        # As if other requests held every slot
+        controller = self.make_controller(slots=0)
+        monkeypatch.setattr(payments, "admission_controller", controller)
+        
+        response = client.get("/api/payments/charges/ch_missing")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        response = client.post("/api/payments/charge", json={
+            "order_id": "order-shed",
+            "amount": 1.00,
+            "currency": "USD",
+            "customer_id": "cust-shed",
+            "payment_method": "card"
+        })
+        assert response.status_code == 503
+        assert controller.shed == 2
+    
+    def test_slot_is_released_after_request(self, monkeypatch):
+        controller = self.make_controller()
+        monkeypatch.setattr(payments, "admission_controller", controller)
+        for _ in range(3):
+            assert client.get("/api/payments/charges/ch_missing").status_code == 404
+        assert controller.in_flight == 0
+    
+    def test_only_served_requests_inform_the_limit(self, monkeypatch):
+        controller = self.make_controller()
+        monkeypatch.setattr(payments, "admission_controller", controller)
+        body = {
+            "order_id": "order-limit",
+            "amount": 1.00,
+            "currency": "USD",
+            "customer_id": "cust-limit",
+            "payment_method": "card"
+        }
+        assert client.get("/api/payments/charges/ch_missing").status_code == 404
+        assert anonymous_client.post("/api/payments/charge", json=body).status_code == 401
+        assert client.post("/api/payments/charge", json=dict(body, amount=-1)).status_code == 400
+        assert controller.limit.latency is None
+        assert controller.in_flight == 0
+        
+        assert client.post("/api/payments/charge", json=body).status_code == 200
+        assert controller.limit.latency is not None
+    
+    def test_export_is_not_admission_controlled(self, monkeypatch):
+        controller = self.make_controller(slots=0)
+        monkeypatch.setattr(payments, "admission_controller", controller)
+        assert client.get("/api/payments/export").status_code == 200
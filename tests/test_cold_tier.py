@@ -0,0 +1,226 @@
+"""
+Tests for the on-disk cold tier of charges
+"""
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.cold_tier import ColdTier, Segment, _key_hash, write_segment
+from src.services.payment_processor import PaymentProcessor
+from src.services.records import ChargeRecord
+from src.services.wal import WALStorage
+
+
+def make_charge(i, order_id=None, customer_id="cust-1"):
+    return ChargeRecord(
+        id=f"ch_{i:016x}",
+        order_id=order_id or f"order-{i}",
+        amount_minor=100 + i,
+        currency="USD",
+        customer_id=customer_id,
+        payment_method="card",
+        status="succeeded",
+        created_at=1704067200.0 + i,
+    )
+
+
+async def settle(processor):
+    """Wait for any background move to the cold tier to finish."""
+    while processor._eviction is not None and not processor._eviction.done():
+        await processor._eviction
+
+
+class TestSegment:
+    """Tests for a single segment file"""
+    
+    def test_lookups(self, tmp_path):
+        path = str(tmp_path / "segment")
+        charges = [make_charge(i, order_id=f"order-{i % 3}", customer_id=f"cust-{i % 2}")
+                   for i in range(10)]
+        write_segment(path, charges, level=0)
+        segment = Segment(path)
+        
+        assert segment.count == 10
+        assert segment.get(4) == charges[4]
+        assert segment.get(99) is None
+        assert list(segment) == charges
+        assert [c.id for c in segment.find("order_id", "order-1", _key_hash("order-1"), 0, None)] == [
+            charges[1].id, charges[4].id, charges[7].id
+        ]
+        assert [c.id for c in segment.find("customer_id", "cust-0", _key_hash("cust-0"), 3, 8)] == [
+            charges[4].id, charges[6].id
+        ]
+        assert list(segment.find("order_id", "order-9", _key_hash("order-9"), 0, None)) == []
+        segment.close()
+
+
+class TestColdTier:
+    """Tests for writing, merging and reading segments"""
+    
+    async def test_merges_full_levels(self, tmp_path):
+        tier = ColdTier(str(tmp_path), fanout=4)
+        for batch in range(9):
+            await tier.add([make_charge(batch * 10 + i) for i in range(10)])
+        
+        # 8 level-0 segments became two of level 1, leaving one new one
+        assert tier.merges == 2
+        assert tier.segments == 3
+        assert len(tier) == 90
+        assert len(os.listdir(tmp_path)) == 3
+        assert [c.id for c in tier.scan()] == [make_charge(i).id for i in range(90)]
+        assert tier.get(make_charge(42).id) == make_charge(42)
+        tier.close()
+    
+    async def test_merge_size_is_capped(self, tmp_path):
+        tier = ColdTier(str(tmp_path), fanout=2, max_segment_charges=15)
+        for batch in range(4):
+            await tier.add([make_charge(batch * 10 + i) for i in range(10)])
+        assert tier.segments == 4
+        tier.close()
+    
+    async def test_segment_count_stays_bounded(self, tmp_path):
+        # The defaults' ratio: a 512 MB budget evicts ~240k charges at a
+        # time against a 1M-charge cap, so fanout segments overflow the cap
+        tier = ColdTier(str(tmp_path), max_segment_charges=100)
+        for batch in range(200):
+            await tier.add([make_charge(batch * 24 + i) for i in range(24)])
+        
+        assert len(tier) == 4800
+        assert tier.segments <= len(tier) // 96 + tier.fanout
+        assert [c.id for c in tier.scan()] == [make_charge(i).id for i in range(4800)]
+        assert tier.get(make_charge(1234).id) == make_charge(1234)
+        tier.close()
+    
+    async def test_overlapping_segments_read_in_id_order(self, tmp_path):
+        tier = ColdTier(str(tmp_path))
+        await tier.add([make_charge(i, order_id="order-1") for i in (1, 3, 5)])
+        await tier.add([make_charge(i, order_id="order-1") for i in (2, 4)])
+        ids = [c.id for c in tier.find("order_id", "order-1", after=make_charge(1).id)]
+        assert ids == [make_charge(i).id for i in (2, 3, 4, 5)]
+        assert [c.id for c in tier.scan(start=make_charge(2).id, stop=make_charge(5).id)] == [
+            make_charge(i).id for i in (2, 3, 4)
+        ]
+        assert tier.get(make_charge(4).id) is not None
+        tier.close()
+    
+    def test_opening_clears_directory(self, tmp_path):
+        (tmp_path / "segment-00000000.seg").write_bytes(b"stale")
+        ColdTier(str(tmp_path))
+        assert os.listdir(tmp_path) == []
+    
+    async def test_malformed_ids_are_not_found(self, tmp_path):
+        tier = ColdTier(str(tmp_path))
+        await tier.add([make_charge(1)])
+        assert tier.get("ch_nothex") is None
+        assert tier.get("../etc/passwd") is None
+        tier.close()
+
+
+class TestTieredProcessor:
+    """Tests for PaymentProcessor with a cold tier"""
+    
+    def make_processor(self, tmp_path, charges=20, **kwargs):
+        # A budget of about `charges` charges
+        tier = ColdTier(str(tmp_path / "cold"), memory_budget=charges * 560)
+        return PaymentProcessor(cold_tier=tier, **kwargs)
+    
+    async def test_old_charges_move_to_disk(self, tmp_path):
+        processor = self.make_processor(tmp_path)
+        charges = []
+        for i in range(200):
+            charges.append(await processor.charge(f"order-{i % 50}", 10.0, "USD", "cust-1", "card"))
+            await settle(processor)
+        
+        assert len(processor._charges) <= 20
+        assert len(processor._cold) + len(processor._charges) == 200
+        assert processor._hot_bytes <= processor._cold.memory_budget
+        for charge in (charges[0], charges[100], charges[-1]):
+            assert await processor.get_charge(charge.id) == charge
+        assert await processor.get_charge("ch_0000000000000000") is None
+        await processor.close()
+    
+    async def test_order_and_customer_lists_span_tiers(self, tmp_path):
+        processor = self.make_processor(tmp_path)
+        expected = []
+        for i in range(100):
+            charge = await processor.charge("order-1" if i % 4 == 0 else f"order-x{i}",
+                                            10.0, "USD", "cust-1", "card")
+            if i % 4 == 0:
+                expected.append(charge.id)
+            await settle(processor)
+        
+        assert [c.id for c in await processor.get_charges_by_order("order-1")] == expected
+        seen, cursor = [], None
+        while True:
+            page, cursor = await processor.list_charges_by_order("order-1", limit=3, cursor=cursor)
+            seen.extend(c.id for c in page)
+            if cursor is None:
+                break
+        assert seen == expected
+        
+        customer, _ = await processor.list_charges_by_customer("cust-1")
+        assert len(customer) == 100
+        await processor.close()
+    
+    async def test_versions_and_refunds_span_tiers(self, tmp_path):
+        processor = self.make_processor(tmp_path)
+        first = await processor.charge("order-1", 10.0, "USD", "cust-1", "card")
+        await processor.refund(first.id, amount=1.0)
+        version = processor.order_version("order-1")
+        assert processor.charge_version(first.id) == 1
+        for i in range(100):
+            await processor.charge(f"order-x{i}", 10.0, "USD", "cust-1", "card")
+            await settle(processor)
+        assert first.id not in processor._charges
+        
+        # Moving the charge to disk doesn't change what the versions say
+        assert processor.order_version("order-1") == version
+        assert processor.charge_version(first.id) == 1
+        
+        await processor.refund(first.id, amount=2.0)
+        assert await processor.get_refund_balance(first.id) == (300, 700)
+        assert processor.order_version("order-1") == version + 1
+        assert processor.charge_version(first.id) == 2
+        await processor.close()
+    
+    async def test_walk_spans_tiers(self, tmp_path):
+        processor = self.make_processor(tmp_path)
+        ids = []
+        for i in range(60):
+            ids.append((await processor.charge(f"order-{i}", 10.0, "USD", "cust-1", "card")).id)
+            await settle(processor)
+        
+        assert [cid for cid, _ in processor.iter_charges()] == ids
+        assert [cid for cid, _ in processor.iter_charges(cursor=ids[9])] == ids[10:]
+        assert [cid for cid, _ in processor.iter_charges(customer_id="cust-1")] == ids
+        await processor.close()
+    
+    async def test_walk_survives_eviction(self, tmp_path):
+        processor = self.make_processor(tmp_path)
+        ids = [(await processor.charge(f"order-{i}", 10.0, "USD", "cust-1", "card")).id
+               for i in range(15)]
+        walk = processor.iter_charges()
+        walked = [next(walk)[0]]
+        for i in range(30):
+            await processor.charge(f"order-y{i}", 10.0, "USD", "cust-1", "card")
+            await settle(processor)
+        walked.extend(cid for cid, _ in walk)
+        assert walked == ids
+        await processor.close()
+    
+    async def test_load_rebuilds_tiers(self, tmp_path):
+        storage = WALStorage(str(tmp_path / "wal"))
+        processor = PaymentProcessor(storage=storage)
+        ids = [(await processor.charge(f"order-{i}", 10.0, "USD", "cust-1", "card")).id
+               for i in range(100)]
+        await processor.close()
+        
+        restarted = self.make_processor(tmp_path, storage=WALStorage(str(tmp_path / "wal")))
+        assert await restarted.load() == 100
+        assert len(restarted._charges) <= 20
+        assert [c.id for c in restarted._cold.scan()] == ids[:len(restarted._cold)]
+        assert await restarted.get_charge(ids[0]) is not None
+        report = await restarted.settlement_report()
+        assert sum(row["charge_count"] for row in report) == 100
+        await restarted.close()
@@ -8,7 +8,9 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from src.utils.formatting import format_currency_wrapper, format_payment_amount
+from src.utils.formatting import (
+    currency_formatter, format_amounts, format_currency_wrapper, format_payment_amount
+)
 
 
 class TestFormatCurrencyWrapper:
@@ -73,3 +75,29 @@ class TestFormatPaymentAmount:
     def test_format_default_currency(self):
         result = format_payment_amount(50.00)
         assert result == "$50.00"
+    
+    def test_format_zero_decimal_currency(self):
+        assert format_payment_amount(1500, "JPY") == "¥1500"
+        assert format_payment_amount(1.5, "KWD") == "KWD1.500"
+
+
+class TestCurrencyFormatter:
+    """Tests for cached per-locale formatters"""
+    
+    def test_locales(self):
+        assert currency_formatter("USD", "en-US")(123456789) == "$1,234,567.89"
+        assert currency_formatter("EUR", "de-DE")(123456789) == "1.234.567,89\u00a0€"
+        assert currency_formatter("JPY", "ja-JP")(150000) == "¥150,000"
+        assert currency_formatter("USD", "en-US")(-5) == "-$0.05"
+    
+    def test_formatters_are_cached(self):
+        assert currency_formatter("GBP", "en-GB") is currency_formatter("GBP", "en-GB")
+    
+    def test_unsupported_locale(self):
+        with pytest.raises(ValueError, match="xx-XX"):
+            currency_formatter("USD", "xx-XX")
+    
+    def test_batch(self):
+        amounts = [(1999, "USD"), (500, "JPY"), (-250, "EUR")]
+        assert format_amounts(amounts) == ["$19.99", "¥500", "-€2.50"]
+        assert format_amounts([], "fr-FR") == []
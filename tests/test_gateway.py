@@ -0,0 +1,172 @@
+"""
+Tests for the payment gateway client
+"""
+import asyncio
+import httpx
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.gateway import (
+    CircuitBreaker,
+    GatewayError,
+    GatewayUnavailable,
+    PaymentGateway,
+)
+from src.services.payment_processor import PaymentProcessor
+from src.services.stub_gateway import create_stub_gateway
+
+
+def make_gateway(handler, **kwargs) -> PaymentGateway:
+    kwargs.setdefault("backoff_base", 0)
+    return PaymentGateway(
+        "http://gateway.test",
+        transport=httpx.MockTransport(handler),
+        **kwargs
+    )
+
+
+class TestPaymentGateway:
+    """Tests for retries, circuit breaking and hedging"""
+    
+    async def test_retries_server_errors_with_reference_as_idempotency_key(self):
+        keys = []
+        
+        def handler(request):
+            keys.append(request.headers["Idempotency-Key"])
+            if len(keys) < 3:
+                return httpx.Response(503)
+            return httpx.Response(200, json={"id": "gw_1"})
+        
+        gateway = make_gateway(handler, max_retries=2)
+        assert await gateway.charge({"reference": "ch_1", "amount": 1.0}) == {"id": "gw_1"}
+        assert keys == ["ch_1"] * 3
+        await gateway.close()
+    
+    async def test_client_errors_are_not_retried(self):
+        calls = 0
+        
+        def handler(request):
+            nonlocal calls
+            calls += 1
+            return httpx.Response(402)
+        
+        gateway = make_gateway(handler, max_retries=2)
+        with pytest.raises(GatewayError) as exc_info:
+            await gateway.charge({"reference": "ch_1", "amount": 1.0})
+        assert exc_info.value.status_code == 402
+        assert calls == 1
+        assert gateway.breaker.state == CircuitBreaker.CLOSED
+        await gateway.close()
+    
+    async def test_malformed_success_body_is_a_gateway_error(self):
+        calls = 0
+        
+        def handler(request):
+            nonlocal calls
+            calls += 1
+            return httpx.Response(200, content=b"<html>upstream proxy</html>")
+        
+        gateway = make_gateway(handler, max_retries=1, breaker=CircuitBreaker(failure_threshold=1))
+        with pytest.raises(GatewayError, match="malformed"):
+            await gateway.charge({"reference": "ch_1", "amount": 1.0})
+        assert calls == 2
+        assert gateway.breaker.state == CircuitBreaker.OPEN
+        await gateway.close()
+    
+    async def test_circuit_opens_and_fails_fast(self):
+        calls = 0
+        
+        def handler(request):
+            nonlocal calls
+            calls += 1
+            return httpx.Response(500)
+        
+        gateway = make_gateway(
+            handler,
+            max_retries=0,
+            breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        )
+        for _ in range(2):
+            with pytest.raises(GatewayError):
+                await gateway.charge({"reference": "ch_1", "amount": 1.0})
+        with pytest.raises(GatewayUnavailable):
+            await gateway.charge({"reference": "ch_1", "amount": 1.0})
+        assert calls == 2
+        await gateway.close()
+    
+    async def test_hedged_request_wins_over_slow_primary(self):
+        stub = create_stub_gateway()
+        calls = 0
+        asgi = httpx.ASGITransport(app=stub)
+        
+        class SlowFirstTransport(httpx.AsyncBaseTransport):
+            async def handle_async_request(self, request):
+                nonlocal calls
+                calls += 1
+                if calls == 1:
+                    await asyncio.sleep(10)
+                return await asgi.handle_async_request(request)
+        
+        gateway = PaymentGateway(
+            "http://gateway.test",
+            hedge_after=0.01,
+            transport=SlowFirstTransport()
+        )
+        result = await asyncio.wait_for(gateway.charge({"reference": "ch_1", "amount": 5.0}), timeout=2)
+        assert result["status"] == "succeeded"
+        assert calls == 2
+        await gateway.close()
+
+
+class TestCircuitBreaker:
+    """Tests for CircuitBreaker state transitions"""
+    
+    def test_half_open_allows_single_trial(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        assert breaker.allow() is False
+        
+        now[0] = 11
+        assert breaker.allow() is True
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow() is False
+        
+        breaker.record_success()
+        assert breaker.allow() is True
+
+
+class TestProcessorWithGateway:
+    """Tests for PaymentProcessor calling the gateway"""
+    
+    async def test_gateway_failure_does_not_record_charge(self):
+        gateway = make_gateway(lambda request: httpx.Response(402))
+        processor = PaymentProcessor(gateway=gateway)
+        with pytest.raises(GatewayError):
+            await processor.charge("order-1", 10.0, "USD", "cust-1", "card")
+        assert await processor.get_charges_by_order("order-1") == []
+        await processor.close()
+    
+    async def test_idempotency_keys_are_record_ids(self):
+        keys = []
+        
+        def handler(request):
+            keys.append(request.headers["Idempotency-Key"])
+            return httpx.Response(200, json={})
+        
+        processor = PaymentProcessor(gateway=make_gateway(handler))
+        charge = await processor.charge("order-1", 10.0, "USD", "cust-1", "card")
+        refund = await processor.refund(charge.id)
+        assert keys == [charge.id, refund.id]
+        await processor.close()
+    
+    async def test_charge_through_stub_gateway(self):
+        stub = create_stub_gateway()
+        gateway = PaymentGateway("http://gateway.test", transport=httpx.ASGITransport(app=stub))
+        processor = PaymentProcessor(gateway=gateway)
+        charge = await processor.charge("order-1", 10.0, "USD", "cust-1", "card")
+        assert charge.status == "succeeded"
+        assert stub.state.requests == 1
+        await processor.close()
@@ -0,0 +1,132 @@
+"""
+Tests for the idempotency cache
+"""
+import asyncio
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.idempotency import IdempotencyCache, IdempotencyConflict
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self):
+        return self.now
+
+
+class TestIdempotencyCache:
+    """Tests for IdempotencyCache"""
+    
+    async def test_replays_finished_result(self):
+        cache = IdempotencyCache()
+        calls = 0
+        
+        async def operation():
+            nonlocal calls
+            calls += 1
+            return {"id": calls}
+        
+        first = await cache.run("key-1", operation)
+        second = await cache.run("key-1", operation)
+        assert first == ({"id": 1}, False)
+        assert second == ({"id": 1}, True)
+        assert calls == 1
+    
+    async def test_concurrent_requests_wait_for_first(self):
+        cache = IdempotencyCache()
+        release = asyncio.Event()
+        calls = 0
+        
+        async def operation():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "done"
+        
+        tasks = [asyncio.ensure_future(cache.run("key-1", operation)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+        
+        assert calls == 1
+        assert [r[0] for r in results] == ["done"] * 5
+        assert sum(1 for _, replayed in results if not replayed) == 1
+    
+    async def test_waiters_survive_cancelled_first_request(self):
+        cache = IdempotencyCache()
+        release = asyncio.Event()
+        calls = 0
+        
+        async def operation():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "done"
+        
+        first = asyncio.ensure_future(cache.run("key-1", operation))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(cache.run("key-1", operation))
+        await asyncio.sleep(0)
+        # The first client disconnects mid-charge
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        
+        assert await waiter == ("done", True)
+        assert first.cancelled()
+        assert calls == 1
+        assert cache.get("key-1") == "done"
+    
+    async def test_failures_are_not_cached(self):
+        cache = IdempotencyCache()
+        
+        async def failing():
+            raise RuntimeError("gateway down")
+        
+        async def succeeding():
+            return "ok"
+        
+        with pytest.raises(RuntimeError):
+            await cache.run("key-1", failing)
+        assert await cache.run("key-1", succeeding) == ("ok", False)
+    
+    async def test_conflicting_fingerprint(self):
+        cache = IdempotencyCache()
+        
+        async def operation():
+            return "ok"
+        
+        await cache.run("key-1", operation, fingerprint="body-a")
+        with pytest.raises(IdempotencyConflict):
+            await cache.run("key-1", operation, fingerprint="body-b")
+    
+    async def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = IdempotencyCache(ttl=10, clock=clock)
+        
+        async def operation():
+            return clock.now
+        
+        await cache.run("key-1", operation)
+        clock.now = 11
+        assert cache.get("key-1") is None
+        assert await cache.run("key-1", operation) == (11, False)
+    
+    async def test_lru_eviction(self):
+        cache = IdempotencyCache(max_entries=2)
+        
+        async def operation():
+            return "ok"
+        
+        await cache.run("a", operation)
+        await cache.run("b", operation)
+        cache.get("a")
+        await cache.run("c", operation)
+        
+        assert len(cache) == 2
+        assert cache.get("a") == "ok"
+        assert cache.get("b") is None
@@ -0,0 +1,83 @@
+"""
+Tests for time-sortable ID generation
+"""
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.utils.ids import (
+    IdGenerator,
+    MAX_WORKER_ID,
+    id_lower_bound,
+    id_timestamp,
+    is_valid_id,
+)
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+    
+    def __call__(self):
+        return self.now
+
+
+class TestIdGenerator:
+    """Tests for IdGenerator"""
+    
+    def test_ids_sort_in_creation_order(self):
+        generator = IdGenerator(7)
+        ids = [generator.new_id("ch") for _ in range(10000)]
+        assert ids == sorted(ids)
+        assert len(set(ids)) == len(ids)
+        assert all(is_valid_id(i, "ch") for i in ids)
+    
+    def test_timestamp_round_trip(self):
+        generator = IdGenerator(1, clock=FakeClock(1700000000.1239))
+        assert id_timestamp(generator.new_id("ch")) == 1700000000.123
+    
+    def test_clock_going_backwards_stays_monotonic(self):
+        clock = FakeClock(1700000001.0)
+        generator = IdGenerator(1, clock=clock)
+        first = generator.new_id("ch")
+        clock.now = 1700000000.0
+        assert generator.new_id("ch") > first
+    
+    def test_sequence_overflow_borrows_next_millisecond(self):
+        generator = IdGenerator(1, clock=FakeClock(1700000000.0))
+        ids = [generator.new_id("ch") for _ in range(4097)]
+        assert ids == sorted(ids)
+        assert id_timestamp(ids[-1]) == 1700000000.001
+    
+    def test_worker_id_range(self):
+        IdGenerator(MAX_WORKER_ID)
+        with pytest.raises(ValueError):
+            IdGenerator(MAX_WORKER_ID + 1)
+    
+    def test_workers_never_collide(self):
+        clock = FakeClock(1700000000.0)
+        a, b = IdGenerator(1, clock=clock), IdGenerator(2, clock=clock)
+        assert a.new_id("ch") != b.new_id("ch")
+
+
+class TestIdHelpers:
+    """Tests for ID bounds and validation"""
+    
+    def test_lower_bound_splits_on_timestamp(self):
+        clock = FakeClock(1700000000.123)
+        generator = IdGenerator(MAX_WORKER_ID, clock=clock)
+        at = generator.new_id("ch")
+        clock.now = 1700000000.122
+        before = IdGenerator(MAX_WORKER_ID, clock=clock).new_id("ch")
+        
+        bound = id_lower_bound("ch", 1700000000.123)
+        assert before < bound <= at
+        assert id_lower_bound("ch", 1700000000.1225) > before
+    
+    def test_is_valid_id(self):
+        assert is_valid_id("ch_0123456789abcdef", "ch")
+        assert not is_valid_id("re_0123456789abcdef", "ch")
+        assert not is_valid_id("ch_0123456789ABCDEF", "ch")
+        assert not is_valid_id("ch_123", "ch")
+        assert not is_valid_id("42", "ch")
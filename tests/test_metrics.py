@@ -0,0 +1,86 @@
+"""
+Tests for request and operation metrics
+"""
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fastapi.testclient import TestClient
+
+from src.main import app
+from src.routes import payments
+from src.services.auth import TokenVerifier
+from src.utils.metrics import Histogram, MetricsRegistry
+
+VERIFIER = TokenVerifier("metrics-secret")
+AUTH_HEADERS = {"Authorization": "Bearer " + VERIFIER.sign({"sub": "test-client"})}
+
+client = TestClient(app)
+
+
+class TestHistogram:
+    """Tests for the log-linear histogram"""
+    
+    def test_quantiles_within_bucket_error(self):
+        histogram = Histogram()
+        for ms in range(1, 101):
+            histogram.observe(ms / 1000)
+        assert histogram.count == 100
+        p50 = histogram.quantile(0.50)
+        p99 = histogram.quantile(0.99)
+        assert 0.050 <= p50 <= 0.050 * 1.25
+        assert 0.099 <= p99 <= 0.099 * 1.25
+    
+    def test_out_of_range_values(self):
+        histogram = Histogram()
+        histogram.observe(0)
+        histogram.observe(10000)
+        assert histogram.counts[0] == 1
+        assert histogram.counts[-1] == 1
+
+
+class TestMetricsRegistry:
+    """Tests for Prometheus rendering"""
+    
+    def test_render_histogram_is_cumulative(self):
+        registry = MetricsRegistry()
+        registry.request_started("GET")
+        registry.request_finished("GET", "/health", 200, 0.001)
+        registry.request_started("GET")
+        registry.request_finished("GET", "/health", 200, 0.5)
+        text = registry.render()
+        
+        assert 'http_requests_total{method="GET",route="/health",status="200"} 2' in text
+        assert 'http_requests_in_flight{method="GET"} 0' in text
+        assert 'http_request_duration_seconds_bucket{method="GET",route="/health",le="+Inf"} 2' in text
+        assert 'http_request_duration_seconds_count{method="GET",route="/health"} 2' in text
+        
+        buckets = [
+            int(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+            if line.startswith("http_request_duration_seconds_bucket")
+        ]
+        assert buckets == sorted(buckets)
+
+
+class TestMetricsEndpoint:
+    """Tests for GET /metrics"""
+    
+    def test_records_route_template_and_processor_timings(self, monkeypatch):
+        monkeypatch.setattr(payments, "token_verifier", VERIFIER)
+        client.get("/api/payments/charges/ch_does_not_exist", headers=AUTH_HEADERS)
+        response = client.get("/metrics")
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert (
+            'http_requests_total{method="GET",route="/api/payments/charges/{charge_id}",status="404"}'
+            in response.text
+        )
+        assert 'payment_processor_operation_seconds_count{operation="get_charge"}' in response.text
+    
+    def test_unmatched_paths_share_a_label(self):
+        client.get("/no/such/path/123")
+        response = client.get("/metrics")
+        assert 'route="unmatched",status="404"' in response.text
+        assert "/no/such/path/123" not in response.text
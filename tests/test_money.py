@@ -0,0 +1,77 @@
+"""
+Tests for minor-unit money helpers
+"""
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.utils.money import (
+    Money,
+    currency_exponent,
+    from_minor_units,
+    has_minor_precision,
+    to_minor_units,
+)
+
+
+class TestMinorUnits:
+    """Tests for minor-unit conversion"""
+    
+    def test_two_decimal_currency(self):
+        assert to_minor_units(99.99, "USD") == 9999
+        assert from_minor_units(9999, "USD") == 99.99
+    
+    def test_zero_decimal_currency(self):
+        assert currency_exponent("JPY") == 0
+        assert to_minor_units(500, "JPY") == 500
+        assert from_minor_units(500, "JPY") == 500.0
+    
+    def test_rounds_half_up_on_decimal_value(self):
+        # 1.005 is stored as 1.00499999... in binary
+        assert to_minor_units(1.005, "USD") == 101
+    
+    def test_round_trip(self):
+        for amount in (0.01, 0.29, 19.99, 123456.78, 1000000):
+            assert from_minor_units(to_minor_units(amount, "EUR"), "EUR") == amount
+    
+    def test_minor_precision(self):
+        for amount, currency in ((19.99, "USD"), (0.29, "EUR"), (500, "JPY"), (1.234, "KWD")):
+            assert has_minor_precision(amount, currency)
+        for amount, currency in ((10.005, "USD"), (1.005, "USD"), (99.99, "JPY"), (1.2345, "KWD")):
+            assert not has_minor_precision(amount, currency)
+
+
+class TestMoney:
+    """Tests for the Money type"""
+    
+    def test_sums_are_exact(self):
+        total = sum([Money.of(0.1, "USD")] * 3)
+        assert total == Money(30, "USD")
+        assert total.amount == 0.3
+        assert Money.of(10, "USD") - Money.of(2.5, "USD") == Money(750, "USD")
+        assert -Money(5, "EUR") == Money(-5, "EUR")
+    
+    def test_zero_decimal_currency(self):
+        assert Money.of(1500, "JPY").amount_minor == 1500
+        assert Money.of(1.234, "KWD").amount_minor == 1234
+    
+    def test_currencies_do_not_mix(self):
+        with pytest.raises(ValueError, match="USD and EUR"):
+            Money(100, "USD") + Money(100, "EUR")
+        with pytest.raises(ValueError):
+            Money(100, "USD") < Money(100, "EUR")
+        assert Money(100, "USD") != Money(100, "EUR")
+    
+    def test_ordering(self):
+        assert Money(1, "USD") < Money(2, "USD") <= Money(2, "USD")
+        assert max(Money(3, "USD"), Money(7, "USD")) == Money(7, "USD")
+        assert len({Money(1, "USD"), Money(1, "USD")}) == 1
+    
+    def test_immutable(self):
+        money = Money(100, "USD")
+        with pytest.raises(AttributeError):
+            money.amount_minor = 200
+        with pytest.raises(AttributeError):
+            money._currency = "EUR"
+        assert money == Money(100, "USD")
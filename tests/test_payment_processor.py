@@ -0,0 +1,288 @@
+"""
+Tests for the PaymentProcessor service
+"""
+import asyncio
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.payment_processor import (
+    ChargeNotFound,
+    PaymentProcessor,
+    RefundExceedsCharge,
+)
+from src.utils.ids import IdGenerator
+
+
+async def make_charge(processor, order_id="order-1", customer_id="cust-1", amount=10.0):
+    return await processor.charge(
+        order_id=order_id,
+        amount=amount,
+        currency="USD",
+        customer_id=customer_id,
+        payment_method="card"
+    )
+
+
+class TestSecondaryIndexes:
+    """Tests for order, customer and refund lookups"""
+    
+    async def test_charges_by_order_only_returns_matches(self):
+        processor = PaymentProcessor()
+        first = await make_charge(processor, order_id="order-a")
+        await make_charge(processor, order_id="order-b")
+        second = await make_charge(processor, order_id="order-a")
+        
+        charges = await processor.get_charges_by_order("order-a")
+        assert [c.id for c in charges] == [first.id, second.id]
+        assert await processor.get_charges_by_order("missing") == []
+    
+    async def test_charges_by_customer_paginates(self):
+        processor = PaymentProcessor()
+        ids = [(await make_charge(processor, customer_id="cust-p")).id for _ in range(5)]
+        
+        page, cursor = await processor.list_charges_by_customer("cust-p", limit=2)
+        assert [c.id for c in page] == ids[:2]
+        
+        seen = [c.id for c in page]
+        while cursor is not None:
+            page, cursor = await processor.list_charges_by_customer(
+                "cust-p", limit=2, cursor=cursor
+            )
+            seen.extend(c.id for c in page)
+        assert seen == ids
+    
+    async def test_invalid_cursor(self):
+        processor = PaymentProcessor()
+        with pytest.raises(ValueError):
+            await processor.list_charges_by_order("order-1", cursor="abc")
+    
+    async def test_refunds_by_charge(self):
+        processor = PaymentProcessor()
+        charge = await make_charge(processor, amount=100.0)
+        other = await make_charge(processor)
+        first = await processor.refund(charge.id, amount=30.0)
+        second = await processor.refund(charge.id, amount=20.0)
+        await processor.refund(other.id)
+        
+        refunds = await processor.get_refunds_by_charge(charge.id)
+        assert [r.id for r in refunds] == [first.id, second.id]
+    
+    async def test_versions_change_on_charge_and_refund(self):
+        processor = PaymentProcessor()
+        assert processor.order_version("order-v") == 0
+        charge = await make_charge(processor, order_id="order-v")
+        assert processor.charge_version(charge.id) == 0
+        assert processor.order_version("order-v") == 1
+        
+        await processor.refund(charge.id, amount=1.0)
+        assert processor.charge_version(charge.id) == 1
+        assert processor.order_version("order-v") == 2
+        assert processor.charge_version("ch_missing") is None
+
+
+class TestChargeMany:
+    """Tests for bounded concurrent batch charging"""
+    
+    async def test_results_in_input_order(self):
+        processor = PaymentProcessor()
+        items = [
+            {
+                "order_id": f"order-{i}",
+                "amount": float(i + 1),
+                "currency": "USD",
+                "customer_id": "cust-batch",
+                "payment_method": "card",
+            }
+            for i in range(20)
+        ]
+        results = await processor.charge_many(items, concurrency=4)
+        assert [r.order_id for r in results] == [f"order-{i}" for i in range(20)]
+    
+    async def test_concurrency_is_bounded(self, monkeypatch):
+        processor = PaymentProcessor()
+        in_flight = 0
+        peak = 0
+        original = processor.charge
+        
+        async def tracking_charge(**kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0)
+            try:
+                return await original(**kwargs)
+            finally:
+                in_flight -= 1
+        
+        monkeypatch.setattr(processor, "charge", tracking_charge)
+        items = [
+            {
+                "order_id": "order-x",
+                "amount": 1.0,
+                "currency": "USD",
+                "customer_id": "cust-x",
+                "payment_method": "card",
+            }
+        ] * 10
+        await processor.charge_many(items, concurrency=3)
+        assert peak == 3
+    
+    async def test_errors_returned_per_item(self):
+        processor = PaymentProcessor()
+        results = await processor.charge_many([{"order_id": "missing-fields"}])
+        assert isinstance(results[0], TypeError)
+
+
+class TestChargeAmounts:
+    """Tests for amounts sent to the gateway and recorded"""
+    
+    async def test_gateway_gets_the_recorded_amount(self):
+        payloads = []
+        
+        class RecordingGateway:
+            async def charge(self, payload):
+                payloads.append(payload)
+        
+        processor = PaymentProcessor(gateway=RecordingGateway())
+        charge = await processor.charge("order-1", 19.99, "USD", "cust-1", "card")
+        yen = await processor.charge("order-2", 1500, "JPY", "cust-1", "card")
+        
+        assert [p["amount"] for p in payloads] == [19.99, 1500]
+        assert (charge.amount_minor, yen.amount_minor) == (1999, 1500)
+    
+    async def test_rejects_amounts_finer_than_the_currency(self):
+        processor = PaymentProcessor()
+        for amount, currency in ((99.99, "JPY"), (10.005, "USD")):
+            with pytest.raises(ValueError, match=f"than {currency} allows"):
+                await processor.charge("order-1", amount, currency, "cust-1", "card")
+        assert list(processor.iter_charges()) == []
+
+
+class TestIterRecords:
+    """Tests for streaming scans over charges and refunds"""
+    
+    async def test_filters_and_resume(self):
+        processor = PaymentProcessor()
+        for i in range(6):
+            await processor.charge(
+                order_id=f"order-{i}",
+                amount=10.0,
+                currency="EUR" if i % 2 else "USD",
+                customer_id="cust-1",
+                payment_method="card"
+            )
+        
+        rows = list(processor.iter_charges(currency="EUR"))
+        assert [c.order_id for _, c in rows] == ["order-1", "order-3", "order-5"]
+        
+        resumed = list(processor.iter_charges(currency="EUR", cursor=rows[0][0]))
+        assert [c.order_id for _, c in resumed] == ["order-3", "order-5"]
+    
+    async def test_time_range(self):
+        now = [1700000100.0]
+        processor = PaymentProcessor(ids=IdGenerator(1, clock=lambda: now[0]))
+        charges = []
+        for created_at in (1700000100.0, 1700000200.0, 1700000300.0):
+            now[0] = created_at
+            charges.append(await make_charge(processor))
+        assert [c.created_at for c in charges] == [1700000100.0, 1700000200.0, 1700000300.0]
+        
+        rows = list(processor.iter_charges(created_from=1700000150.0, created_to=1700000300.0))
+        assert [c.id for _, c in rows] == [charges[1].id]
+        rows = list(processor.iter_charges(created_from=1700000200.0))
+        assert [c.id for _, c in rows] == [charges[1].id, charges[2].id]
+    
+    async def test_walk_stops_before_pending_charge(self):
+        class SlowGateway:
+            async def charge(self, payload):
+                await asyncio.sleep(0.01)
+        
+        processor = PaymentProcessor()
+        first = await make_charge(processor)
+        processor._gateway = SlowGateway()
+        slow = asyncio.ensure_future(make_charge(processor))
+        await asyncio.sleep(0)
+        processor._gateway = None
+        await make_charge(processor)
+        
+        # The charge recorded after the slow one started is held back
+        # until the slow one lands in front of it
+        assert [c.id for _, c in processor.iter_charges()] == [first.id]
+        resumed = list(processor.iter_charges(cursor=first.id))
+        assert resumed == []
+        slow_charge = await slow
+        resumed = list(processor.iter_charges(cursor=first.id))
+        assert [c.id for _, c in resumed][0] == slow_charge.id
+        assert len(resumed) == 2
+    
+    async def test_refunds_by_customer(self):
+        processor = PaymentProcessor()
+        mine = await make_charge(processor, customer_id="cust-a")
+        theirs = await make_charge(processor, customer_id="cust-b")
+        refund = await processor.refund(mine.id)
+        await processor.refund(theirs.id)
+        
+        rows = list(processor.iter_refunds(customer_id="cust-a"))
+        assert [r.id for _, r in rows] == [refund.id]
+    
+    def test_invalid_cursor_raises_immediately(self):
+        processor = PaymentProcessor()
+        with pytest.raises(ValueError):
+            processor.iter_charges(cursor="nope")
+
+
+class TestRefundLedger:
+    """Tests for cumulative refund checks"""
+    
+    async def test_partial_refunds_up_to_charge_amount(self):
+        processor = PaymentProcessor()
+        charge = await make_charge(processor, amount=100.0)
+        await processor.refund(charge.id, amount=60.0)
+        await processor.refund(charge.id, amount=40.0)
+        
+        assert await processor.get_refund_balance(charge.id) == (10000, 0)
+        with pytest.raises(RefundExceedsCharge):
+            await processor.refund(charge.id, amount=0.01)
+    
+    async def test_default_refunds_remaining_balance(self):
+        processor = PaymentProcessor()
+        charge = await make_charge(processor, amount=100.0)
+        await processor.refund(charge.id, amount=30.0)
+        refund = await processor.refund(charge.id)
+        
+        assert refund.amount_minor == 7000
+        with pytest.raises(RefundExceedsCharge):
+            await processor.refund(charge.id)
+    
+    async def test_rejects_non_positive_and_unknown(self):
+        processor = PaymentProcessor()
+        charge = await make_charge(processor)
+        with pytest.raises(ValueError):
+            await processor.refund(charge.id, amount=-5.0)
+        with pytest.raises(ValueError, match="decimal places"):
+            await processor.refund(charge.id, amount=1.005)
+        with pytest.raises(ChargeNotFound):
+            await processor.refund("ch_missing")
+    
+    async def test_concurrent_refunds_never_exceed_charge(self):
+        class SlowStorage:
+            async def save_refund(self, refund):
+                await asyncio.sleep(0.001)
+        
+        processor = PaymentProcessor()
+        charge = await make_charge(processor, amount=100.0)
+        processor._storage = SlowStorage()
+        
+        results = await asyncio.gather(
+            *(processor.refund(charge.id, amount=10.0) for _ in range(50)),
+            return_exceptions=True
+        )
+        succeeded = [r for r in results if not isinstance(r, Exception)]
+        rejected = [r for r in results if isinstance(r, RefundExceedsCharge)]
+        
+        assert len(succeeded) == 10
+        assert len(rejected) == 40
+        assert await processor.get_refund_balance(charge.id) == (10000, 0)
+        assert processor._refund_locks == {}
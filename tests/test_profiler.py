@@ -0,0 +1,160 @@
+"""
+Tests for the sampling profiler, the slow-request log and the debug endpoints
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.main import app
+from src.middleware.slow_requests import SlowRequestMiddleware
+from src.routes import debug, payments
+from src.services.auth import TokenVerifier
+from src.services.profiler import ProfilerBusy, SamplingProfiler, profile_event_loop
+from src.utils.request_timing import RequestTimer, current_timer, lap
+
+VERIFIER = TokenVerifier("profiler-secret")
+AUTH_HEADERS = {"Authorization": "Bearer " + VERIFIER.sign({"sub": "operator"})}
+
+
+def spin(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+@pytest.fixture
+def auth(monkeypatch):
+    monkeypatch.setattr(payments, "token_verifier", VERIFIER)
+
+
+class TestSamplingProfiler:
+    """Tests for stack sampling and collapsed output"""
+    
+    def test_samples_running_function(self):
+        profiler = SamplingProfiler(threading.get_ident(), interval=0.001)
+        profiler.start()
+        spin(0.2)
+        profiler.stop()
+        
+        assert profiler.samples > 10
+        lines = profiler.collapsed().splitlines()
+        stack, count = lines[0].rsplit(" ", 1)
+        assert int(count) > 0
+        assert stack.split(";")[-1] == "test_profiler.py:spin"
+        assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == profiler.samples
+    
+    def test_empty_profile(self):
+        profiler = SamplingProfiler(-1)
+        profiler._sample()
+        assert profiler.samples == 0
+        assert profiler.collapsed() == ""
+    
+    async def test_one_profile_at_a_time(self):
+        first = asyncio.ensure_future(profile_event_loop(0.05))
+        await asyncio.sleep(0)
+        with pytest.raises(ProfilerBusy):
+            await profile_event_loop(0.05)
+        assert (await first).samples > 0
+        # Free again once the first profile is done
+        await profile_event_loop(0.01)
+
+
+class TestRequestTimer:
+    """Tests for phase laps"""
+    
+    def test_laps_accumulate_per_phase(self):
+        timer = RequestTimer()
+        token = current_timer.set(timer)
+        try:
+            spin(0.01)
+            lap("validation")
+            spin(0.02)
+            lap("processor")
+            spin(0.01)
+            lap("processor")
+        finally:
+            current_timer.reset(token)
+        assert set(timer.phases) == {"validation", "processor"}
+        assert timer.phases["processor"] >= 0.03
+        assert sum(timer.phases.values()) <= timer.elapsed()
+    
+    def test_lap_outside_request_is_noop(self):
+        lap("validation")
+
+
+class TestSlowRequestLog:
+    """Tests for the slow-request middleware"""
+    
+    def make_client(self, threshold, recent):
+        test_app = FastAPI()
+        test_app.add_middleware(SlowRequestMiddleware, threshold=threshold, recent=recent)
+        test_app.include_router(payments.router, prefix="/api/payments")
+        return TestClient(test_app)
+    
+    def test_records_phases_of_slow_requests(self, auth):
+        recent = deque(maxlen=10)
+        client = self.make_client(0, recent)
+        response = client.post("/api/payments/charge", headers=AUTH_HEADERS, json={
+            "order_id": "order-slow",
+            "amount": 10.00,
+            "currency": "USD",
+            "customer_id": "cust-slow",
+            "payment_method": "card"
+        })
+        assert response.status_code == 200
+        
+        entry = recent[-1]
+        assert entry["method"] == "POST"
+        assert entry["path"] == "/api/payments/charge"
+        assert entry["status"] == 200
+        assert set(entry["phases_ms"]) == {"admission", "validation", "processor", "serialization"}
+        assert sum(entry["phases_ms"].values()) <= entry["duration_ms"] + 0.01
+    
+    def test_fast_requests_are_not_recorded(self, auth):
+        recent = deque(maxlen=10)
+        client = self.make_client(60, recent)
+        assert client.get("/api/payments/charges/ch_missing", headers=AUTH_HEADERS).status_code == 404
+        assert len(recent) == 0
+
+
+class TestDebugEndpoints:
+    """Tests for /debug/profile and /debug/slow-requests"""
+    
+    client = TestClient(app)
+    
+    def test_requires_token(self, auth):
+        assert self.client.get("/debug/profile").status_code == 401
+        assert self.client.get("/debug/slow-requests").status_code == 401
+    
+    def test_profiling_is_opt_in(self, auth):
+        response = self.client.get("/debug/profile?seconds=0.01", headers=AUTH_HEADERS)
+        assert response.status_code == 404
+    
+    def test_profile_returns_collapsed_stacks(self, auth, monkeypatch):
+        monkeypatch.setattr(debug, "PROFILING_ENABLED", True)
+        response = self.client.get("/debug/profile?seconds=0.05&hz=500", headers=AUTH_HEADERS)
+        assert response.status_code == 200
+        assert response.headers["content-disposition"].endswith('.folded"')
+        assert int(response.headers["x-profile-samples"]) > 0
+        for line in response.text.splitlines():
+            stack, count = line.rsplit(" ", 1)
+            assert stack and int(count) > 0
+    
+    def test_profile_duration_is_capped(self, auth, monkeypatch):
+        monkeypatch.setattr(debug, "PROFILING_ENABLED", True)
+        response = self.client.get("/debug/profile?seconds=3600", headers=AUTH_HEADERS)
+        assert response.status_code == 422
+    
+    def test_slow_requests(self, auth):
+        response = self.client.get("/debug/slow-requests", headers=AUTH_HEADERS)
+        assert response.status_code == 200
+        assert isinstance(response.json()["requests"], list)
@@ -0,0 +1,78 @@
+"""
+Tests for the GCRA rate limiter
+"""
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.rate_limit import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter:
+    """Tests for RateLimiter"""
+    
+    def test_burst_then_reject_with_retry_after(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rate=2, burst=3, clock=clock)
+        assert [limiter.acquire("k") for _ in range(3)] == [0.0, 0.0, 0.0]
+        assert limiter.acquire("k") == pytest.approx(0.5)
+    
+    def test_refills_lazily_at_rate(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rate=2, burst=1, clock=clock)
+        assert limiter.acquire("k") == 0.0
+        assert limiter.acquire("k") > 0
+        clock.now += 0.5
+        assert limiter.acquire("k") == 0.0
+    
+    def test_rejections_do_not_use_quota(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rate=1, burst=1, clock=clock)
+        limiter.acquire("k")
+        for _ in range(10):
+            assert limiter.acquire("k") > 0
+        clock.now += 1.0
+        assert limiter.acquire("k") == 0.0
+    
+    def test_keys_are_independent(self):
+        limiter = RateLimiter(rate=1, burst=1, clock=FakeClock())
+        assert limiter.acquire("a") == 0.0
+        assert limiter.acquire("a") > 0
+        assert limiter.acquire("b") == 0.0
+    
+    def test_cost_takes_all_or_nothing(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rate=2, burst=3, clock=clock)
+        assert limiter.check("k", 3) == 0.0
+        assert limiter.acquire("k", 2) == 0.0
+        assert limiter.check("k", 2) == pytest.approx(0.5)
+        assert limiter.acquire("k", 2) == pytest.approx(0.5)
+        assert limiter.acquire("k") == 0.0
+        assert limiter.acquire("new", 4) > 0
+        assert limiter.acquire("new", 3) == 0.0
+    
+    def test_memory_bounded_by_lru_eviction(self):
+        limiter = RateLimiter(rate=1, burst=1, max_keys=64, shards=4, clock=FakeClock())
+        for i in range(10000):
+            limiter.acquire(f"cust-{i}")
+        assert len(limiter) <= 64
+    
+    def test_active_key_survives_eviction(self):
+        limiter = RateLimiter(rate=1, burst=1, max_keys=4, shards=1, clock=FakeClock())
+        limiter.acquire("hot")
+        for i in range(10):
+            limiter.acquire(f"cold-{i}")
+            assert limiter.acquire("hot") > 0
+    
+    def test_rejects_bad_config(self):
+        with pytest.raises(ValueError):
+            RateLimiter(rate=0, burst=1)
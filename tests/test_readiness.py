@@ -0,0 +1,111 @@
+"""
+Tests for background readiness probes
+"""
+import asyncio
+import pytest
+import sys
+import os
+from fastapi.testclient import TestClient
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.main import app
+from src.routes import health
+from src.services.readiness import ReadinessMonitor
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+    
+    def __call__(self):
+        return self.now
+
+
+async def ok():
+    pass
+
+
+async def broken():
+    raise ConnectionError("connection refused")
+
+
+async def hangs():
+    await asyncio.sleep(10)
+
+
+class TestReadinessMonitor:
+    """Tests for ReadinessMonitor"""
+    
+    async def test_pending_until_first_probe(self):
+        monitor = ReadinessMonitor({"database": ok})
+        snapshot = monitor.snapshot()
+        assert snapshot["ready"] is False
+        assert snapshot["checks"]["database"]["status"] == "pending"
+        
+        await monitor.refresh()
+        assert monitor.snapshot()["ready"] is True
+    
+    async def test_failing_and_timed_out_probes(self):
+        monitor = ReadinessMonitor(
+            {"database": ok, "payment_gateway": broken, "cache": hangs}, timeout=0.01
+        )
+        await monitor.refresh()
+        checks = monitor.snapshot()["checks"]
+        assert checks["database"]["status"] == "ok"
+        assert checks["payment_gateway"]["status"] == "failing"
+        assert checks["payment_gateway"]["error"] == "connection refused"
+        assert "timed out" in checks["cache"]["error"]
+        assert monitor.snapshot()["ready"] is False
+    
+    async def test_stale_results_are_not_ready(self):
+        clock = FakeClock()
+        monitor = ReadinessMonitor({"database": ok}, max_staleness=15.0, clock=clock)
+        await monitor.refresh()
+        clock.now += 16.0
+        snapshot = monitor.snapshot()
+        assert snapshot["checks"]["database"]["status"] == "stale"
+        assert snapshot["ready"] is False
+    
+    async def test_snapshot_never_probes(self):
+        calls = 0
+        
+        async def counted():
+            nonlocal calls
+            calls += 1
+        
+        monitor = ReadinessMonitor({"database": counted})
+        await monitor.refresh()
+        for _ in range(1000):
+            monitor.snapshot()
+        assert calls == 1
+    
+    async def test_background_task_refreshes(self):
+        calls = 0
+        
+        async def counted():
+            nonlocal calls
+            calls += 1
+        
+        monitor = ReadinessMonitor({"database": counted}, interval=0.01)
+        monitor.start()
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+        assert calls >= 2
+
+
+class TestReadyEndpoint:
+    """Tests for GET /ready"""
+    
+    def test_ready_after_startup(self):
+        with TestClient(app) as client:
+            for _ in range(100):
+                response = client.get("/ready")
+                if response.status_code == 200:
+                    break
+            assert response.status_code == 200
+            assert response.json()["ready"] is True
+    
+    def test_not_ready_without_monitor(self):
+        health.readiness_monitor = None
+        response = TestClient(app).get("/ready")
+        assert response.status_code == 503
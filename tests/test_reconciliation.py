@@ -0,0 +1,168 @@
+"""
+Tests for settlement reconciliation
+"""
+import io
+import pytest
+from decimal import DecimalException
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.payment_processor import PaymentProcessor
+from src.services.reconciliation import (
+    AMOUNT_MISMATCH, DUPLICATE, EXTRA, INVALID, MISSING,
+    Ledger, _load_ledger, build_ledger, parse_minor, read_chunks, reconcile
+)
+from src.services.storage import SQLiteStorage
+from src.services.wal import WALStorage
+
+
+async def make_processor():
+    processor = PaymentProcessor()
+    charges = [await processor.charge(f"order-{i}", 10.0 + i, "USD", "cust-1", "card") for i in range(20)]
+    yen = await processor.charge("order-yen", 1500, "JPY", "cust-1", "card")
+    refund = await processor.refund(charges[0].id, amount=2.5)
+    return processor, charges, yen, refund
+
+
+def settlement_file(rows, header="reference,amount,currency,fee"):
+    return io.BytesIO(("\n".join([header] + rows) + "\n").encode())
+
+
+def run(f, ledger, **kwargs):
+    found = []
+    counts = reconcile(f, ledger, found.append, **kwargs)
+    return counts, found
+
+
+class TestParsing:
+    """Tests for chunking and amount parsing"""
+    
+    def test_chunks_end_on_line_breaks(self):
+        data = b"".join(f"row-{i},{i}\n".encode() for i in range(1000))
+        chunks = list(read_chunks(io.BytesIO(data), 100))
+        assert b"".join(chunks) == data
+        assert all(chunk.endswith(b"\n") for chunk in chunks)
+        assert len(chunks) > 10
+    
+    def test_chunks_keep_quoted_line_breaks(self):
+        data = b"".join(f'row-{i},"line one\nline ""two""\n",{i}\n'.encode() for i in range(200))
+        chunks = list(read_chunks(io.BytesIO(data), 100))
+        assert b"".join(chunks) == data
+        assert all(chunk.count(b'"') % 2 == 0 for chunk in chunks)
+        assert len(chunks) > 10
+    
+    def test_parse_minor(self):
+        assert parse_minor("10.50", "USD") == 1050
+        assert parse_minor("-2.50", "USD") == 250
+        assert parse_minor(" 1500 ", "JPY") == 1500
+        assert parse_minor("1.005", "USD") == 101
+    
+    @pytest.mark.parametrize("amount", ["abc", "NaN", "-Infinity", "\u00b2", "1.\u00b2", "1e999999999"])
+    def test_parse_minor_rejects_non_numbers(self, amount):
+        with pytest.raises((DecimalException, ValueError)):
+            parse_minor(amount, "USD")
+
+
+class TestReconcile:
+    """Tests for matching a settlement file against our records"""
+    
+    @pytest.mark.parametrize("workers", [0, 2])
+    async def test_reports_each_discrepancy(self, workers):
+        processor, charges, yen, refund = await make_processor()
+        ledger = await build_ledger(processor)
+        assert len(ledger) == 22
+        
+        rows = [f"{charge.id},{charge.amount:.2f},USD,0.30" for charge in charges[2:]]
+        rows += [
+            f"{charges[1].id},11.01,USD,0.30",    # amount differs
+            f"{charges[2].id},12.00,USD,0.30",    # settled twice
+            f"{yen.id},1500,JPY,0",
+            f"{refund.id},-2.50,USD,0",
+            "ch_notours,5.00,USD,0.30",
+            f"{charges[3].id},abc,USD,0.30",
+            f"{charges[4].id},NaN,USD,0.30",
+            f"{charges[5].id},\u00b2,USD,0.30",
+        ]
+        counts, found = run(settlement_file(rows), ledger, workers=workers, chunk_bytes=64)
+        
+        assert counts == {
+            "rows": 26, "matched": 20, MISSING: 1, EXTRA: 1,
+            AMOUNT_MISMATCH: 1, DUPLICATE: 1, INVALID: 3,
+        }
+        by_kind = {kind: (record_id, expected, settled) for kind, record_id, _, expected, settled in found}
+        assert by_kind[MISSING] == (charges[0].id, 1000, None)
+        assert by_kind[EXTRA] == ("ch_notours", None, 500)
+        assert by_kind[AMOUNT_MISMATCH] == (charges[1].id, 1100, 1101)
+        assert by_kind[DUPLICATE][0] == charges[2].id
+        assert found[-1][0] == MISSING
+    
+    @pytest.mark.parametrize("workers", [0, 2])
+    async def test_descriptions_may_span_lines(self, workers):
+        processor, charges, _, _ = await make_processor()
+        ledger = await build_ledger(processor)
+        rows = [f'{charge.id},{charge.amount:.2f},USD,"Order {charge.order_id}\nthanks, ""Acme"""'
+                for charge in charges]
+        counts, found = run(
+            settlement_file(rows, "reference,amount,currency,description"),
+            ledger, workers=workers, chunk_bytes=64
+        )
+        assert counts["rows"] == 20
+        assert counts["matched"] == 20
+        assert counts[INVALID] == 0
+        assert [kind for kind, *_ in found] == [MISSING, MISSING]
+    
+    async def test_currency_mismatch(self):
+        processor, charges, _, _ = await make_processor()
+        ledger = await build_ledger(processor)
+        rows = [f"{charges[0].id},10.00,EUR"]
+        counts, found = run(settlement_file(rows, "reference,amount,currency"), ledger, workers=0)
+        assert counts[AMOUNT_MISMATCH] == 1
+        assert found[0] == (AMOUNT_MISMATCH, charges[0].id, "EUR", 1000, 1000)
+    
+    async def test_ledger_covers_period(self):
+        processor, charges, _, _ = await make_processor()
+        ledger = await build_ledger(processor, created_to=0)
+        assert len(ledger) == 0
+        ledger = await build_ledger(processor, created_from=charges[0].created_at)
+        assert len(ledger) == 22
+    
+    def test_header_needs_required_columns(self):
+        with pytest.raises(ValueError, match="currency"):
+            run(settlement_file([], "reference,amount"), Ledger(), workers=0)
+
+
+class TestLoadLedger:
+    """Tests for reading the ledger next to a live service"""
+    
+    async def test_reads_live_log_without_touching_it(self, tmp_path, monkeypatch):
+        storage = WALStorage(str(tmp_path))
+        processor = PaymentProcessor(storage=storage)
+        charges = [await processor.charge(f"order-{i}", 10.0, "USD", "cust-1", "card") for i in range(5)]
+        # A half-written frame and an unfinished compaction, as the live service may have
+        with open(storage._segment_path(storage._segment_seq), "ab") as f:
+            f.write(b"\x00\x00\x01")
+        (tmp_path / "snapshot-00000009.bin.tmp").write_bytes(b"partial")
+        before = {p.name: p.stat().st_size for p in tmp_path.iterdir()}
+        
+        monkeypatch.setenv("PAYMENTS_WAL_DIR", str(tmp_path))
+        ledger = _load_ledger(None, None)
+        assert ledger.ids == [charge.id for charge in charges]
+        assert {p.name: p.stat().st_size for p in tmp_path.iterdir()} == before
+        await processor.close()
+    
+    async def test_reads_database(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "payments.db")
+        processor = PaymentProcessor(storage=SQLiteStorage(path))
+        charge = await processor.charge("order-1", 10.0, "USD", "cust-1", "card")
+        await processor.close()
+        
+        monkeypatch.delenv("PAYMENTS_WAL_DIR", raising=False)
+        monkeypatch.setenv("PAYMENTS_DB_PATH", path)
+        assert _load_ledger(None, None).ids == [charge.id]
+    
+    def test_needs_durable_storage(self, monkeypatch):
+        monkeypatch.delenv("PAYMENTS_WAL_DIR", raising=False)
+        monkeypatch.delenv("PAYMENTS_DB_PATH", raising=False)
+        with pytest.raises(ValueError, match="No durable storage"):
+            _load_ledger(None, None)
@@ -0,0 +1,69 @@
+"""
+Tests for compact charge and refund records
+"""
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.records import ChargeRecord, RefundRecord
+
+
+def make_charge(**overrides) -> ChargeRecord:
+    fields = dict(
+        id="ch_1",
+        order_id="order-1",
+        amount_minor=9999,
+        currency="USD",
+        customer_id="cust-1",
+        payment_method="card",
+        status="succeeded",
+        created_at=1704067200.5,
+    )
+    fields.update(overrides)
+    return ChargeRecord(**fields)
+
+
+class TestChargeRecord:
+    """Tests for ChargeRecord"""
+    
+    def test_to_dict_matches_api_shape(self):
+        assert make_charge().to_dict() == {
+            "id": "ch_1",
+            "order_id": "order-1",
+            "amount": 99.99,
+            "currency": "USD",
+            "customer_id": "cust-1",
+            "payment_method": "card",
+            "status": "succeeded",
+            "created_at": "2024-01-01T00:00:00.500000",
+        }
+    
+    def test_no_instance_dict(self):
+        with pytest.raises(AttributeError):
+            make_charge().__dict__
+    
+    def test_low_cardinality_fields_are_interned(self):
+        first = make_charge(currency="".join("EUR"))
+        second = make_charge(currency="".join("EUR"))
+        assert first.currency is second.currency
+    
+    def test_equality(self):
+        assert make_charge() == make_charge()
+        assert make_charge() != make_charge(amount_minor=1)
+
+
+class TestRefundRecord:
+    """Tests for RefundRecord"""
+    
+    def test_to_dict_uses_currency_exponent(self):
+        refund = RefundRecord(
+            id="re_1",
+            charge_id="ch_1",
+            amount_minor=500,
+            currency="JPY",
+            reason=None,
+            status="succeeded",
+            created_at=1704067200.0,
+        )
+        assert refund.to_dict()["amount"] == 500.0
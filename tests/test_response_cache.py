@@ -0,0 +1,57 @@
+"""
+Tests for the pre-serialized response cache
+"""
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.response_cache import ResponseCache, encode_json, etag_matches, make_etag
+
+
+class TestResponseCache:
+    """Tests for version-tagged bodies"""
+    
+    def test_hit_only_at_same_version(self):
+        cache = ResponseCache()
+        cache.put("/charges/ch_1?", 0, b'{"id":"ch_1"}')
+        assert cache.get("/charges/ch_1?", 0) == b'{"id":"ch_1"}'
+        assert cache.get("/charges/ch_1?", 1) is None
+        assert (cache.hits, cache.misses) == (1, 1)
+    
+    def test_newer_version_replaces_entry(self):
+        cache = ResponseCache()
+        cache.put("/orders/o?", 1, b"old")
+        cache.put("/orders/o?", 2, b"new")
+        assert cache.get("/orders/o?", 2) == b"new"
+        assert len(cache) == 1
+    
+    def test_bounded(self):
+        cache = ResponseCache(max_entries=2)
+        for i in range(5):
+            cache.put(f"/charges/ch_{i}?", 0, b"{}")
+        assert len(cache) == 2
+        assert cache.get("/charges/ch_4?", 0) == b"{}"
+        assert cache.get("/charges/ch_0?", 0) is None
+    
+    def test_disabled(self):
+        cache = ResponseCache(max_entries=0)
+        cache.put("/charges/ch_1?", 0, b"{}")
+        assert len(cache) == 0
+    
+    def test_encoding_matches_json_response(self):
+        from fastapi.responses import JSONResponse
+        content = {"amount": 1.5, "name": "café", "items": [1, None]}
+        assert encode_json(content) == JSONResponse(content).body
+
+
+class TestEtagMatching:
+    """Tests for If-None-Match parsing"""
+    
+    @pytest.mark.parametrize("header", ['"v3"', 'W/"v3"', '"v1", "v3"', "*"])
+    def test_matches(self, header):
+        assert etag_matches(header, make_etag(3))
+    
+    @pytest.mark.parametrize("header", [None, "", '"v2"', '"v33"'])
+    def test_does_not_match(self, header):
+        assert not etag_matches(header, make_etag(3))
@@ -0,0 +1,99 @@
+"""
+Tests for running settlement aggregates
+"""
+import pytest
+import sys
+import os
+from datetime import date
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.payment_processor import PaymentProcessor
+from src.services.records import ChargeRecord, RefundRecord
+from src.services.settlement import SettlementAggregates, summarize
+from src.utils.ids import IdGenerator
+
+DAY_ONE = 1700006400.0  # 2023-11-15T00:00:00Z
+DAY_TWO = DAY_ONE + 86400
+
+
+def charge(id, amount_minor, currency="USD", method="card", created_at=DAY_ONE):
+    return ChargeRecord(id, "order", amount_minor, currency, "cust", method, "succeeded", created_at)
+
+
+class TestSettlementAggregates:
+    """Tests for SettlementAggregates"""
+    
+    def test_buckets_by_currency_day_and_method(self):
+        aggregates = SettlementAggregates()
+        aggregates.add_charge(charge("ch_1", 1000))
+        aggregates.add_charge(charge("ch_2", 500))
+        aggregates.add_charge(charge("ch_3", 700, method="paypal"))
+        aggregates.add_charge(charge("ch_4", 300, currency="JPY", created_at=DAY_TWO))
+        aggregates.add_refund(
+            RefundRecord("re_1", "ch_1", 200, "USD", None, "succeeded", DAY_TWO), "card"
+        )
+        
+        rows = aggregates.report()
+        assert [(r["date"], r["currency"], r["payment_method"]) for r in rows] == [
+            ("2023-11-15", "USD", "card"),
+            ("2023-11-15", "USD", "paypal"),
+            ("2023-11-16", "JPY", "card"),
+            ("2023-11-16", "USD", "card"),
+        ]
+        assert rows[0]["charge_count"] == 2
+        assert rows[0]["gross_minor"] == 1500
+        assert rows[3]["refund_count"] == 1
+        assert rows[3]["net_minor"] == -200
+    
+    def test_report_filters(self):
+        aggregates = SettlementAggregates()
+        aggregates.add_charge(charge("ch_1", 1000))
+        aggregates.add_charge(charge("ch_2", 300, currency="EUR", created_at=DAY_TWO))
+        
+        assert [r["currency"] for r in aggregates.report(currency="EUR")] == ["EUR"]
+        assert [r["date"] for r in aggregates.report(date_from=date(2023, 11, 16))] == ["2023-11-16"]
+        assert [r["date"] for r in aggregates.report(date_to=date(2023, 11, 15))] == ["2023-11-15"]
+    
+    def test_summarize_totals_per_currency(self):
+        aggregates = SettlementAggregates()
+        aggregates.add_charge(charge("ch_1", 1000))
+        aggregates.add_charge(charge("ch_2", 500, created_at=DAY_TWO))
+        aggregates.add_refund(
+            RefundRecord("re_1", "ch_1", 250, "USD", None, "succeeded", DAY_TWO), "card"
+        )
+        
+        summary = summarize(aggregates.report())
+        assert summary["buckets"][0]["gross"] == 10.0
+        assert summary["totals"]["USD"] == {
+            "charge_count": 2, "refund_count": 1,
+            "gross": 15.0, "refunded": 2.5, "net": 12.5,
+        }
+    
+    def test_summarize_formats_for_locale(self):
+        aggregates = SettlementAggregates()
+        aggregates.add_charge(charge("ch_1", 123456))
+        aggregates.add_charge(charge("ch_2", 1500, currency="JPY"))
+        
+        summary = summarize(aggregates.report(), locale="en-US")
+        assert [b["display"]["gross"] for b in summary["buckets"]] == ["¥1,500", "$1,234.56"]
+        assert summary["totals"]["USD"]["display"] == {
+            "gross": "$1,234.56", "refunded": "$0.00", "net": "$1,234.56",
+        }
+        assert "display" not in summarize(aggregates.report())["buckets"][0]
+
+
+class TestProcessorSettlement:
+    """Tests for aggregates maintained by PaymentProcessor"""
+    
+    async def test_charge_and_refund_update_totals(self):
+        processor = PaymentProcessor(ids=IdGenerator(1, clock=lambda: DAY_ONE + 60))
+        first = await processor.charge("order-1", 100.0, "USD", "cust-1", "card")
+        await processor.charge("order-2", 50.0, "USD", "cust-1", "card")
+        await processor.refund(first.id, amount=30.0)
+        
+        rows = await processor.settlement_report()
+        assert len(rows) == 1
+        assert rows[0]["charge_count"] == 2
+        assert rows[0]["gross_minor"] == 15000
+        assert rows[0]["refunded_minor"] == 3000
+        assert rows[0]["net_minor"] == 12000
@@ -0,0 +1,235 @@
+"""
+Tests for the shared multi-worker store
+"""
+import asyncio
+import pytest
+import threading
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.payment_processor import (
+    ChargeNotFound,
+    PaymentProcessor,
+    RefundExceedsCharge,
+)
+from src.services.gateway import GatewayError
+from src.services.shared_store import SharedStorage, StoreServer, StoreState
+from src.services.wal import WALStorage
+
+
+def start_server(path, storage=None) -> StoreServer:
+    server = StoreServer(path, shards=4, storage=storage)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    return server
+
+
+def stop_server(server):
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    path = str(tmp_path / "store.sock")
+    server = start_server(path)
+    yield path
+    stop_server(server)
+
+
+@pytest.fixture
+async def workers(store_path):
+    """Two processors sharing one store, as two uvicorn workers would."""
+    first = PaymentProcessor(storage=SharedStorage(store_path, pool_size=2))
+    second = PaymentProcessor(storage=SharedStorage(store_path, pool_size=2))
+    yield first, second
+    await first.close()
+    await second.close()
+
+
+async def make_charge(processor, order_id="order-1", customer_id="cust-1", amount=10.0, currency="USD"):
+    return await processor.charge(
+        order_id=order_id,
+        amount=amount,
+        currency=currency,
+        customer_id=customer_id,
+        payment_method="card"
+    )
+
+
+class TestSharedWorkers:
+    """Tests for reads and writes across workers"""
+    
+    async def test_charge_visible_on_other_worker(self, workers):
+        first, second = workers
+        charge = await make_charge(first)
+        
+        assert await second.get_charge(charge.id) == charge
+        assert await second.get_charges_by_order("order-1") == [charge]
+        assert await second.get_charge("ch_missing") is None
+    
+    async def test_index_pagination(self, workers):
+        first, second = workers
+        ids = [(await make_charge(worker, customer_id="cust-p")).id
+               for worker in (first, second, first)]
+        
+        page, cursor = await second.list_charges_by_customer("cust-p", limit=2)
+        assert [c.id for c in page] == ids[:2]
+        page, cursor = await first.list_charges_by_customer("cust-p", limit=2, cursor=cursor)
+        assert [c.id for c in page] == ids[2:]
+        assert cursor is None
+        with pytest.raises(ValueError):
+            await first.list_charges_by_customer("cust-p", cursor="nope")
+    
+    async def test_refund_ledger_shared(self, workers):
+        first, second = workers
+        charge = await make_charge(first, amount=100.0)
+        await first.refund(charge.id, amount=60.0)
+        refund = await second.refund(charge.id)
+        
+        assert refund.amount_minor == 4000
+        assert await first.get_refund_balance(charge.id) == (10000, 0)
+        assert [r.amount_minor for r in await second.get_refunds_by_charge(charge.id)] == [6000, 4000]
+        with pytest.raises(RefundExceedsCharge):
+            await first.refund(charge.id, amount=0.01)
+        with pytest.raises(ChargeNotFound):
+            await second.refund("ch_missing")
+        with pytest.raises(ChargeNotFound):
+            await second.get_refund_balance("ch_missing")
+    
+    async def test_concurrent_refunds_across_workers_never_exceed_charge(self, workers):
+        first, second = workers
+        charge = await make_charge(first, amount=100.0)
+        
+        results = await asyncio.gather(
+            *(worker.refund(charge.id, amount=10.0) for worker in (first, second) * 25),
+            return_exceptions=True
+        )
+        assert sum(1 for r in results if not isinstance(r, Exception)) == 10
+        assert sum(1 for r in results if isinstance(r, RefundExceedsCharge)) == 40
+        assert await second.get_refund_balance(charge.id) == (10000, 0)
+    
+    async def test_failed_refund_releases_reservation(self, workers):
+        class FailingGateway:
+            async def refund(self, payload):
+                raise GatewayError("declined", 402)
+            
+            async def close(self):
+                pass
+        
+        first, _ = workers
+        charge = await make_charge(first, amount=100.0)
+        first._gateway = FailingGateway()
+        with pytest.raises(GatewayError):
+            await first.refund(charge.id, amount=25.0)
+        assert await first.get_refund_balance(charge.id) == (0, 10000)
+    
+    async def test_settlement_report_covers_all_workers(self, workers):
+        first, second = workers
+        charge = await make_charge(first, amount=100.0)
+        await make_charge(second, amount=50.0)
+        await second.refund(charge.id, amount=25.0)
+        
+        rows = await first.settlement_report(currency="USD")
+        assert sum(r["gross_minor"] for r in rows) == 15000
+        assert sum(r["refunded_minor"] for r in rows) == 2500
+        assert sum(r["charge_count"] for r in rows) == 2
+    
+    async def test_workers_claim_distinct_worker_ids(self, workers):
+        first, second = workers
+        await first.load()
+        await second.load()
+        assert first._ids.worker_id != second._ids.worker_id
+    
+    async def test_stream_records_filters_and_resumes(self, workers):
+        first, second = workers
+        for i in range(6):
+            await make_charge((first, second)[i % 2], order_id=f"order-{i}",
+                              currency="EUR" if i % 2 else "USD")
+        
+        rows = [row async for row in first.stream_records("charges", currency="EUR")]
+        assert [c.order_id for _, c in rows] == ["order-1", "order-3", "order-5"]
+        resumed = [row async for row in second.stream_records(
+            "charges", cursor=rows[0][0], currency="EUR"
+        )]
+        assert [c.order_id for _, c in resumed] == ["order-3", "order-5"]
+        with pytest.raises(ValueError):
+            first.stream_records("charges", cursor="nope")
+
+
+class TestSharedStorage:
+    """Tests for the worker-side client"""
+    
+    def test_built_before_the_event_loop(self, store_path):
+        # As at import time: no loop is running yet
+        storage = SharedStorage(store_path, pool_size=1)
+        
+        async def run():
+            processor = PaymentProcessor(storage=storage)
+            charges = await asyncio.gather(*(
+                make_charge(processor, order_id=f"order-{i}") for i in range(5)
+            ))
+            await processor.close()
+            return charges
+        
+        assert len(asyncio.run(run())) == 5
+
+
+class TestDurableStore:
+    """Tests for a store server writing through to durable storage"""
+    
+    async def test_restarted_server_keeps_charges_and_ledger(self, tmp_path):
+        path = str(tmp_path / "store.sock")
+        directory = str(tmp_path / "wal")
+        server = start_server(path, WALStorage(directory))
+        worker = PaymentProcessor(storage=SharedStorage(path))
+        charge = await make_charge(worker, amount=100.0)
+        await worker.refund(charge.id, amount=60.0)
+        await worker.close()
+        stop_server(server)
+        
+        server = start_server(path, WALStorage(directory))
+        worker = PaymentProcessor(storage=SharedStorage(path))
+        try:
+            assert await worker.get_charge(charge.id) == charge
+            assert await worker.get_refund_balance(charge.id) == (6000, 4000)
+            with pytest.raises(RefundExceedsCharge):
+                await worker.refund(charge.id, amount=50.0)
+        finally:
+            await worker.close()
+            stop_server(server)
+    
+    def test_failed_write_is_not_acknowledged(self):
+        def fail(record):
+            raise OSError("disk full")
+        
+        state = StoreState(shards=2, save=fail)
+        row = ["ch_1", "order", 100, "USD", "cust", "card", "succeeded", 1.0]
+        reply = state.handle({"op": "put_charge", "args": {"row": row}})
+        assert reply["error"] == "storage"
+        assert "disk full" in reply["message"]
+        assert state.get_charge("ch_1") is None
+
+
+class TestStoreState:
+    """Tests for the server-side request handling"""
+    
+    def test_unknown_and_malformed_requests(self):
+        state = StoreState(shards=2)
+        assert state.handle({"op": "drop_everything"})["error"] == "bad_request"
+        assert state.handle({"op": "get_charge", "args": {}})["error"] == "bad_request"
+        assert state.handle({"op": "ping"}) == {"result": True}
+    
+    def test_scan_pages_through_log(self, monkeypatch):
+        monkeypatch.setattr("src.services.shared_store.SCAN_PAGE_SIZE", 2)
+        state = StoreState(shards=2)
+        for i in range(3):
+            state.put_charge([f"ch_{i}", "order", 100, "USD", "cust", "card", "succeeded", float(i)])
+        
+        page = state.scan("charges", 0, {"created_from": 1.0})
+        assert [cursor for cursor, _ in page["rows"]] == [2]
+        assert page["next"] == 2
+        page = state.scan("charges", page["next"], {})
+        assert [cursor for cursor, _ in page["rows"]] == [3]
+        assert page["next"] is None
@@ -0,0 +1,112 @@
+"""
+Tests for storage backends
+"""
+import asyncio
+import pytest
+import sqlite3
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.payment_processor import PaymentProcessor
+from src.services.records import ChargeRecord
+from src.services.storage import SQLiteStorage
+
+
+def make_charge(charge_id):
+    return ChargeRecord(
+        id=charge_id,
+        order_id="order-1",
+        amount_minor=100,
+        currency="USD",
+        customer_id="cust-1",
+        payment_method="card",
+        status="succeeded",
+        created_at=1704067200.0,
+    )
+
+
+class TestSQLiteStorage:
+    """Tests for the SQLite storage backend"""
+    
+    async def test_restart_restores_charges_and_indexes(self, tmp_path):
+        path = str(tmp_path / "payments.db")
+        processor = PaymentProcessor(storage=SQLiteStorage(path))
+        charge = await processor.charge(
+            order_id="order-1",
+            amount=25.0,
+            currency="USD",
+            customer_id="cust-1",
+            payment_method="card"
+        )
+        refund = await processor.refund(charge.id, amount=5.0)
+        await processor.close()
+        
+        restarted = PaymentProcessor(storage=SQLiteStorage(path))
+        assert await restarted.load() == 2
+        assert await restarted.get_charge(charge.id) == charge
+        assert await restarted.get_charges_by_order("order-1") == [charge]
+        assert await restarted.get_refunds_by_charge(charge.id) == [refund]
+        await restarted.close()
+    
+    async def test_concurrent_writes_share_commits(self, tmp_path):
+        storage = SQLiteStorage(str(tmp_path / "grouped.db"), group_commit=True)
+        processor = PaymentProcessor(storage=storage)
+        items = [
+            {
+                "order_id": f"order-{i}",
+                "amount": 1.0,
+                "currency": "USD",
+                "customer_id": "cust-1",
+                "payment_method": "card",
+            }
+            for i in range(200)
+        ]
+        await processor.charge_many(items, concurrency=50)
+        await processor.close()
+        
+        assert storage.writes == 200
+        assert storage.commits < 200
+    
+    async def test_per_write_commit(self, tmp_path):
+        storage = SQLiteStorage(str(tmp_path / "per_write.db"), group_commit=False)
+        processor = PaymentProcessor(storage=storage)
+        for i in range(5):
+            await processor.charge(f"order-{i}", 1.0, "USD", "cust-1", "card")
+        await processor.close()
+        assert storage.commits == 5
+    
+    async def test_failed_write_only_fails_its_caller(self, tmp_path):
+        storage = SQLiteStorage(str(tmp_path / "dupes.db"))
+        await storage.save_charge(make_charge("ch_dup"))
+        results = await asyncio.gather(
+            storage.save_charge(make_charge("ch_dup")),
+            storage.save_charge(make_charge("ch_ok")),
+            return_exceptions=True
+        )
+        await storage.close()
+        
+        assert isinstance(results[0], sqlite3.IntegrityError)
+        assert results[1] is None
+        assert [c.id for c in storage.iter_charges()] == ["ch_dup", "ch_ok"]
+    
+    async def test_outbox_is_kept_until_delivered(self, tmp_path):
+        path = str(tmp_path / "outbox.db")
+        storage = SQLiteStorage(path)
+        await storage.save_charge(make_charge("ch_before"))
+        assert storage.enable_outbox()
+        for charge_id in ("ch_1", "ch_2", "ch_3"):
+            await storage.save_charge(make_charge(charge_id))
+        await storage.mark_delivered(["ch_2"])
+        await storage.close()
+        
+        restarted = SQLiteStorage(path)
+        assert [c.id for c in restarted.iter_outbox()] == ["ch_1", "ch_3"]
+        await restarted.close()
+    
+    async def test_ping(self, tmp_path):
+        storage = SQLiteStorage(str(tmp_path / "ping.db"))
+        await storage.ping()
+        await storage.close()
+        with pytest.raises(RuntimeError):
+            await storage.ping()
@@ -6,10 +6,18 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
+from src.utils import validation
 from src.utils.validation import (
+    INVALID_AMOUNT,
+    INVALID_CURRENCY,
+    INVALID_PAYMENT_METHOD,
+    validate_batch,
+    validate_currencies,
     validate_order_total,
+    validate_order_totals,
     validate_currency,
-    validate_payment_method
+    validate_payment_method,
+    validate_payment_methods
 )
 
 
@@ -63,3 +71,55 @@ class TestValidatePaymentMethod:
     def test_invalid_methods(self):
         assert validate_payment_method("cash") is False
         assert validate_payment_method("bitcoin") is False
+
+
+@pytest.fixture(params=["numpy", "python"])
+def batch_backend(request, monkeypatch):
+    """Run batch tests with NumPy (if installed) and with the pure-Python fallback."""
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(validation, "np", None)
+    return request.param
+
+
+class TestBatchValidation:
+    """Tests for column-wise batch validation"""
+    
+    def test_order_totals_match_scalar(self, batch_backend):
+        totals = [100, 0, 999999, 0.01, -1, 1000001, float("nan"), "100", None, True]
+        assert list(validate_order_totals(totals)) == [validate_order_total(t) for t in totals]
+    
+    def test_numeric_column_fast_path(self, batch_backend):
+        assert list(validate_order_totals([1.5, -2.0, 3])) == [True, False, True]
+    
+    def test_currencies_and_methods_match_scalar(self, batch_backend):
+        currencies = ["USD", "usd", "", "JPY", None]
+        methods = ["card", "cash", "paypal", "", "google_pay"]
+        assert list(validate_currencies(currencies)) == [validate_currency(c) for c in currencies]
+        assert list(validate_payment_methods(methods)) == [validate_payment_method(m) for m in methods]
+    
+    def test_batch_error_flags(self, batch_backend):
+        flags = validate_batch(
+            [10.0, -1.0, 10.0, float("nan")],
+            currencies=["USD", "USD", "XXX", "XXX"],
+            methods=["card", "card", "card", "cash"]
+        )
+        assert list(flags) == [
+            0,
+            INVALID_AMOUNT,
+            INVALID_CURRENCY,
+            INVALID_AMOUNT | INVALID_CURRENCY | INVALID_PAYMENT_METHOD,
+        ]
+    
+    def test_batch_amounts_only(self, batch_backend):
+        assert list(validate_batch([5, "5"])) == [0, INVALID_AMOUNT]
+    
+    def test_batch_rejects_ragged_columns(self, batch_backend):
+        with pytest.raises(ValueError):
+            validate_batch([1.0, 2.0], currencies=["USD"])
+    
+    def test_numpy_string_array(self):
+        np = pytest.importorskip("numpy")
+        mask = validate_currencies(np.array(["USD", "XYZ", "EUR"]))
+        assert mask.tolist() == [True, False, True]
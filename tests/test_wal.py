@@ -0,0 +1,268 @@
+"""
+Tests for the write-ahead log storage backend
+"""
+import errno
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.payment_processor import PaymentProcessor
+from src.services.records import ChargeRecord, RefundRecord
+from src.services.wal import WALStorage, encode_frame
+
+
+def make_charge(i, **overrides):
+    fields = dict(
+        id=f"ch_{i:016x}",
+        order_id=f"order-{i}",
+        amount_minor=100 + i,
+        currency="USD",
+        customer_id="cust-1",
+        payment_method="card",
+        status="succeeded",
+        created_at=1704067200.0 + i,
+    )
+    fields.update(overrides)
+    return ChargeRecord(**fields)
+
+
+def make_refund(i, reason=None):
+    return RefundRecord(
+        id=f"re_{i:016x}",
+        charge_id=f"ch_{i:016x}",
+        amount_minor=50,
+        currency="USD",
+        reason=reason,
+        status="succeeded",
+        created_at=1704067300.0 + i,
+    )
+
+
+def segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("wal-"))
+
+
+def snapshots(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("snapshot-"))
+
+
+class TestWALStorage:
+    """Tests for logging, snapshots and recovery"""
+    
+    async def test_restart_restores_charges_and_indexes(self, tmp_path):
+        directory = str(tmp_path / "wal")
+        processor = PaymentProcessor(storage=WALStorage(directory))
+        charge = await processor.charge(
+            order_id="order-1",
+            amount=25.0,
+            currency="USD",
+            customer_id="cust-1",
+            payment_method="card"
+        )
+        refund = await processor.refund(charge.id, amount=5.0, reason="damaged")
+        await processor.close()
+        
+        restarted = PaymentProcessor(storage=WALStorage(directory))
+        assert await restarted.load() == 2
+        assert await restarted.get_charge(charge.id) == charge
+        assert await restarted.get_charges_by_order("order-1") == [charge]
+        assert await restarted.get_refunds_by_charge(charge.id) == [refund]
+        await restarted.close()
+    
+    async def test_concurrent_writes_share_fsyncs(self, tmp_path):
+        storage = WALStorage(str(tmp_path / "wal"))
+        processor = PaymentProcessor(storage=storage)
+        items = [
+            {
+                "order_id": f"order-{i}",
+                "amount": 1.0,
+                "currency": "USD",
+                "customer_id": "cust-1",
+                "payment_method": "card",
+            }
+            for i in range(200)
+        ]
+        await processor.charge_many(items, concurrency=50)
+        await processor.close()
+        
+        assert storage.writes == 200
+        assert storage.fsyncs < 200
+    
+    async def test_snapshot_replaces_segments(self, tmp_path):
+        directory = str(tmp_path / "wal")
+        storage = WALStorage(directory)
+        for i in range(3):
+            await storage.save_charge(make_charge(i))
+        await storage.save_refund(make_refund(0))
+        await storage.save_refund(make_refund(1, reason="duplicate"))
+        await storage.snapshot()
+        await storage.save_charge(make_charge(3))
+        await storage.close()
+        
+        assert snapshots(directory) == ["snapshot-00000002.bin"]
+        assert segments(directory) == ["wal-00000002.log"]
+        
+        restarted = WALStorage(directory)
+        assert list(restarted.iter_charges()) == [make_charge(i) for i in range(4)]
+        assert list(restarted.iter_refunds()) == [make_refund(0), make_refund(1, reason="duplicate")]
+        await restarted.close()
+    
+    async def test_segments_compact_automatically(self, tmp_path):
+        directory = str(tmp_path / "wal")
+        storage = WALStorage(directory, snapshot_every=10, max_batch=5)
+        for i in range(25):
+            await storage.save_charge(make_charge(i))
+        await storage.close()
+        
+        assert storage.snapshots >= 1
+        assert len(segments(directory)) < 3
+        restarted = WALStorage(directory)
+        assert list(restarted.iter_charges()) == [make_charge(i) for i in range(25)]
+        await restarted.close()
+    
+    async def test_outbox_survives_restart_and_compaction(self, tmp_path):
+        directory = str(tmp_path / "wal")
+        storage = WALStorage(directory)
+        await storage.save_charge(make_charge(0))
+        assert storage.enable_outbox()
+        for i in range(1, 4):
+            await storage.save_charge(make_charge(i))
+        await storage.save_refund(make_refund(1))
+        await storage.mark_delivered([make_charge(1).id])
+        await storage.snapshot()
+        await storage.save_charge(make_charge(4))
+        await storage.mark_delivered([make_charge(2).id, make_charge(4).id])
+        await storage.close()
+        
+        restarted = WALStorage(directory)
+        pending = [make_charge(3), make_refund(1)]
+        assert list(restarted.iter_outbox()) == pending
+        await restarted.snapshot()
+        assert list(restarted.iter_outbox()) == pending
+        # Flagged records are ordinary records to everything else
+        assert list(restarted.iter_charges()) == [make_charge(i) for i in range(5)]
+        await restarted.close()
+    
+    async def test_torn_tail_is_truncated(self, tmp_path):
+        directory = str(tmp_path / "wal")
+        storage = WALStorage(directory)
+        await storage.save_charge(make_charge(0))
+        await storage.save_charge(make_charge(1))
+        await storage.close()
+        
+        # A crash part-way through appending the third record
+        path = os.path.join(directory, "wal-00000001.log")
+        intact = os.path.getsize(path)
+        with open(path, "ab") as f:
+            f.write(encode_frame(make_charge(2))[:-3])
+        
+        restarted = WALStorage(directory)
+        assert os.path.getsize(path) == intact
+        await restarted.save_charge(make_charge(3))
+        assert list(restarted.iter_charges()) == [make_charge(0), make_charge(1), make_charge(3)]
+        await restarted.close()
+    
+    async def test_corrupt_record_ends_replay(self, tmp_path):
+        directory = str(tmp_path / "wal")
+        storage = WALStorage(directory)
+        await storage.save_charge(make_charge(0))
+        await storage.save_charge(make_charge(1))
+        await storage.close()
+        
+        path = os.path.join(directory, "wal-00000001.log")
+        with open(path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"X")
+        
+        restarted = WALStorage(directory)
+        assert list(restarted.iter_charges()) == [make_charge(0)]
+        await restarted.close()
+    
+    async def test_interrupted_compaction_is_discarded(self, tmp_path):
+        directory = str(tmp_path / "wal")
+        storage = WALStorage(directory)
+        await storage.save_charge(make_charge(0))
+        await storage.close()
+        with open(os.path.join(directory, "snapshot-00000002.bin.tmp"), "wb") as f:
+            f.write(b"partial")
+        
+        restarted = WALStorage(directory)
+        assert list(restarted.iter_charges()) == [make_charge(0)]
+        assert snapshots(directory) == []
+        await restarted.close()
+    
+    async def test_failed_fsync_is_not_recovered(self, tmp_path, monkeypatch):
+        directory = str(tmp_path / "wal")
+        storage = WALStorage(directory)
+        await storage.save_charge(make_charge(0))
+        
+        real_fsync = os.fsync
+        calls = []
+        
+        def fsync(fd):
+            calls.append(fd)
+            if len(calls) == 1:
+                raise OSError(errno.EIO, "Input/output error")
+            real_fsync(fd)
+        monkeypatch.setattr(os, "fsync", fsync)
+        with pytest.raises(OSError):
+            await storage.save_charge(make_charge(1))
+        monkeypatch.setattr(os, "fsync", real_fsync)
+        await storage.save_charge(make_charge(2))
+        await storage.close()
+        
+        restarted = WALStorage(directory)
+        assert list(restarted.iter_charges()) == [make_charge(0), make_charge(2)]
+        await restarted.close()
+    
+    async def test_partial_write_does_not_hide_later_records(self, tmp_path):
+        directory = str(tmp_path / "wal")
+        storage = WALStorage(directory)
+        await storage.save_charge(make_charge(0))
+        
+        class DiskFull:
+            def __init__(self, f):
+                self._f = f
+            
+            def write(self, data):
+                self._f.write(data[:10])
+                self._f.flush()
+                raise OSError(errno.ENOSPC, "No space left on device")
+            
+            def __getattr__(self, name):
+                return getattr(self._f, name)
+        
+        storage._segment = DiskFull(storage._segment)
+        with pytest.raises(OSError):
+            await storage.save_charge(make_charge(1))
+        await storage.save_charge(make_charge(2))
+        await storage.close()
+        
+        restarted = WALStorage(directory)
+        assert list(restarted.iter_charges()) == [make_charge(0), make_charge(2)]
+        await restarted.close()
+    
+    async def test_writer_stops_if_rollback_fails(self, tmp_path, monkeypatch):
+        storage = WALStorage(str(tmp_path / "wal"))
+        real_fsync = os.fsync
+        
+        def fsync(fd):
+            raise OSError(errno.EIO, "Input/output error")
+        monkeypatch.setattr(os, "fsync", fsync)
+        with pytest.raises(OSError):
+            await storage.save_charge(make_charge(0))
+        monkeypatch.setattr(os, "fsync", real_fsync)
+        
+        with pytest.raises(OSError):
+            await storage.save_charge(make_charge(1))
+        with pytest.raises(RuntimeError, match="failed"):
+            await storage.ping()
+        await storage.close()
+    
+    async def test_ping(self, tmp_path):
+        storage = WALStorage(str(tmp_path / "wal"))
+        await storage.ping()
+        await storage.close()
+        with pytest.raises(RuntimeError):
+            await storage.ping()
@@ -0,0 +1,267 @@
+"""
+Tests for payment event webhooks
+"""
+import asyncio
+import httpx
+import json
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.payment_processor import PaymentProcessor
+from src.services.records import ChargeRecord
+from src.services.storage import SQLiteStorage
+from src.services.wal import WALStorage
+from src.services.webhooks import CHARGE_SUCCEEDED, WebhookDispatcher
+
+
+def make_dispatcher(handler, endpoints=("http://hooks.test/a",), **kwargs) -> WebhookDispatcher:
+    kwargs.setdefault("backoff_base", 0)
+    return WebhookDispatcher(list(endpoints), transport=httpx.MockTransport(handler), **kwargs)
+
+
+def make_charge(i):
+    return ChargeRecord(
+        id=f"ch_{i:016x}",
+        order_id=f"order-{i}",
+        amount_minor=1000,
+        currency="USD",
+        customer_id="cust-1",
+        payment_method="card",
+        status="succeeded",
+        created_at=1704067200.0,
+    )
+
+
+async def wait_until(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.005)
+
+
+class TestWebhookDispatcher:
+    """Tests for batching, retries and in-flight limits"""
+    
+    async def test_events_are_batched(self):
+        batches = []
+        
+        def handler(request):
+            batches.append(json.loads(request.content)["events"])
+            return httpx.Response(200)
+        
+        dispatcher = make_dispatcher(handler, batch_size=10)
+        for i in range(25):
+            dispatcher.publish(CHARGE_SUCCEEDED, make_charge(i))
+        dispatcher.start()
+        await wait_until(lambda: dispatcher.delivered == 25)
+        await dispatcher.close()
+        
+        assert [len(batch) for batch in batches] == [10, 10, 5]
+        event = batches[0][0]
+        assert event["id"] == "evt_ch_0000000000000000"
+        assert event["type"] == "charge.succeeded"
+        assert event["data"]["amount"] == 10.0
+    
+    async def test_server_errors_are_retried(self):
+        attempts = 0
+        
+        def handler(request):
+            nonlocal attempts
+            attempts += 1
+            return httpx.Response(503 if attempts < 3 else 200)
+        
+        dispatcher = make_dispatcher(handler, max_retries=5)
+        dispatcher.start()
+        dispatcher.publish(CHARGE_SUCCEEDED, make_charge(0))
+        await wait_until(lambda: dispatcher.delivered == 1)
+        await dispatcher.close()
+        assert attempts == 3
+        assert not dispatcher.dead_letters
+    
+    async def test_rejected_batches_are_dead_lettered(self):
+        attempts = 0
+        
+        def handler(request):
+            nonlocal attempts
+            attempts += 1
+            return httpx.Response(400)
+        
+        dispatcher = make_dispatcher(handler, max_retries=5)
+        dispatcher.start()
+        dispatcher.publish(CHARGE_SUCCEEDED, make_charge(0))
+        await wait_until(lambda: dispatcher.dead_letters)
+        await dispatcher.close()
+        assert attempts == 1
+        url, events, error = dispatcher.dead_letters[0]
+        assert url == "http://hooks.test/a"
+        assert len(events) == 1
+        assert "400" in error
+    
+    async def test_retries_are_bounded(self):
+        dispatcher = make_dispatcher(lambda request: httpx.Response(500), max_retries=2)
+        dispatcher.start()
+        dispatcher.publish(CHARGE_SUCCEEDED, make_charge(0))
+        await wait_until(lambda: dispatcher.dead_letters)
+        await dispatcher.close()
+        assert dispatcher.delivered == 0
+    
+    async def test_in_flight_deliveries_are_capped(self):
+        in_flight = 0
+        peak = 0
+        
+        async def handler(request):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return httpx.Response(200)
+        
+        endpoints = [f"http://hooks.test/{i}" for i in range(4)]
+        dispatcher = make_dispatcher(handler, endpoints, batch_size=1, max_in_flight=3)
+        dispatcher.start()
+        for i in range(20):
+            dispatcher.publish(CHARGE_SUCCEEDED, make_charge(i))
+        await wait_until(lambda: dispatcher.delivered == 80)
+        await dispatcher.close()
+        assert peak == 3
+    
+    async def test_full_queues_hold_events_without_storage(self):
+        dispatcher = make_dispatcher(lambda request: httpx.Response(200), max_pending=3)
+        for i in range(5):
+            assert dispatcher.publish(CHARGE_SUCCEEDED, make_charge(i))
+        assert dispatcher.overflowed == 2
+        assert dispatcher.pending() == 5
+        dispatcher.start()
+        await dispatcher.close()
+        assert dispatcher.delivered == 5
+    
+    def test_built_before_the_event_loop(self):
+        # As at import time: no loop is running yet
+        dispatcher = make_dispatcher(
+            lambda request: httpx.Response(200),
+            ("http://hooks.test/a", "http://hooks.test/b"),
+            max_in_flight=1
+        )
+        
+        async def run():
+            dispatcher.start()
+            await asyncio.sleep(0.01)
+            for i in range(5):
+                dispatcher.publish(CHARGE_SUCCEEDED, make_charge(i))
+            await wait_until(lambda: dispatcher.delivered == 10)
+            await dispatcher.close()
+        
+        asyncio.run(run())
+    
+    async def test_close_drains_outbox(self):
+        dispatcher = make_dispatcher(lambda request: httpx.Response(200))
+        dispatcher.start()
+        for i in range(5):
+            dispatcher.publish(CHARGE_SUCCEEDED, make_charge(i))
+        await dispatcher.close()
+        assert dispatcher.delivered == 5
+
+
+class TestProcessorEvents:
+    """Tests for events published by PaymentProcessor"""
+    
+    async def test_charge_and_refund_publish_events(self):
+        received = []
+        
+        def handler(request):
+            received.extend(json.loads(request.content)["events"])
+            return httpx.Response(200)
+        
+        dispatcher = make_dispatcher(handler)
+        dispatcher.start()
+        processor = PaymentProcessor(webhooks=dispatcher)
+        charge = await processor.charge("order-1", 25.0, "USD", "cust-1", "card")
+        refund = await processor.refund(charge.id, amount=5.0)
+        await processor.close()
+        
+        # Batches to one endpoint may be in flight together, so order can vary
+        assert sorted((e["type"], e["data"]["id"]) for e in received) == [
+            ("charge.succeeded", charge.id),
+            ("refund.succeeded", refund.id),
+        ]
+    
+    async def test_slow_endpoint_does_not_delay_charges(self):
+        release = asyncio.Event()
+        
+        async def handler(request):
+            await release.wait()
+            return httpx.Response(200)
+        
+        dispatcher = make_dispatcher(handler)
+        dispatcher.start()
+        processor = PaymentProcessor(webhooks=dispatcher)
+        charges = await asyncio.wait_for(
+            asyncio.gather(*(
+                processor.charge(f"order-{i}", 1.0, "USD", "cust-1", "card") for i in range(10)
+            )),
+            timeout=1.0
+        )
+        assert len(charges) == 10
+        assert dispatcher.delivered == 0
+        release.set()
+        await processor.close()
+        assert dispatcher.delivered == 10
+
+
+class TestOutbox:
+    """Tests for events kept in the storage outbox"""
+    
+    async def test_undelivered_events_are_sent_after_restart(self, tmp_path):
+        path = str(tmp_path / "payments.db")
+        failing = make_dispatcher(lambda request: httpx.Response(503), max_retries=0)
+        failing.start()
+        processor = PaymentProcessor(storage=SQLiteStorage(path), webhooks=failing)
+        charge = await processor.charge("order-1", 25.0, "USD", "cust-1", "card")
+        refund = await processor.refund(charge.id, amount=5.0)
+        await wait_until(lambda: len(failing.dead_letters) == 2)
+        await processor.close()
+        
+        received = []
+        
+        def handler(request):
+            received.extend(json.loads(request.content)["events"])
+            return httpx.Response(200)
+        
+        storage = SQLiteStorage(path)
+        dispatcher = make_dispatcher(handler)
+        restarted = PaymentProcessor(storage=storage, webhooks=dispatcher)
+        await restarted.load()
+        dispatcher.start()
+        await wait_until(lambda: dispatcher.delivered == 2)
+        await restarted.close()
+        
+        assert sorted(e["id"] for e in received) == [f"evt_{charge.id}", f"evt_{refund.id}"]
+        assert list(SQLiteStorage(path).iter_outbox()) == []
+    
+    async def test_events_past_max_pending_wait_in_storage(self, tmp_path):
+        release = asyncio.Event()
+        received = []
+        
+        async def handler(request):
+            await release.wait()
+            received.extend(json.loads(request.content)["events"])
+            return httpx.Response(200)
+        
+        storage = WALStorage(str(tmp_path / "wal"))
+        dispatcher = make_dispatcher(handler, max_pending=2, batch_size=1)
+        dispatcher.start()
+        processor = PaymentProcessor(storage=storage, webhooks=dispatcher)
+        charges = [
+            await processor.charge(f"order-{i}", 1.0, "USD", "cust-1", "card") for i in range(6)
+        ]
+        assert dispatcher.overflowed == 4
+        assert dispatcher.pending() == 2
+        
+        release.set()
+        await wait_until(lambda: dispatcher.delivered == 6)
+        assert sorted(e["data"]["id"] for e in received) == sorted(c.id for c in charges)
+        await wait_until(lambda: not list(storage.iter_outbox()))
+        await processor.close()